@@ -10,8 +10,8 @@ import os
 import uuid
 
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
 from django.utils.encoding import force_str
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -19,10 +19,14 @@ from mptt.models import MPTTModel, TreeForeignKey
 
 from machina.apps.forum import signals
 from machina.conf import settings as machina_settings
+from machina.core.loading import get_class
 from machina.models import DatedModel
 from machina.models.fields import ExtendedImageField, MarkupTextField
 
 
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
+
+
 def get_forum_image_upload_to(instance, filename):
     """ Returns a valid upload path for an image file associated with a forum instance. """
     return instance.get_image_upload_to(filename)
@@ -89,6 +93,24 @@ class AbstractForum(MPTTModel, DatedModel):
     )
     last_post_on = models.DateTimeField(verbose_name=_('Last post added on'), blank=True, null=True)
 
+    # The 'subtree_*' fields contain values related to the topics/posts of the considered forum and
+    # of all its sub-forums. They are rolled up along the chain of ancestors of a forum each time
+    # its direct trackers are updated, so that the totals of a forum can be displayed without
+    # loading its sub-forums.
+    subtree_posts_count = models.PositiveIntegerField(
+        editable=False, blank=True, default=0, verbose_name=_('Number of posts with sub-forums'),
+    )
+    subtree_topics_count = models.PositiveIntegerField(
+        editable=False, blank=True, default=0, verbose_name=_('Number of topics with sub-forums'),
+    )
+    subtree_last_post = models.ForeignKey(
+        'forum_conversation.Post', editable=False, related_name='+', blank=True, null=True,
+        on_delete=models.SET_NULL, verbose_name=_('Last post with sub-forums'),
+    )
+    subtree_last_post_on = models.DateTimeField(
+        verbose_name=_('Last post with sub-forums added on'), blank=True, null=True,
+    )
+
     # Display options ; these fields can be used to alter the display of the forums in the list of
     # forums.
     display_sub_forum_list = models.BooleanField(
@@ -96,6 +118,22 @@ class AbstractForum(MPTTModel, DatedModel):
         help_text=_('Displays this forum on the legend of its parent-forum (sub forums list)'),
     )
 
+    # The names of the fields defining the structure of the tree of forums ; the snapshots of the
+    # tree of forums are invalidated when one of these fields is modified.
+    structural_fields = ('parent', 'type', 'name', 'link')
+
+    # The names of the fields written when the trackers of a forum are updated.
+    tracker_fields = (
+        'direct_posts_count', 'direct_topics_count', 'last_post', 'last_post_on',
+        'subtree_posts_count', 'subtree_topics_count', 'subtree_last_post', 'subtree_last_post_on',
+    )
+
+    # The attribute names of the trackers rolled up over the sub-forums of a forum.
+    subtree_trackers = (
+        'subtree_posts_count', 'subtree_topics_count', 'subtree_last_post_id',
+        'subtree_last_post_on',
+    )
+
     class Meta:
         abstract = True
         app_label = 'forum'
@@ -163,36 +201,197 @@ class AbstractForum(MPTTModel, DatedModel):
         # Update the slug field
         self.slug = slugify(force_str(self.name), allow_unicode=True)
 
+        # Only the creation of a forum or the modification of its place in the tree of forums
+        # should invalidate the snapshots of the tree (see the ``forum.receivers`` module).
+        self._structure_changed = old_instance is None or any(
+            getattr(old_instance, self._meta.get_field(name).attname) !=
+            getattr(self, self._meta.get_field(name).attname)
+            for name in self.structural_fields
+        )
+
         # Do the save
         super().save(*args, **kwargs)
 
         # If any change has been made to the forum parent, trigger the update of the counters
         if old_instance and old_instance.parent != self.parent:
             self.update_trackers()
+            # The totals of the previous ancestors should no longer include the forum
+            if old_instance.parent:
+                old_instance.parent.update_subtree_trackers()
             # Trigger the 'forum_moved' signal
             signals.forum_moved.send(sender=self, previous_parent=old_instance.parent)
 
     def update_trackers(self):
         """ Updates the denormalized trackers associated with the forum instance. """
+        if deferred_trackers.defer(self):
+            return
+
         direct_approved_topics = self.topics.filter(approved=True).order_by('-last_post_on')
 
         # Compute the direct topics count and the direct posts count.
-        self.direct_topics_count = direct_approved_topics.count()
-        self.direct_posts_count = direct_approved_topics.aggregate(
-            total_posts_count=Sum('posts_count'))['total_posts_count'] or 0
+        counts = direct_approved_topics.aggregate(
+            topics_count=Count('id'), posts_count=Sum('posts_count'),
+        )
+        self.direct_topics_count = counts['topics_count']
+        self.direct_posts_count = counts['posts_count'] or 0
 
         # Forces the forum's 'last_post' ID and 'last_post_on' date to the corresponding values
         # associated with the topic with the latest post.
-        if direct_approved_topics.exists():
-            self.last_post_id = direct_approved_topics[0].last_post_id
-            self.last_post_on = direct_approved_topics[0].last_post_on
-        else:
-            self.last_post_id = None
-            self.last_post_on = None
-
-        # Any save of a forum triggered from the update_tracker process will not result in checking
-        # for a change of the forum's parent.
-        self._simple_save()
+        self.last_post_id, self.last_post_on = direct_approved_topics \
+            .values_list('last_post_id', 'last_post_on').first() or (None, None)
+
+        with transaction.atomic():
+            # Rolls up the direct trackers over the ancestors of the forum.
+            self._roll_up_subtree_trackers()
+
+            # Any save of a forum triggered from the update_tracker process will not result in
+            # checking for a change of the forum's parent. Only the trackers are written so that
+            # the update date of the forum is left untouched.
+            self._simple_save(update_fields=self.tracker_fields)
+
+    def update_trackers_incrementally(self, topics_delta=0, posts_delta=0, last_post=None):
+        """ Applies deltas to the denormalized trackers associated with the forum instance.
+
+        The counters are incremented using ``F()`` expressions and the ``last_post`` of the forum is
+        only replaced if the given post is not older than the current one, using a single query. The
+        same deltas are applied to the subtree trackers of the forum and of its ancestors using a
+        second query.
+
+        """
+        values = {}
+        if topics_delta:
+            values['direct_topics_count'] = F('direct_topics_count') + topics_delta
+        if posts_delta:
+            values['direct_posts_count'] = F('direct_posts_count') + posts_delta
+        if last_post is not None:
+            is_latest = Q(last_post_on__isnull=True) | Q(last_post_on__lte=last_post.created)
+            values['last_post'] = Case(
+                When(is_latest, then=Value(last_post.pk)), default=F('last_post'),
+                output_field=models.IntegerField(),
+            )
+            values['last_post_on'] = Case(
+                When(is_latest, then=Value(last_post.created)), default=F('last_post_on'),
+            )
+        if values:
+            self.__class__._default_manager.filter(pk=self.pk).update(**values)
+
+        subtree_values = {}
+        if topics_delta:
+            subtree_values['subtree_topics_count'] = F('subtree_topics_count') + topics_delta
+        if posts_delta:
+            subtree_values['subtree_posts_count'] = F('subtree_posts_count') + posts_delta
+        if last_post is not None:
+            is_latest = (
+                Q(subtree_last_post_on__isnull=True) |
+                Q(subtree_last_post_on__lte=last_post.created)
+            )
+            subtree_values['subtree_last_post'] = Case(
+                When(is_latest, then=Value(last_post.pk)), default=F('subtree_last_post'),
+                output_field=models.IntegerField(),
+            )
+            subtree_values['subtree_last_post_on'] = Case(
+                When(is_latest, then=Value(last_post.created)), default=F('subtree_last_post_on'),
+            )
+        if subtree_values:
+            # The forum may have been moved since it was loaded: its position in the tree is
+            # refreshed so that the deltas are applied to its current ancestors.
+            self.refresh_from_db(fields=['tree_id', 'lft', 'rght'])
+            self.__class__._default_manager \
+                .filter(tree_id=self.tree_id, lft__lte=self.lft, rght__gte=self.rght) \
+                .update(**subtree_values)
+
+        self.refresh_from_db(fields=[
+            'direct_topics_count', 'direct_posts_count', 'last_post', 'last_post_on',
+            'subtree_topics_count', 'subtree_posts_count', 'subtree_last_post',
+            'subtree_last_post_on',
+        ])
+
+        # Trigger the 'forum_trackers_updated' signal
+        signals.forum_trackers_updated.send(sender=self)
+
+    def update_subtree_trackers(self):
+        """ Updates the trackers rolled up over the sub-forums of the forum and of its ancestors.
+
+        The direct trackers of the forum are not recomputed (see ``update_trackers``).
+
+        """
+        with transaction.atomic():
+            self._roll_up_subtree_trackers(refresh_direct_trackers=True)
+            self.__class__._default_manager.filter(pk=self.pk).update(
+                **{field: getattr(self, field) for field in self.subtree_trackers},
+            )
+
+        # Trigger the 'forum_trackers_updated' signal
+        signals.forum_trackers_updated.send(sender=self)
+
+    def _roll_up_subtree_trackers(self, refresh_direct_trackers=False):
+        """ Computes the subtree trackers of the forum and writes the ones of its ancestors.
+
+        The subtree trackers of a forum are computed from its direct trackers and from the subtree
+        trackers of its children, starting from the forum itself up to the top-level forum. The
+        subtree trackers of the forum instance are only set on the instance. The direct trackers of
+        the forum instance are used unless ``refresh_direct_trackers`` is set.
+
+        This method must be called inside a transaction: the rows of the forum and of its ancestors
+        are locked, from the top-level forum downwards, so that the concurrent roll-ups going
+        through the same ancestors are serialized.
+
+        """
+        chain = self._lock_ancestors()
+        ancestors = [forum for forum in chain if forum.pk != self.pk]
+        if refresh_direct_trackers:
+            locked_self = next(forum for forum in chain if forum.pk == self.pk)
+            for field in ('direct_posts_count', 'direct_topics_count', 'last_post_id',
+                          'last_post_on'):
+                setattr(self, field, getattr(locked_self, field))
+
+        chain_ids = [forum.pk for forum in chain]
+        children_trackers = {}
+        children = self.__class__._default_manager \
+            .filter(parent_id__in=chain_ids).exclude(pk__in=chain_ids) \
+            .values_list('parent_id', *self.subtree_trackers)
+        for parent_id, *trackers in children:
+            children_trackers.setdefault(parent_id, []).append(trackers)
+
+        rolled_up_trackers = None
+        for forum in [self] + ancestors[::-1]:
+            trackers = children_trackers.get(forum.pk, [])
+            if rolled_up_trackers is not None:
+                trackers.append(rolled_up_trackers)
+            last_posts = [(on, post_id) for _, _, post_id, on in trackers if on is not None]
+            if forum.last_post_on is not None:
+                last_posts.append((forum.last_post_on, forum.last_post_id))
+            # The last posts are only compared using their dates: their IDs can be None.
+            last_post_on, last_post_id = max(last_posts, key=lambda post: post[0]) \
+                if last_posts else (None, None)
+            rolled_up_trackers = (
+                forum.direct_posts_count + sum(t[0] for t in trackers),
+                forum.direct_topics_count + sum(t[1] for t in trackers),
+                last_post_id,
+                last_post_on,
+            )
+
+            values = dict(zip(self.subtree_trackers, rolled_up_trackers))
+            if forum is not self and any(getattr(forum, f) != v for f, v in values.items()):
+                self.__class__._default_manager.filter(pk=forum.pk).update(**values)
+            for field, value in values.items():
+                setattr(forum, field, value)
+
+    def _lock_ancestors(self):
+        """ Locks and returns the rows of the forum and of its ancestors, in tree order. """
+        while True:
+            chain = list(
+                self.get_ancestors(include_self=True).select_for_update().order_by('lft'),
+            )
+            locked_self = next((forum for forum in chain if forum.pk == self.pk), None)
+            if locked_self is not None and (
+                (locked_self.tree_id, locked_self.lft, locked_self.rght) ==
+                (self.tree_id, self.lft, self.rght)
+            ):
+                return chain
+            # The forum has been moved since it was loaded: its position in the tree is refreshed
+            # and the ancestors are locked again.
+            self.refresh_from_db(fields=['parent', 'tree_id', 'lft', 'rght', 'level'])
 
     def _simple_save(self, *args, **kwargs):
         """ Simple wrapper around the standard save method.
@@ -11,7 +11,7 @@ from collections import OrderedDict
 from django.contrib import admin
 from django.contrib.admin import helpers
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import AnonymousUser, Group
 from django.forms.forms import NON_FIELD_ERRORS
 from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect, render
@@ -36,6 +36,10 @@ PickUserForm = get_class('forum.forms', 'PickUserForm')
 
 PermissionConfig = get_class('forum_permission.defaults', 'PermissionConfig')
 
+ALL_AUTHENTICATED_USERS = get_class('forum_permission.shortcuts', 'ALL_AUTHENTICATED_USERS')
+copy_perms = get_class('forum_permission.shortcuts', 'copy_perms')
+set_perms = get_class('forum_permission.shortcuts', 'set_perms')
+
 
 class ForumAdmin(admin.ModelAdmin):
     """ The Forum model admin. """
@@ -307,7 +311,7 @@ class ForumAdmin(admin.ModelAdmin):
         context['forum'] = forum
         context['title'] = '{} - {}'.format(_('Forum permissions'), user)
         context['form'] = self._get_permissions_form(
-            request, UserForumPermission, {'forum': forum, 'user': user},
+            request, UserForumPermission, {'forum': forum, 'user': user}, user,
         )
 
         return render(request, self.editpermissions_user_view_template_name, context)
@@ -327,6 +331,7 @@ class ForumAdmin(admin.ModelAdmin):
         context['title'] = '{} - {}'.format(_('Forum permissions'), _('Anonymous user'))
         context['form'] = self._get_permissions_form(
             request, UserForumPermission, {'forum': forum, 'anonymous_user': True},
+            AnonymousUser(),
         )
 
         return render(request, self.editpermissions_anonymous_user_view_template_name, context)
@@ -346,6 +351,7 @@ class ForumAdmin(admin.ModelAdmin):
         context['title'] = '{} - {}'.format(_('Forum permissions'), _('Authenticated user'))
         context['form'] = self._get_permissions_form(
             request, UserForumPermission, {'forum': forum, 'authenticated_user': True},
+            ALL_AUTHENTICATED_USERS,
         )
 
         return render(request, self.editpermissions_authenticated_user_view_template_name, context)
@@ -365,12 +371,12 @@ class ForumAdmin(admin.ModelAdmin):
         context['forum'] = forum
         context['title'] = '{} - {}'.format(_('Forum permissions'), group)
         context['form'] = self._get_permissions_form(
-            request, GroupForumPermission, {'forum': forum, 'group': group},
+            request, GroupForumPermission, {'forum': forum, 'group': group}, group,
         )
 
         return render(request, self.editpermissions_group_view_template_name, context)
 
-    def _get_permissions_form(self, request, permission_model, filter_kwargs):
+    def _get_permissions_form(self, request, permission_model, filter_kwargs, target):
         # Fetch the permissions
         editable_permissions = sorted(
             ForumPermission.objects.all(), key=lambda p: p.name,
@@ -401,25 +407,14 @@ class ForumAdmin(admin.ModelAdmin):
         if request.method == 'POST':
             form = PermissionsForm(request.POST, permissions_dict=permissions_dict)
             if form.is_valid():
-                for codename, value in form.cleaned_data.items():
-                    try:
-                        perm = permission_model.objects.get(
-                            permission=permissions_dict[codename][0], **filter_kwargs
-                        )
-                    except permission_model.DoesNotExist:
-                        if value == PermissionsForm.PERM_NOT_SET:
-                            continue
-                        perm = permission_model.objects.create(
-                            permission=permissions_dict[codename][0], **filter_kwargs
-                        )
-
-                    if value == PermissionsForm.PERM_NOT_SET:
-                        perm.delete()
-                        continue
-
-                    perm.has_perm = (value == PermissionsForm.PERM_GRANTED)
-                    perm.save()
-
+                # All the permissions are applied at once.
+                set_perms(target, filter_kwargs['forum'], {
+                    codename: (
+                        None if value == PermissionsForm.PERM_NOT_SET
+                        else value == PermissionsForm.PERM_GRANTED
+                    )
+                    for codename, value in form.cleaned_data.items()
+                })
                 self.message_user(request, _('Permissions successfully applied'))
         else:
             form = PermissionsForm(permissions_dict=permissions_dict)
@@ -427,37 +422,7 @@ class ForumAdmin(admin.ModelAdmin):
         return form
 
     def _copy_forum_permissions(self, forum_from, forum_to):
-        user_perms = UserForumPermission.objects.filter(forum=forum_from)
-        group_perms = GroupForumPermission.objects.filter(forum=forum_from)
-
-        for perm in user_perms:
-            try:
-                new_perm = UserForumPermission.objects.get(
-                    permission=perm.permission, forum=forum_to,
-                    user=perm.user, anonymous_user=perm.anonymous_user,
-                )
-            except UserForumPermission.DoesNotExist:
-                new_perm = UserForumPermission(
-                    permission=perm.permission, forum=forum_to,
-                    user=perm.user, anonymous_user=perm.anonymous_user,
-                    authenticated_user=perm.authenticated_user
-                )
-            new_perm.has_perm = perm.has_perm
-            new_perm.save()
-
-        for perm in group_perms:
-            try:
-                new_perm = GroupForumPermission.objects.get(
-                    permission=perm.permission, forum=forum_to,
-                    group=perm.group,
-                )
-            except GroupForumPermission.DoesNotExist:
-                new_perm = GroupForumPermission(
-                    permission=perm.permission, forum=forum_to,
-                    group=perm.group,
-                )
-            new_perm.has_perm = perm.has_perm
-            new_perm.save()
+        copy_perms(forum_from, [forum_to])
 
 
 admin.site.register(Forum, ForumAdmin)
@@ -0,0 +1,92 @@
+"""
+    Forum counters
+    ==============
+
+    This module defines an abstraction allowing to increment counters stored in model fields (such
+    as the views count of topics or the redirects count of link forums). The increments can be
+    accumulated in a buffer stored in a Django cache and written to the database periodically as
+    one aggregated update per row (see the ``flush_counters`` management command).
+
+"""
+
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+
+from machina.conf import settings as machina_settings
+from machina.core.buffer import CacheBuffer
+
+
+class CounterBuffer(CacheBuffer):
+    """ The counter increments buffer.
+
+    The buffer is enabled only if the ``MACHINA_COUNTER_BUFFER_CACHE_NAME`` setting is set;
+    otherwise each increment is written to the database immediately. Each buffered increment is a
+    (model label, primary key, field name, delta) four-tuple. The buffer is flushed by the process
+    appending an increment once it holds ``MACHINA_COUNTER_BUFFER_FLUSH_SIZE`` increments or once
+    it has not been flushed for ``MACHINA_COUNTER_BUFFER_FLUSH_INTERVAL`` seconds, so that the
+    increments that can be lost if the cache is cleared are bounded ; such a flush writes at most
+    one batch of increments.
+
+    """
+
+    cache_name_setting = 'COUNTER_BUFFER_CACHE_NAME'
+    verbose_name = 'counter buffer'
+    key_prefix = 'machina:forum:counters'
+    flushed_at_key = 'machina:forum:counters:flushed_at'
+
+    def increment(self, instance, field, delta=1):
+        """ Increments the counter stored in the given field of a model instance. """
+        increment = (instance._meta.label_lower, instance.pk, field, delta)
+        backend = self.get_backend()
+        if backend is None:
+            self._apply([increment])
+            return
+
+        index = self._append(backend, increment)
+
+        state = backend.get_many([self.flushed_key, self.flushed_at_key])
+        if state.get(self.flushed_at_key) is None:
+            # The buffer was never flushed (or its state has been evicted): the interval starts now.
+            backend.add(self.flushed_at_key, time.time(), timeout=None)
+        elif (
+            index - state.get(self.flushed_key, 0) >= machina_settings.COUNTER_BUFFER_FLUSH_SIZE or
+            time.time() - state[self.flushed_at_key] >=
+            machina_settings.COUNTER_BUFFER_FLUSH_INTERVAL
+        ):
+            # The flushes performed in the request path are limited to a single batch. They are
+            # performed once the current transaction (if any) is committed, so that the increments
+            # can't be removed from the buffer by a flush that is rolled back afterwards.
+            transaction.on_commit(lambda: self.flush(
+                batch_size=machina_settings.COUNTER_BUFFER_FLUSH_SIZE, max_batches=1,
+            ))
+
+    def flush(self, batch_size=1000, max_batches=None):
+        """ Writes the buffered increments to the database.
+
+        The increments are processed by batches of ``batch_size`` increments (and at most
+        ``max_batches`` batches) and the increments of the same row are aggregated into a single
+        update. Returns the number of increments that have been flushed, or ``0`` if the buffer is
+        being flushed by another process.
+
+        """
+        count = super().flush(self._apply, batch_size=batch_size, max_batches=max_batches)
+        self.get_backend().set(self.flushed_at_key, time.time(), timeout=None)
+        return count
+
+    def _apply(self, increments):
+        """ Writes a list of increments to the database using one update per row. """
+        deltas = defaultdict(lambda: defaultdict(int))
+        for label, pk, field, delta in increments:
+            deltas[(label, pk)][field] += delta
+
+        for (label, pk), fields in sorted(deltas.items()):
+            apps.get_model(label)._default_manager.filter(pk=pk).update(
+                **{field: F(field) + delta for field, delta in fields.items()},
+            )
+
+
+counter_buffer = CounterBuffer()
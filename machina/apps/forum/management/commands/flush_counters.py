@@ -0,0 +1,33 @@
+"""
+    Flush counters command
+    ======================
+
+    This module defines a management command allowing to write the buffered counter increments to
+    the database.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from machina.core.loading import get_class
+
+
+counter_buffer = get_class('forum.counters', 'counter_buffer')
+
+
+class Command(BaseCommand):
+    help = 'Writes the buffered counter increments to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='The number of counter increments written at once.',
+        )
+
+    def handle(self, *args, **options):
+        if not counter_buffer.enabled:
+            raise CommandError('The counter buffer is not enabled')
+
+        count = counter_buffer.flush(batch_size=options['batch_size'])
+
+        self.stdout.write('{} counter increment(s) flushed'.format(count))
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def update_forum_subtree_trackers(apps, schema_editor):
+    Forum = apps.get_model('forum', 'Forum')
+    forums = list(Forum.objects.order_by('tree_id', '-lft'))
+    trackers = {}
+    # The children of a forum always come before it in reverse tree order.
+    for forum in forums:
+        posts_count, topics_count, last_posts = trackers.pop(forum.pk, (0, 0, []))
+        forum.subtree_posts_count = forum.direct_posts_count + posts_count
+        forum.subtree_topics_count = forum.direct_topics_count + topics_count
+        if forum.last_post_on is not None:
+            last_posts.append((forum.last_post_on, forum.last_post_id))
+        # The last posts are only compared by date: their IDs can be null.
+        forum.subtree_last_post_on, forum.subtree_last_post_id = \
+            max(last_posts, key=lambda post: post[0]) if last_posts else (None, None)
+        if forum.parent_id is not None:
+            parent_posts_count, parent_topics_count, parent_last_posts = \
+                trackers.get(forum.parent_id, (0, 0, []))
+            if forum.subtree_last_post_on is not None:
+                parent_last_posts.append((forum.subtree_last_post_on, forum.subtree_last_post_id))
+            trackers[forum.parent_id] = (
+                parent_posts_count + forum.subtree_posts_count,
+                parent_topics_count + forum.subtree_topics_count,
+                parent_last_posts,
+            )
+    Forum.objects.bulk_update(
+        forums,
+        [
+            'subtree_posts_count', 'subtree_topics_count', 'subtree_last_post',
+            'subtree_last_post_on',
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum_conversation', '0010_auto_20170120_0224'),
+        ('forum', '0011_auto_20190627_2132'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_last_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='forum_conversation.post', verbose_name='Last post with sub-forums'),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_last_post_on',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last post with sub-forums added on'),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_posts_count',
+            field=models.PositiveIntegerField(blank=True, default=0, editable=False, verbose_name='Number of posts with sub-forums'),
+        ),
+        migrations.AddField(
+            model_name='forum',
+            name='subtree_topics_count',
+            field=models.PositiveIntegerField(blank=True, default=0, editable=False, verbose_name='Number of topics with sub-forums'),
+        ),
+        migrations.RunPython(
+            update_forum_subtree_trackers, reverse_code=migrations.RunPython.noop),
+    ]
@@ -6,15 +6,61 @@
 
 """
 
-from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from mptt.signals import node_moved
 
-from machina.apps.forum.signals import forum_viewed
+from machina.apps.forum.signals import forum_moved, forum_viewed
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+
+
+Forum = get_model('forum', 'Forum')
+
+counter_buffer = get_class('forum.counters', 'counter_buffer')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
+forum_tree = get_class('forum.tree', 'forum_tree')
 
 
 @receiver(forum_viewed)
 def update_forum_redirects_counter(sender, forum, user, request, response, **kwargs):
     """ Handles the update of the link redirects counter associated with link forums. """
     if forum.is_link and forum.link_redirects:
-        forum.link_redirects_count = F('link_redirects_count') + 1
-        forum.save()
+        counter_buffer.increment(forum, 'link_redirects_count')
+
+
+@receiver(post_save, sender=Forum)
+def invalidate_forum_tree_on_save(sender, instance, created, update_fields=None, **kwargs):
+    """ Invalidates the snapshot of the tree of forums when a forum is created or restructured.
+
+    The saves that only write the trackers of a forum (posts counts, last post, ...) leave the
+    snapshot untouched: the trackers of the forums of the snapshot are not meant to be used.
+
+    """
+    if update_fields is not None and not set(update_fields) & set(instance.structural_fields):
+        return
+    if created or getattr(instance, '_structure_changed', True):
+        forum_tree.bump_version()
+
+
+@receiver(post_delete, sender=Forum)
+@receiver(node_moved, sender=Forum)
+@receiver(forum_moved)
+def invalidate_forum_tree(sender, **kwargs):
+    """ Invalidates the snapshot of the tree of forums when a forum is moved or deleted. """
+    forum_tree.bump_version()
+
+
+@receiver(post_delete, sender=Forum)
+def discard_deferred_forum_trackers(sender, instance, **kwargs):
+    """ Prevents the trackers of a deleted forum from being updated by a unit of work. """
+    deferred_trackers.discard(instance)
+
+
+@receiver(post_delete, sender=Forum)
+def update_parent_subtree_trackers(sender, instance, **kwargs):
+    """ Removes the trackers of a deleted forum from the totals of its ancestors. """
+    parent = Forum._default_manager.filter(pk=instance.parent_id).first() \
+        if instance.parent_id else None
+    if parent is not None:
+        parent.update_subtree_trackers()
@@ -11,5 +11,7 @@ import django.dispatch
 
 # Arguments:"previous_parent"
 forum_moved = django.dispatch.Signal()
+# Arguments: none
+forum_trackers_updated = django.dispatch.Signal()
 # Arguments:"forum", "user", "request", "response"
 forum_viewed = django.dispatch.Signal()
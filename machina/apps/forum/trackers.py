@@ -0,0 +1,95 @@
+"""
+    Forum trackers
+    ==============
+
+    This module defines a unit of work allowing to coalesce the updates of the denormalized trackers
+    of topics and forums (posts counts, last posts, ...). Inside a unit of work, the topics and the
+    forums whose trackers should be updated are only marked as dirty; each dirty object is then
+    updated exactly once when the unit of work ends.
+
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+
+
+class DeferredTrackers:
+    """ The trackers updates unit of work.
+
+    A unit of work is started using the ``atomic`` context manager, for example to wrap the
+    processing of a form or a bulk operation. Until the outermost ``atomic`` block ends, the
+    ``update_trackers`` methods of topics and forums only mark their instance as dirty. The dirty
+    topics are then updated before the dirty forums, so that the forums trackers are computed from
+    up-to-date topics trackers. The updates run in the transaction of the unit of work: the trackers
+    are committed along with the changes that made them dirty, or not at all. The topics and forums
+    deleted in the meantime are discarded by the ``post_delete`` signal receivers.
+
+    """
+
+    flush_order = ('forum_conversation.topic', 'forum.forum')
+
+    def __init__(self):
+        self._state = ContextVar('machina_deferred_trackers', default=None)
+
+    @property
+    def active(self):
+        """ Returns ``True`` if a unit of work is in progress. """
+        return self._state.get() is not None
+
+    @contextmanager
+    def atomic(self, using=None):
+        """ Starts a unit of work in which the trackers updates are deferred. """
+        if self.active:
+            # Nested units of work are merged into the outermost one.
+            yield
+            return
+
+        token = self._state.set({'dirty': {}, 'flushing': None})
+        try:
+            with transaction.atomic(using=using):
+                yield
+                self.flush()
+        finally:
+            self._state.reset(token)
+
+    def defer(self, instance):
+        """ Marks the trackers of a topic or forum instance as dirty.
+
+        Returns ``True`` if the update of the trackers is deferred, in which case the caller should
+        not update them; returns ``False`` if no unit of work is in progress or if the instance is
+        being updated by the unit of work itself.
+
+        """
+        state = self._state.get()
+        if state is None or instance.pk is None or state['flushing'] is instance:
+            return False
+        # The last instance marked as dirty is used to update the trackers, as it is the one that
+        # is the most likely to hold the other pending changes of the object (subject, ...).
+        state['dirty'].setdefault(instance._meta.label_lower, {})[instance.pk] = instance
+        return True
+
+    def discard(self, instance):
+        """ Unmarks the trackers of a topic or forum instance, for example once it is deleted. """
+        state = self._state.get()
+        if state is not None:
+            state['dirty'].get(instance._meta.label_lower, {}).pop(instance.pk, None)
+
+    def flush(self):
+        """ Updates the trackers of the dirty topics and forums. """
+        state = self._state.get()
+        while state['dirty']:
+            label = min(state['dirty'], key=self._get_flush_rank)
+            for _, instance in sorted(state['dirty'].pop(label).items()):
+                state['flushing'] = instance
+                try:
+                    instance.update_trackers()
+                finally:
+                    state['flushing'] = None
+
+    def _get_flush_rank(self, label):
+        return self.flush_order.index(label) if label in self.flush_order else len(self.flush_order)
+
+
+deferred_trackers = DeferredTrackers()
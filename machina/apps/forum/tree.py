@@ -0,0 +1,216 @@
+"""
+    Forum tree snapshot
+    ===================
+
+    This module defines an abstraction allowing to keep the whole tree of forums in process memory
+    (and optionally in a Django cache) so that it can be reused across requests until a forum is
+    created, moved, deleted or modified in a way that changes the tree of forums.
+
+"""
+
+import time
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import BigIntegerField, Count, F, Max, Sum
+from django.db.models.functions import Cast
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+
+
+Forum = get_model('forum', 'Forum')
+
+
+class ForumTree:
+    """ An immutable representation of the tree of forums.
+
+    The forums are ordered using their position in the tree (tree ID, then left value). The forum
+    instances of a tree are shared between all the consumers of the tree: they must not be
+    modified. The trackers of these forums (posts counts, last posts, ...) are not kept up-to-date:
+    they should be loaded from the database when needed.
+
+    """
+
+    def __init__(self, forums, version=None):
+        self.version = version
+        self.forums = tuple(sorted(forums, key=lambda f: (f.tree_id, f.lft)))
+
+        self._forums_by_id = {}
+        self._positions = {}
+        self._children = {}
+        self._ancestors = {}
+        top_nodes = []
+        for position, forum in enumerate(self.forums):
+            self._forums_by_id[forum.id] = forum
+            self._positions[forum.id] = position
+            self._children[forum.id] = []
+            # Parents always come before their children in tree order.
+            if forum.parent_id is None:
+                self._ancestors[forum.id] = ()
+                top_nodes.append(forum)
+            else:
+                parent = self._forums_by_id[forum.parent_id]
+                self._ancestors[forum.id] = self._ancestors[parent.id] + (parent, )
+                self._children[parent.id].append(forum)
+        self.top_nodes = tuple(top_nodes)
+
+    def __iter__(self):
+        return iter(self.forums)
+
+    def __len__(self):
+        return len(self.forums)
+
+    def __contains__(self, forum):
+        return getattr(forum, 'id', forum) in self._forums_by_id
+
+    def get_forum(self, forum_id):
+        """ Returns the forum associated with the given ID or ``None``. """
+        return self._forums_by_id.get(forum_id)
+
+    def get_children(self, forum):
+        """ Returns the direct children of the given forum. """
+        return tuple(self._children[forum.id])
+
+    def get_ancestors(self, forum, include_self=False):
+        """ Returns the ancestors of the given forum, from the top node to its parent. """
+        ancestors = self._ancestors[forum.id]
+        return ancestors + (self._forums_by_id[forum.id], ) if include_self else ancestors
+
+    def get_descendants(self, forum, include_self=False):
+        """ Returns the descendants of the given forum in tree order. """
+        forum = self._forums_by_id[forum.id]
+        position = self._positions[forum.id]
+        # A MPTT node has (rght - lft - 1) / 2 descendants which directly follow it in tree order.
+        end = position + 1 + (forum.rght - forum.lft - 1) // 2
+        return self.forums[position if include_self else position + 1:end]
+
+    def get_interval(self, forum):
+        """ Returns the (tree ID, left value, right value) interval of the given forum. """
+        forum = self._forums_by_id[forum.id]
+        return (forum.tree_id, forum.lft, forum.rght)
+
+
+class ForumTreeSnapshot:
+    """ The process-level snapshot of the tree of forums.
+
+    The snapshot is associated with a version. If the ``MACHINA_FORUM_TREE_CACHE_NAME`` setting is
+    set, the version is stored in the related cache and is bumped each time a forum is created,
+    moved, deleted or renamed (see the ``structural_fields`` of forums), which allows to invalidate
+    the snapshots of all the processes at once without performing any query ; the forums are also
+    stored in this cache. Otherwise the version is derived from the number of forums, from their
+    last update date and from a checksum of their positions in the tree using a single aggregate
+    query, so that the forums moved by other processes (which don't modify their update date) are
+    also taken into account. The update date of a forum is not modified by the updates of its
+    trackers, so that posting a message does not invalidate the snapshots.
+
+    """
+
+    version_key = 'machina:forum:tree:version'
+    key_prefix = 'machina:forum:tree'
+
+    def __init__(self):
+        self._local_version = 0
+        self._tree = None
+
+    def get_backend(self):
+        """ Returns the associated cache backend or ``None`` if no cache is configured. """
+        if not machina_settings.FORUM_TREE_CACHE_NAME:
+            return None
+        try:
+            cache = caches[machina_settings.FORUM_TREE_CACHE_NAME]
+        except InvalidCacheBackendError:
+            raise ImproperlyConfigured(
+                'The forum tree cache backend ({}) is not configured'.format(
+                    machina_settings.FORUM_TREE_CACHE_NAME,
+                ),
+            )
+        return cache
+
+    def get_version(self):
+        """ Returns the current version of the tree of forums. """
+        backend = self.get_backend()
+        if backend is not None:
+            version = backend.get(self.version_key)
+            if version is None:
+                # The initial version is derived from the current time so that trees stored before
+                # the eviction of the version key can't be returned again.
+                backend.add(self.version_key, int(time.time() * 1000), timeout=None)
+                version = backend.get(self.version_key)
+            return (version, self._local_version)
+        state = Forum.objects.order_by().aggregate(**self._get_state_aggregates())
+        return tuple(state[name] for name in sorted(state)) + (self._local_version, )
+
+    async def aget_version(self):
+        """ Asynchronous version of ``get_version``. """
+        backend = self.get_backend()
+        if backend is not None:
+            version = await backend.aget(self.version_key)
+            if version is None:
+                await backend.aadd(self.version_key, int(time.time() * 1000), timeout=None)
+                version = await backend.aget(self.version_key)
+            return (version, self._local_version)
+        state = await Forum.objects.order_by().aaggregate(**self._get_state_aggregates())
+        return tuple(state[name] for name in sorted(state)) + (self._local_version, )
+
+    def bump_version(self):
+        """ Increments the version ; the existing snapshots become stale. """
+        self._local_version += 1
+        self._tree = None
+        backend = self.get_backend()
+        if backend is not None:
+            self._bump_shared_version(backend)
+            # The version is bumped again once the transaction is committed so that a tree built by
+            # another process before the commit can't be used afterwards.
+            transaction.on_commit(lambda: self._bump_shared_version(backend))
+
+    def get(self):
+        """ Returns the current ``ForumTree`` ; a new one is built if the snapshot is stale. """
+        version = self.get_version()
+        tree = self._tree
+        if tree is None or tree.version != version:
+            backend = self.get_backend()
+            key = '{}:{}'.format(self.key_prefix, version[0])
+            forums = backend.get(key) if backend is not None else None
+            if forums is None:
+                forums = list(Forum.objects.all())
+                if backend is not None:
+                    backend.set(key, forums)
+            tree = self._tree = ForumTree(forums, version)
+        return tree
+
+    async def aget(self):
+        """ Asynchronous version of ``get``. """
+        version = await self.aget_version()
+        tree = self._tree
+        if tree is None or tree.version != version:
+            backend = self.get_backend()
+            key = '{}:{}'.format(self.key_prefix, version[0])
+            forums = await backend.aget(key) if backend is not None else None
+            if forums is None:
+                forums = [forum async for forum in Forum.objects.all()]
+                if backend is not None:
+                    await backend.aset(key, forums)
+            tree = self._tree = ForumTree(forums, version)
+        return tree
+
+    def _get_state_aggregates(self):
+        # The MPTT fields of the forums are modified by moves without modifying their update date:
+        # the sums of these fields weighted by the IDs of the forums change if a forum is moved.
+        forum_id = Cast('id', BigIntegerField())
+        return {
+            'count': Count('id'),
+            'updated': Max('updated'),
+            'positions': Sum(forum_id * F('lft')),
+            'trees': Sum(forum_id * F('tree_id')),
+        }
+
+    def _bump_shared_version(self, backend):
+        try:
+            backend.incr(self.version_key)
+        except ValueError:
+            backend.set(self.version_key, int(time.time() * 1000), timeout=None)
+
+
+forum_tree = ForumTreeSnapshot()
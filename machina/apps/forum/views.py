@@ -86,7 +86,7 @@ class ForumView(PermissionRequiredMixin, ListView):
             .exclude(approved=False)
             .select_related('poster', 'last_post', 'last_post__poster')
         )
-        return qs
+        return TrackingHandler(self.request).annotate_unread_topics(qs, self.request.user)
 
     def get_controlled_object(self):
         """ Returns the controlled object. """
@@ -107,14 +107,18 @@ class ForumView(PermissionRequiredMixin, ListView):
         )
 
         # The announces will be displayed on each page of the forum
+        tracking_handler = TrackingHandler(self.request)
         context['announces'] = list(
-            self.get_forum()
-            .topics.select_related('poster', 'last_post', 'last_post__poster')
-            .filter(type=Topic.TOPIC_ANNOUNCE)
+            tracking_handler.annotate_unread_topics(
+                self.get_forum()
+                .topics.select_related('poster', 'last_post', 'last_post__poster')
+                .filter(type=Topic.TOPIC_ANNOUNCE),
+                self.request.user,
+            )
         )
 
         # Determines the topics that have not been read by the current user
-        context['unread_topics'] = TrackingHandler(self.request).get_unread_topics(
+        context['unread_topics'] = tracking_handler.get_unread_topics(
             list(context[self.context_object_name]) + context['announces'], self.request.user,
         )
 
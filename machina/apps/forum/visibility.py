@@ -154,9 +154,30 @@ class ForumVisibilityContentNode:
         self.tree = None
         self.visible = False
 
+    @cached_property
+    def is_complete(self):
+        """ Returns ``True`` if all the sub-forums of the forum are descendants of the node.
+
+        The trackers rolled up over the sub-forums of a forum (``subtree_*`` fields) can only be
+        used in this case ; otherwise they would take into account sub-forums that are hidden from
+        the user.
+
+        """
+        return (self.obj.rght - self.obj.lft - 1) // 2 == self.descendants_count
+
+    @cached_property
+    def descendants_count(self):
+        """ Returns the number of descendants of the node. """
+        return sum(1 + n.descendants_count for n in self.children)
+
     @cached_property
     def last_post(self):
-        """ Returns the latest post associated with the node or one of its descendants. """
+        """ Returns the latest post associated with the node or one of its descendants.
+
+        The stored ``subtree_last_post`` of the forum is not used: the last posts of the descendants
+        are already loaded, which avoids joining the posts (and their posters) twice.
+
+        """
         posts = [n.last_post for n in self.children if n.last_post is not None]
         children_last_post = max(posts, key=lambda p: p.created) if posts else None
         if children_last_post and self.obj.last_post_id:
@@ -166,6 +187,8 @@ class ForumVisibilityContentNode:
     @cached_property
     def last_post_on(self):
         """ Returns the latest post date associated with the node or one of its descendants. """
+        if self.is_complete:
+            return self.obj.subtree_last_post_on
         dates = [n.last_post_on for n in self.children if n.last_post_on is not None]
         children_last_post_on = max(dates) if dates else None
         if children_last_post_on and self.obj.last_post_on:
@@ -196,6 +219,8 @@ class ForumVisibilityContentNode:
     @cached_property
     def posts_count(self):
         """ Returns the number of posts associated with the current node and its descendants. """
+        if self.is_complete:
+            return self.obj.subtree_posts_count
         return self.obj.direct_posts_count + sum(n.posts_count for n in self.children)
 
     @cached_property
@@ -222,4 +247,6 @@ class ForumVisibilityContentNode:
     @cached_property
     def topics_count(self):
         """ Returns the number of topics associated with the current node and its descendants. """
+        if self.is_complete:
+            return self.obj.subtree_topics_count
         return self.obj.direct_topics_count + sum(n.topics_count for n in self.children)
@@ -9,9 +9,10 @@
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, F, Q, Value, When
 from django.utils.encoding import force_str
 from django.utils.text import slugify
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 from machina.conf import settings as machina_settings
@@ -23,6 +24,8 @@ from machina.models.fields import MarkupTextField
 
 ApprovedManager = get_class('forum_conversation.managers', 'ApprovedManager')
 
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
+
 
 class AbstractTopic(models.Model):
     """ Represents a forum topic. """
@@ -153,6 +156,12 @@ class AbstractTopic(models.Model):
             self._subscribers = list(self.subscribers.all())
         return user in self._subscribers
 
+    async def ahas_subscriber(self, user):
+        """ Asynchronous version of ``has_subscriber``. """
+        if not hasattr(self, '_subscribers'):
+            self._subscribers = [subscriber async for subscriber in self.subscribers.all()]
+        return user in self._subscribers
+
     def clean(self):
         """ Validates the topic instance. """
         super().clean()
@@ -204,6 +213,9 @@ class AbstractTopic(models.Model):
 
     def update_trackers(self):
         """ Updates the denormalized trackers associated with the topic instance. """
+        if deferred_trackers.defer(self):
+            return
+
         self.posts_count = self.posts.filter(approved=True).count()
         first_post = self.posts.all().order_by('created').first()
         last_post = self.posts.filter(approved=True).order_by('-created').first()
@@ -214,6 +226,74 @@ class AbstractTopic(models.Model):
         # Trigger the forum-level trackers update
         self.forum.update_trackers()
 
+    def update_trackers_for_post(self, post, created=False, was_approved=None):
+        """ Updates the denormalized trackers associated with the topic after a post is saved.
+
+        The common changes (creation of a post, or approval or disapproval of a post that is neither
+        the first nor the last post of the topic) are applied as deltas to the trackers of the topic
+        and of its forum, using a constant number of queries. The other changes trigger a full
+        recomputation of the trackers (see ``update_trackers``).
+
+        """
+        is_head = self.first_post_id is None if created else post.pk == self.first_post_id
+        posts_delta, last_post = 0, None
+        if created:
+            posts_delta, last_post = (1, post) if post.approved else (0, None)
+        elif was_approved is None:
+            return self.update_trackers()
+        elif was_approved != post.approved:
+            # The approval of the first post changes the approval of the topic itself.
+            if is_head or (post.pk == self.last_post_id and not post.approved):
+                return self.update_trackers()
+            posts_delta, last_post = (1, post) if post.approved else (-1, None)
+
+        self._update_trackers_incrementally(
+            first_post=post if is_head else None, posts_delta=posts_delta, last_post=last_post,
+            topics_delta=1 if created and is_head else 0,
+        )
+
+    def update_trackers_for_deleted_post(self, post_id, approved):
+        """ Updates the denormalized trackers associated with the topic after a post is deleted.
+
+        The deletion of a post that is neither the first nor the last post of the topic is applied
+        as deltas to the trackers of the topic and of its forum. The other deletions trigger a full
+        recomputation of the trackers (see ``update_trackers``).
+
+        """
+        if post_id in (self.first_post_id, self.last_post_id):
+            return self.update_trackers()
+        self._update_trackers_incrementally(posts_delta=-1 if approved else 0)
+
+    def _update_trackers_incrementally(
+            self, first_post=None, posts_delta=0, last_post=None, topics_delta=0):
+        values = {}
+        if first_post is not None:
+            values.update(first_post=first_post, subject=self.subject, approved=self.approved)
+        if posts_delta:
+            values['posts_count'] = F('posts_count') + posts_delta
+        if last_post is not None:
+            is_latest = Q(last_post_on__isnull=True) | Q(last_post_on__lte=last_post.created)
+            values['last_post'] = Case(
+                When(is_latest, then=Value(last_post.pk)), default=F('last_post'),
+                output_field=models.IntegerField(),
+            )
+            values['last_post_on'] = Case(
+                When(is_latest, then=Value(last_post.created)), default=F('last_post_on'),
+            )
+        if not values:
+            return
+        values['updated'] = now()
+        self.__class__._default_manager.filter(pk=self.pk).update(**values)
+        self.refresh_from_db(
+            fields=['posts_count', 'first_post', 'last_post', 'last_post_on', 'updated'],
+        )
+
+        # Trigger the forum-level trackers update
+        if self.approved and (posts_delta or last_post is not None):
+            self.forum.update_trackers_incrementally(
+                topics_delta=topics_delta, posts_delta=posts_delta, last_post=last_post,
+            )
+
 
 class AbstractPost(DatedModel):
     """ Represents a forum post. A forum post is always linked to a topic. """
@@ -324,6 +404,10 @@ class AbstractPost(DatedModel):
     def save(self, *args, **kwargs):
         """ Saves the post instance. """
         new_post = self.pk is None
+        was_approved = None
+        if not new_post and machina_settings.INCREMENTAL_TRACKERS:
+            was_approved = self.__class__._default_manager \
+                .filter(pk=self.pk).values_list('approved', flat=True).first()
         super().save(*args, **kwargs)
 
         # Ensures that the subject of the thread corresponds to the one associated
@@ -334,7 +418,10 @@ class AbstractPost(DatedModel):
                 self.topic.approved = self.approved
 
         # Trigger the topic-level trackers update
-        self.topic.update_trackers()
+        if machina_settings.INCREMENTAL_TRACKERS:
+            self.topic.update_trackers_for_post(self, created=new_post, was_approved=was_approved)
+        else:
+            self.topic.update_trackers()
 
     def delete(self, using=None):
         """ Deletes the post instance. """
@@ -343,5 +430,9 @@ class AbstractPost(DatedModel):
             # only if the considered post is the only post embedded in the topic
             self.topic.delete()
         else:
+            post_id = self.pk
             super(AbstractPost, self).delete(using)
-            self.topic.update_trackers()
+            if machina_settings.INCREMENTAL_TRACKERS:
+                self.topic.update_trackers_for_deleted_post(post_id, self.approved)
+            else:
+                self.topic.update_trackers()
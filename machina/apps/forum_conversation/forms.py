@@ -20,7 +20,7 @@ Post = get_model('forum_conversation', 'Post')
 Topic = get_model('forum_conversation', 'Topic')
 TopicPoll = get_model('forum_polls', 'TopicPoll')
 
-PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+get_permission_handler = get_class('forum_permission.registry', 'get_permission_handler')
 
 get_anonymous_user_forum_key = get_class(
     'forum_permission.shortcuts', 'get_anonymous_user_forum_key',
@@ -39,7 +39,7 @@ class PostForm(forms.ModelForm):
         self.forum = kwargs.pop('forum', None)
         self.topic = kwargs.pop('topic', None)
 
-        self.perm_handler = PermissionHandler()
+        self.perm_handler = get_permission_handler()
 
         super().__init__(*args, **kwargs)
 
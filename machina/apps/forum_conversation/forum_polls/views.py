@@ -26,6 +26,10 @@ TopicPollVoteForm = get_class('forum_polls.forms', 'TopicPollVoteForm')
 
 PermissionRequiredMixin = get_class('forum_permission.viewmixins', 'PermissionRequiredMixin')
 
+get_anonymous_user_forum_key = get_class(
+    'forum_permission.shortcuts', 'get_anonymous_user_forum_key',
+)
+
 
 class TopicPollVoteView(PermissionRequiredMixin, UpdateView):
     """ Allows to vote in polls. """
@@ -45,7 +49,7 @@ class TopicPollVoteView(PermissionRequiredMixin, UpdateView):
         user_kwargs = (
             {'voter': self.request.user}
             if self.request.user.is_authenticated
-            else {'anonymous_key': self.request.user.forum_key}
+            else {'anonymous_key': get_anonymous_user_forum_key(self.request.user)}
         )
 
         if self.object.user_changes:
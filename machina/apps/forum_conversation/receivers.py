@@ -6,13 +6,27 @@
 
 """
 
-from django.db.models import F
+from django.db.models.signals import post_delete
 from django.dispatch import receiver
 
 from machina.apps.forum_conversation.signals import topic_viewed
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+
+
+Topic = get_model('forum_conversation', 'Topic')
+
+counter_buffer = get_class('forum.counters', 'counter_buffer')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
 
 
 @receiver(topic_viewed)
 def update_topic_counter(sender, topic, user, request, response, **kwargs):
     """ Handles the update of the views counter associated with topics. """
-    topic.__class__._default_manager.filter(id=topic.id).update(views_count=F('views_count') + 1)
+    counter_buffer.increment(topic, 'views_count')
+
+
+@receiver(post_delete, sender=Topic)
+def discard_deferred_topic_trackers(sender, instance, **kwargs):
+    """ Prevents the trackers of a deleted topic from being updated by a unit of work. """
+    deferred_trackers.discard(instance)
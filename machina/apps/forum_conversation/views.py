@@ -34,6 +34,7 @@ TopicPollOptionFormset = get_class('forum_polls.forms', 'TopicPollOptionFormset'
 TopicPollVoteForm = get_class('forum_polls.forms', 'TopicPollVoteForm')
 
 attachments_cache = get_class('forum_attachments.cache', 'cache')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
 
 PermissionRequiredMixin = get_class('forum_permission.viewmixins', 'PermissionRequiredMixin')
 
@@ -113,8 +114,37 @@ class TopicView(PermissionRequiredMixin, ListView):
         except ObjectDoesNotExist:  # pragma: no cover
             pass
 
+        # Precomputes the permissions that are checked in the templates
+        context['precomputed_permissions'] = self.get_precomputed_permissions(
+            topic, context[self.context_object_name],
+        )
+
         return context
 
+    def get_precomputed_permissions(self, topic, posts):
+        """ Returns the permissions of the current user for the topic and the displayed posts.
+
+        The returned dictionary maps (permission method name, object) two-tuples to booleans. It is
+        used by the ``get_permission`` template tag in order to avoid performing each permission
+        check individually.
+
+        """
+        checks = [
+            ('can_add_post', topic),
+            ('can_subscribe_to_topic', topic),
+            ('can_unsubscribe_from_topic', topic),
+            ('can_lock_topics', topic.forum),
+            ('can_move_topics', topic.forum),
+            ('can_delete_topics', topic.forum),
+            ('can_update_topics_to_normal_topics', topic.forum),
+            ('can_update_topics_to_sticky_topics', topic.forum),
+            ('can_update_topics_to_announces', topic.forum),
+            ('can_download_files', topic.forum),
+        ]
+        for post in posts:
+            checks.extend([('can_edit_post', post), ('can_delete_post', post)])
+        return self.request.forum_permission_handler.get_permissions(checks, self.request.user)
+
     def send_signal(self, request, response, topic):
         """ Sends the signal associated with the view. """
         self.view_signal.send(
@@ -338,12 +368,14 @@ class BasePostFormView(FormView):
                 ),
             )
 
-        # This is not a preview ; the object is going to be saved
-        self.forum_post = post_form.save()
+        # This is not a preview ; the object is going to be saved. The trackers of the topic and of
+        # the forum are updated once all the objects have been saved.
+        with deferred_trackers.atomic():
+            self.forum_post = post_form.save()
 
-        if save_attachment_formset:
-            attachment_formset.post = self.forum_post
-            attachment_formset.save()
+            if save_attachment_formset:
+                attachment_formset.post = self.forum_post
+                attachment_formset.save()
 
         messages.success(self.request, self.success_message)
         if not self.forum_post.approved:
@@ -498,22 +530,23 @@ class BaseTopicFormView(BasePostFormView):
             kwargs['poll_options_validated']
         )
 
-        valid = super().form_valid(
-            post_form,
-            attachment_formset,
-            poll_option_formset=poll_option_formset, **kwargs
-        )
-
-        if save_poll_option_formset:
-            poll_option_formset.topic = self.forum_post.topic
-            poll_option_formset.save(
-                poll_question=post_form.cleaned_data.pop('poll_question', None),
-                poll_max_options=post_form.cleaned_data.pop('poll_max_options', None),
-                poll_duration=post_form.cleaned_data.pop('poll_duration', None),
-                poll_user_changes=post_form.cleaned_data.pop('poll_user_changes', None),
-                poll_hide_results=post_form.cleaned_data.pop('poll_hide_results', None),
+        with deferred_trackers.atomic():
+            valid = super().form_valid(
+                post_form,
+                attachment_formset,
+                poll_option_formset=poll_option_formset, **kwargs
             )
 
+            if save_poll_option_formset:
+                poll_option_formset.topic = self.forum_post.topic
+                poll_option_formset.save(
+                    poll_question=post_form.cleaned_data.pop('poll_question', None),
+                    poll_max_options=post_form.cleaned_data.pop('poll_max_options', None),
+                    poll_duration=post_form.cleaned_data.pop('poll_duration', None),
+                    poll_user_changes=post_form.cleaned_data.pop('poll_user_changes', None),
+                    poll_hide_results=post_form.cleaned_data.pop('poll_hide_results', None),
+                )
+
         return valid
 
     def form_invalid(self, post_form, attachment_formset, poll_option_formset, **kwargs):
@@ -760,6 +793,13 @@ class PostDeleteView(PermissionRequiredMixin, DeleteView):
         """ Returns the controlled object. """
         return self.get_object()
 
+    def post(self, request, *args, **kwargs):
+        """ Deletes the post and updates the related trackers once. """
+        # The deletion is performed by ``delete()`` or by ``form_valid()`` depending on the version
+        # of Django: the whole processing of the request is wrapped in the unit of work.
+        with deferred_trackers.atomic():
+            return super().post(request, *args, **kwargs)
+
     def get_success_url(self):
         """ Returns the URL to redirect the user to upon valid form processing. """
         messages.success(self.request, self.success_message)
@@ -30,6 +30,7 @@ Topic = get_model('forum_conversation', 'Topic')
 ForumProfileForm = get_class('forum_member.forms', 'ForumProfileForm')
 
 PermissionRequiredMixin = get_class('forum_permission.viewmixins', 'PermissionRequiredMixin')
+TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
 
 
 class UserPostsView(ListView):
@@ -233,8 +234,9 @@ class TopicSubscriptionListView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         """ Returns the list of items for this view. """
-        return (
+        return TrackingHandler(self.request).annotate_unread_topics(
             self.request.user.topic_subscriptions
             .select_related('forum', 'poster', 'last_post', 'last_post__poster')
-            .all()
+            .all(),
+            self.request.user,
         )
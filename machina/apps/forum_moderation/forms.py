@@ -16,7 +16,7 @@ from machina.forms.widgets import SelectWithDisabled
 
 Forum = get_model('forum', 'Forum')
 
-PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+get_permission_handler = get_class('forum_permission.registry', 'get_permission_handler')
 
 
 class TopicMoveForm(forms.Form):
@@ -28,7 +28,7 @@ class TopicMoveForm(forms.Form):
     def __init__(self, *args, **kwargs):
         self.topic = kwargs.pop('topic', None)
         self.user = kwargs.pop('user', None)
-        self.perm_handler = PermissionHandler()
+        self.perm_handler = get_permission_handler()
 
         super().__init__(*args, **kwargs)
 
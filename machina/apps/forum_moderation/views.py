@@ -30,6 +30,8 @@ TopicMoveForm = get_class('forum_moderation.forms', 'TopicMoveForm')
 
 PermissionRequiredMixin = get_class('forum_permission.viewmixins', 'PermissionRequiredMixin')
 
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
+
 
 class TopicLockView(PermissionRequiredMixin, SingleObjectTemplateResponseMixin, BaseDetailView):
     """ Provides the ability to lock forum topics. """
@@ -144,6 +146,13 @@ class TopicDeleteView(PermissionRequiredMixin, DeleteView):
         context['forum'] = topic.forum
         return context
 
+    def post(self, request, *args, **kwargs):
+        """ Deletes the topic and updates the related trackers once. """
+        # The deletion is performed by ``delete()`` or by ``form_valid()`` depending on the version
+        # of Django: the whole processing of the request is wrapped in the unit of work.
+        with deferred_trackers.atomic():
+            return super().post(request, *args, **kwargs)
+
     def get_success_url(self):
         """ Returns the success URL to redirect the user to. """
         messages.success(self.request, self.success_message)
@@ -211,7 +220,9 @@ class TopicMoveView(
         else:
             topic.status = Topic.TOPIC_MOVED
 
-        topic.save()
+        # The trackers of the topic and of both forums are updated once the topic has been moved.
+        with deferred_trackers.atomic():
+            topic.save()
 
         messages.success(self.request, self.success_message)
         return HttpResponseRedirect(self.get_success_url())
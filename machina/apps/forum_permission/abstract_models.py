@@ -126,3 +126,39 @@ class AbstractGroupForumPermission(BaseAuthForumPermission):
         if self.forum:
             return '{} - {} - {}'.format(self.permission, self.group, self.forum)
         return '{} - {}'.format(self.permission, self.group)
+
+
+class AbstractGrantedForum(models.Model):
+    """ Represents a forum that is granted to a permission profile.
+
+    Granted forums are materialized by the ``PermissionHandler`` when the
+    ``MACHINA_PERMISSION_QUERYSET_MODE`` setting is enabled so that the forums granted to a user can
+    be used as a subquery. A permission profile identifies users sharing the same permission
+    fingerprint for a list of permission codenames and a permission generation. Each profile also
+    comes with a row without forum indicating that its granted forums have been materialized. The
+    granted forums of a profile can be materialized concurrently by several processes: the unique
+    constraints ensure that the rows are only created once.
+
+    """
+
+    profile_key = models.CharField(max_length=32, verbose_name=_('Profile key'), db_index=True)
+    generation = models.BigIntegerField(verbose_name=_('Permission generation'), db_index=True)
+    forum = models.ForeignKey(
+        'forum.Forum', blank=True, null=True, on_delete=models.CASCADE, verbose_name=_('Forum'),
+    )
+
+    class Meta:
+        abstract = True
+        app_label = 'forum_permission'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['profile_key', 'generation'], condition=models.Q(forum__isnull=True),
+                name='%(app_label)s_%(class)s_unique_materialized_profile',
+            ),
+        ]
+        unique_together = ['profile_key', 'generation', 'forum', ]
+        verbose_name = _('Granted forum')
+        verbose_name_plural = _('Granted forums')
+
+    def __str__(self):
+        return '{} - {}'.format(self.profile_key, self.forum)
@@ -0,0 +1,260 @@
+"""
+    Forum permission audience
+    =========================
+
+    This module defines a ``ForumAudienceResolver`` abstraction that answers the reverse permission
+    question: which groups and users are granted a specific permission on a forum. The permissions
+    of the users are resolved using the ``PermissionResolutionEngine`` so that the same precedence
+    rules apply, but users sharing the same relevant permission rows are resolved only once.
+
+"""
+
+import heapq
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.db.models import Q
+
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+
+
+GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
+UserForumPermission = get_model('forum_permission', 'UserForumPermission')
+
+PermissionResolutionEngine = get_class('forum_permission.engine', 'PermissionResolutionEngine')
+
+
+# The permission bits of a (global granted, global non-granted, forum granted, forum non-granted)
+# combination of permission rows targeting the same principal.
+NO_BITS = (0, 0, 0, 0)
+
+
+class ForumAudience:
+    """ Describes the groups and users that are granted a permission on a forum.
+
+    The following attributes are available:
+
+        - ``anonymous_user``: whether the anonymous user is granted the permission
+        - ``authenticated_users``: whether the users that are not targeted by any specific
+          permission row (through their groups or themselves) are granted the permission
+        - ``granted_group_ids`` / ``denied_group_ids``: the IDs of the groups with specific
+          permission rows whose members are granted (or not) the permission - provided that they
+          are not targeted by other specific permission rows
+        - ``user_overrides``: a dictionary of user ID to the value of the permission rows that
+          explicitly target this user (forum-level rows take precedence over global ones)
+
+    """
+
+    def __init__(self, resolver, forum, codename, group_bits, user_bits, all_users_bits,
+                 anonymous_bits):
+        self.resolver = resolver
+        self.forum = forum
+        self.codename = codename
+        self._group_bits = group_bits
+        self._user_bits = user_bits
+        self._all_users_bits = all_users_bits
+        self._resolved = {}
+
+        self.anonymous_user = resolver.resolve(
+            codename, forum.id, anonymous_bits, NO_BITS, NO_BITS, anonymous=True,
+        )
+        self.authenticated_users = self._resolve(NO_BITS, NO_BITS)
+        self.granted_group_ids = frozenset(
+            gid for gid, bits in group_bits.items() if self._resolve(NO_BITS, bits)
+        )
+        self.denied_group_ids = frozenset(group_bits) - self.granted_group_ids
+        self.user_overrides = {
+            uid: bool(bits[2]) if bits[2] or bits[3] else bool(bits[0])
+            for uid, bits in user_bits.items()
+        }
+
+    def get_granted_groups(self):
+        """ Returns a queryset of the groups whose members are granted the permission.
+
+        Members of these groups can still be denied the permission by explicit user overrides or by
+        the permission rows of their other groups.
+
+        """
+        if self.authenticated_users:
+            return Group.objects.exclude(id__in=self.denied_group_ids)
+        return Group.objects.filter(id__in=self.granted_group_ids)
+
+    def iter_user_ids(self, users=None, chunk_size=2000):
+        """ Yields the IDs of the users who are granted the permission, in ascending order.
+
+        The ``users`` argument can be used to restrict the considered users (eg. the subscribers of
+        a topic). Only the users targeted by specific permission rows are resolved in memory: all
+        the other users share the same permission. As for the permission checker, inactive users
+        are never granted the permission while superusers are always granted it.
+
+        """
+        user_model = get_user_model()
+        users = users if users is not None else user_model._default_manager.all()
+        users = users.filter(is_active=True)
+        specific_results = self._get_specific_user_results()
+
+        if self.authenticated_users:
+            rows = users.order_by('pk').values_list('pk', 'is_superuser').iterator(
+                chunk_size=chunk_size,
+            )
+            for user_id, is_superuser in rows:
+                if is_superuser or specific_results.get(user_id, True):
+                    yield user_id
+        else:
+            superuser_ids = users.filter(is_superuser=True).order_by('pk').values_list(
+                'pk', flat=True,
+            ).iterator(chunk_size=chunk_size)
+            last_user_id = None
+            for user_id in heapq.merge(superuser_ids, self._iter_granted_user_ids(
+                    users, specific_results, chunk_size)):
+                if user_id != last_user_id:
+                    yield user_id
+                last_user_id = user_id
+
+    def _iter_granted_user_ids(self, users, specific_results, chunk_size):
+        """ Yields the IDs of the users granted the permission by specific rows, in order. """
+        candidate_ids = sorted(uid for uid, granted in specific_results.items() if granted)
+        for i in range(0, len(candidate_ids), chunk_size):
+            yield from (
+                users
+                .filter(pk__in=candidate_ids[i:i + chunk_size])
+                .order_by('pk')
+                .values_list('pk', flat=True)
+            )
+
+    def _get_specific_user_results(self):
+        """ Returns a dictionary of user ID to permission for the users with specific rows. """
+        user_model = get_user_model()
+        groups_field = user_model.groups.field
+        memberships = (
+            groups_field.remote_field.through.objects
+            .filter(**{
+                '{}__in'.format(groups_field.m2m_reverse_field_name()): list(self._group_bits),
+            })
+            .values_list(groups_field.m2m_field_name(), groups_field.m2m_reverse_field_name())
+        )
+
+        # The permission rows of all the groups of a user are combined.
+        user_group_bits = {}
+        for user_id, group_id in memberships.iterator():
+            bits = user_group_bits.get(user_id, NO_BITS)
+            user_group_bits[user_id] = tuple(
+                a | b for a, b in zip(bits, self._group_bits[group_id])
+            )
+
+        return {
+            user_id: self._resolve(
+                self._user_bits.get(user_id, NO_BITS), user_group_bits.get(user_id, NO_BITS),
+            )
+            for user_id in set(user_group_bits) | set(self._user_bits)
+        }
+
+    def _resolve(self, user_bits, group_bits):
+        key = (user_bits, group_bits)
+        if key not in self._resolved:
+            self._resolved[key] = self.resolver.resolve(
+                self.codename, self.forum.id, user_bits, group_bits, self._all_users_bits,
+            )
+        return self._resolved[key]
+
+
+class ForumAudienceResolver:
+    """ Computes the ``ForumAudience`` of forums for a given permission codename.
+
+    The permission rows related to the considered forums are loaded using two queries, regardless of
+    the number of forums.
+
+    """
+
+    def __init__(self):
+        self._engines = {}
+
+    def get_audience(self, forum, codename):
+        """ Returns the ``ForumAudience`` of the given forum for the given permission codename. """
+        return self.get_audiences([forum], codename)[forum]
+
+    def get_audiences(self, forums, codename):
+        """ Returns a dictionary of forum to ``ForumAudience`` for the given codename. """
+        forums = list(forums)
+        forum_filter = Q(forum__isnull=True) | Q(forum__in=forums)
+
+        group_rows = (
+            GroupForumPermission.objects
+            .filter(forum_filter, permission__codename=codename)
+            .values_list('group_id', 'forum_id', 'has_perm')
+        )
+        user_rows = (
+            UserForumPermission.objects
+            .filter(forum_filter, permission__codename=codename)
+            .values_list('user_id', 'anonymous_user', 'authenticated_user', 'forum_id', 'has_perm')
+        )
+
+        group_bits = {f.id: {} for f in forums}
+        user_bits = {f.id: {} for f in forums}
+        all_users_bits = {f.id: NO_BITS for f in forums}
+        anonymous_bits = {f.id: NO_BITS for f in forums}
+
+        for group_id, forum_id, has_perm in group_rows:
+            for fid in self._get_forum_ids(forum_id, group_bits):
+                group_bits[fid][group_id] = self._add_bit(
+                    group_bits[fid].get(group_id, NO_BITS), forum_id, has_perm,
+                )
+
+        for user_id, anonymous_user, authenticated_user, forum_id, has_perm in user_rows:
+            for fid in self._get_forum_ids(forum_id, user_bits):
+                if user_id is not None:
+                    user_bits[fid][user_id] = self._add_bit(
+                        user_bits[fid].get(user_id, NO_BITS), forum_id, has_perm,
+                    )
+                elif anonymous_user:
+                    anonymous_bits[fid] = self._add_bit(anonymous_bits[fid], forum_id, has_perm)
+                elif authenticated_user:
+                    all_users_bits[fid] = self._add_bit(all_users_bits[fid], forum_id, has_perm)
+
+        return {
+            f: ForumAudience(
+                self, f, codename, group_bits[f.id], user_bits[f.id], all_users_bits[f.id],
+                anonymous_bits[f.id],
+            )
+            for f in forums
+        }
+
+    def resolve(self, codename, forum_id, user_bits, group_bits, all_users_bits, anonymous=False):
+        """ Returns whether the given combination of permission rows grants the permission.
+
+        Each ``*_bits`` argument is a (global granted, global non-granted, forum granted, forum
+        non-granted) tuple of permission rows targeting the user itself, its groups and all the
+        authenticated users. The permission is resolved for an anonymous user if ``anonymous`` is
+        set.
+
+        """
+        engine = self._get_engine(codename, anonymous)
+        forum_masks = {
+            'user_global': list(user_bits[:2]),
+            'group_global': list(group_bits[:2]),
+            'all_users_global': list(all_users_bits[:2]),
+            'user_forums': {forum_id: list(user_bits[2:])},
+            'group_forums': {forum_id: list(group_bits[2:])},
+            'all_users_forums': {forum_id: list(all_users_bits[2:])},
+        }
+        return bool(engine.resolve(forum_masks, [forum_id])[0] & 1)
+
+    def _get_engine(self, codename, anonymous):
+        key = (codename, anonymous)
+        if key not in self._engines:
+            engine = PermissionResolutionEngine(
+                AnonymousUser() if anonymous else get_user_model()(),
+            )
+            # The considered permission is always associated with the first bit.
+            engine.get_bit(codename)
+            self._engines[key] = engine
+        return self._engines[key]
+
+    def _get_forum_ids(self, forum_id, forum_ids):
+        """ Returns the IDs of the forums that are targeted by a permission row. """
+        return forum_ids if forum_id is None else [forum_id]
+
+    def _add_bit(self, bits, forum_id, has_perm):
+        index = (0 if forum_id is None else 2) + (0 if has_perm else 1)
+        return tuple(1 if i == index else b for i, b in enumerate(bits))
@@ -0,0 +1,152 @@
+"""
+    Forum permission cache
+    ======================
+
+    This module defines an abstraction allowing to store resolved forum permissions in a Django
+    cache so that they can be shared across requests and processes.
+
+"""
+
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from machina.conf import settings as machina_settings
+
+
+class PermissionCache:
+    """ The permission cache.
+
+    The permission cache is enabled only if the ``MACHINA_PERMISSION_CACHE_NAME`` setting is set.
+    Each entry is keyed by the permission fingerprint of the considered users (see
+    ``ForumPermissionChecker.get_fingerprint``) and by a permission generation counter. This
+    counter is bumped each time a permission, a forum or a group membership is modified, and again
+    once the related transaction is committed, so that stale permissions are never returned once
+    the related write has been committed.
+
+    """
+
+    generation_key = 'machina:forum_permission:generation'
+    key_prefix = 'machina:forum_permission'
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get_backend(self):
+        """ Returns the associated cache backend or ``None`` if the cache is disabled. """
+        if not machina_settings.PERMISSION_CACHE_NAME:
+            return None
+        try:
+            cache = caches[machina_settings.PERMISSION_CACHE_NAME]
+        except InvalidCacheBackendError:
+            raise ImproperlyConfigured(
+                'The permission cache backend ({}) is not configured'.format(
+                    machina_settings.PERMISSION_CACHE_NAME,
+                ),
+            )
+        return cache
+
+    @property
+    def enabled(self):
+        """ Returns ``True`` if the permission cache is enabled. """
+        return bool(machina_settings.PERMISSION_CACHE_NAME)
+
+    def get_generation(self):
+        """ Returns the current permission generation. """
+        backend = self.get_backend()
+        generation = backend.get(self.generation_key)
+        if generation is None:
+            # The initial generation is derived from the current time so that entries computed
+            # before the eviction of the generation key can't be returned again.
+            backend.add(self.generation_key, int(time.time() * 1000), timeout=None)
+            generation = backend.get(self.generation_key)
+        return generation
+
+    async def aget_generation(self):
+        """ Asynchronous version of ``get_generation``. """
+        backend = self.get_backend()
+        generation = await backend.aget(self.generation_key)
+        if generation is None:
+            await backend.aadd(self.generation_key, int(time.time() * 1000), timeout=None)
+            generation = await backend.aget(self.generation_key)
+        return generation
+
+    def bump_generation(self):
+        """ Increments the permission generation ; all the existing entries become stale.
+
+        The generation is bumped immediately and again once the current transaction is committed:
+        the permissions resolved by another request before the commit are read from the rows that
+        were not modified yet, so that they must not be used afterwards.
+
+        """
+        if getattr(self._local, 'batch_depth', 0):
+            self._local.bump_pending = True
+            return
+        backend = self.get_backend()
+        if backend is None:
+            return
+        self._bump(backend)
+        transaction.on_commit(lambda: self._bump(backend))
+
+    @contextmanager
+    def batch(self):
+        """ Defers the generation bumps requested in the block.
+
+        The generation is bumped at most once, when the outermost block exits, and again once the
+        current transaction is committed. This allows to modify many permissions at once without
+        invalidating the cache for each of them.
+
+        """
+        depth = getattr(self._local, 'batch_depth', 0)
+        if not depth:
+            self._local.bump_pending = False
+        self._local.batch_depth = depth + 1
+        try:
+            yield
+        finally:
+            self._local.batch_depth = depth
+            if not depth and self._local.bump_pending:
+                self._local.bump_pending = False
+                self.bump_generation()
+
+    def _bump(self, backend):
+        try:
+            backend.incr(self.generation_key)
+        except ValueError:
+            backend.set(self.generation_key, int(time.time() * 1000), timeout=None)
+
+    def get_principal_key(self, fingerprint, generation=None):
+        """ Returns the cache key prefix associated with the given permission fingerprint. """
+        principal = '{}|{}'.format(
+            repr(fingerprint),
+            ','.join(machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS),
+        )
+        return '{}:{}:{}'.format(
+            self.key_prefix,
+            generation if generation is not None else self.get_generation(),
+            hashlib.md5(principal.encode('utf-8')).hexdigest(),
+        )
+
+    def get(self, key):
+        """ Returns the value associated with the given key. """
+        return self.get_backend().get(key)
+
+    def set(self, key, value):
+        """ Stores the given value using the configured timeout. """
+        self.get_backend().set(key, value, machina_settings.PERMISSION_CACHE_TIMEOUT)
+
+    async def aget(self, key):
+        """ Asynchronous version of ``get``. """
+        return await self.get_backend().aget(key)
+
+    async def aset(self, key, value):
+        """ Asynchronous version of ``set``. """
+        await self.get_backend().aset(key, value, machina_settings.PERMISSION_CACHE_TIMEOUT)
+
+
+cache = PermissionCache()
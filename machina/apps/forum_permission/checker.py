@@ -7,19 +7,22 @@
 
 """
 
-from collections import OrderedDict
-
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
 
-from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
+from machina.core.loading import get_class
 
 
 ForumPermission = get_model('forum_permission', 'ForumPermission')
-GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
 UserForumPermission = get_model('forum_permission', 'UserForumPermission')
 
+PermissionResolutionEngine = get_class(
+    'forum_permission.engine', 'PermissionResolutionEngine')
+
+anonymous_snapshot = get_class('forum_permission.snapshot', 'snapshot')
+permission_cache = get_class('forum_permission.cache', 'cache')
+
 
 class ForumPermissionChecker:
     """ The ForumPermissionChecker allows to check forum permissions on Forum instances. """
@@ -27,6 +30,9 @@ class ForumPermissionChecker:
     def __init__(self, user):
         self.user = user
         self._forum_perms_cache = {}
+        self._shared_perms = None
+        self._cache_key = None
+        self._fingerprint = None
 
     def has_perm(self, perm, forum):
         """ Checks if the considered user has given permission for the passed forum. """
@@ -38,6 +44,14 @@ class ForumPermissionChecker:
             return True
         return perm in self.get_perms(forum)
 
+    async def ahas_perm(self, perm, forum):
+        """ Asynchronous version of ``has_perm``. """
+        if not self.user.is_anonymous and not self.user.is_active:
+            return False
+        elif self.user and self.user.is_superuser:
+            return True
+        return perm in await self.aget_perms(forum)
+
     def get_perms(self, forum):
         """ Returns the list of permission codenames of all permissions for the given forum. """
         # An inactive user has no permissions.
@@ -54,13 +68,86 @@ class ForumPermissionChecker:
                 # The superuser has all the permissions.
                 permcodes = list(ForumPermission.objects.values_list('codename', flat=True))
             elif self.user:
-                perms = self.get_perms_for_forumlist([forum], None)
-                permcodes = perms[forum]
+                shared_perms = self.get_shared_perms()
+                if shared_perms is not None:
+                    permcodes = set(shared_perms.get(forum_identifier, shared_perms['global']))
+                else:
+                    perms = self.get_perms_for_forumlist([forum], None)
+                    permcodes = perms[forum]
+
+            self._forum_perms_cache[forum_identifier] = permcodes
+
+        return self._forum_perms_cache[forum_identifier]
+
+    async def aget_perms(self, forum):
+        """ Asynchronous version of ``get_perms``. """
+        if not self.user.is_anonymous and not self.user.is_active:
+            return []
+
+        forum_identifier = 'global' if forum is None else forum.id
+
+        if forum_identifier not in self._forum_perms_cache:
+            if self.user and self.user.is_superuser:
+                permcodes = [
+                    codename async for codename in
+                    ForumPermission.objects.values_list('codename', flat=True)
+                ]
+            elif self.user:
+                shared_perms = await self.aget_shared_perms()
+                if shared_perms is not None:
+                    permcodes = set(shared_perms.get(forum_identifier, shared_perms['global']))
+                else:
+                    perms = await self.aget_perms_for_forumlist([forum], None)
+                    permcodes = perms[forum]
 
             self._forum_perms_cache[forum_identifier] = permcodes
 
         return self._forum_perms_cache[forum_identifier]
 
+    def prefetch_perms(self, forums):
+        """ Resolves and caches the permissions of the given forums in a single pass.
+
+        This allows subsequent calls to ``get_perms`` or ``has_perm`` for these forums to be
+        performed without hitting the database.
+
+        """
+        if (not self.user.is_anonymous and not self.user.is_active) or self.user.is_superuser:
+            return
+        if self.get_shared_perms() is not None:
+            return
+
+        forum_ids = {f.id for f in forums if f is not None} - set(self._forum_perms_cache)
+        if not forum_ids:
+            return
+
+        engine = PermissionResolutionEngine(self.user)
+        for forum_id, mask in engine.get_independent_masks(forum_ids).items():
+            self._forum_perms_cache[forum_id if forum_id is not None else 'global'] = set(
+                engine.get_codenames(mask),
+            )
+
+    async def aprefetch_perms(self, forums):
+        """ Asynchronous version of ``prefetch_perms``.
+
+        Once the permissions of the given forums are prefetched, the synchronous ``get_perms`` and
+        ``has_perm`` methods can be used for these forums without performing any I/O.
+
+        """
+        if (not self.user.is_anonymous and not self.user.is_active) or self.user.is_superuser:
+            return
+        if await self.aget_shared_perms() is not None:
+            return
+
+        forum_ids = {f.id for f in forums if f is not None} - set(self._forum_perms_cache)
+        if not forum_ids:
+            return
+
+        engine = PermissionResolutionEngine(self.user)
+        for forum_id, mask in (await engine.aget_independent_masks(forum_ids)).items():
+            self._forum_perms_cache[forum_id if forum_id is not None else 'global'] = set(
+                engine.get_codenames(mask),
+            )
+
     def get_perms_for_forumlist(self, forums, perm_codenames=None):
         """
             Computes and returns a dictionary of [forum] to (set of permissions) for the user,
@@ -71,224 +158,156 @@ class ForumPermissionChecker:
             - forums to be a list of forum objects
             - perm_codenames to be a list of permission codes (strings) to look for or None
         """
-        globally_granted_all_users_perms = set()
-        globally_granted_group_perms, globally_nongranted_group_perms = set(), set()
+        engine = PermissionResolutionEngine(self.user)
+        return engine.get_perms_for_forumlist(forums, perm_codenames)
 
-        user_perms = (
-            UserForumPermission.objects.select_related()
-            .filter(Q(forum__isnull=True) | Q(forum__in=forums))
-        )
-        if perm_codenames:
-            user_perms = user_perms.filter(permission__codename__in=perm_codenames)
-
-        # Do some additional filtering on (type of) user
-        if self.user.is_anonymous:
-            user_perms = user_perms.filter(anonymous_user=True)
-            all_users_perms = None
-            group_perms = None
-        else:
-            two_types_user_perms = user_perms.filter(Q(authenticated_user=True) | Q(user=self.user))
-            all_users_perms = [p for p in two_types_user_perms if p.authenticated_user]
-            user_perms = [p for p in two_types_user_perms if p.user]
-            # Now get group permissions
-            user_model = get_user_model()
-            user_groups_related_name = user_model.groups.field.related_query_name()
-            group_perms = (
-                GroupForumPermission.objects.select_related()
-                .filter(**{'group__{}'.format(user_groups_related_name): self.user})
-                .filter(Q(forum__isnull=True) | Q(forum__in=forums))
-            )
-            if perm_codenames:
-                group_perms = group_perms.filter(permission__codename__in=perm_codenames)
+    async def aget_perms_for_forumlist(self, forums, perm_codenames=None):
+        """ Asynchronous version of ``get_perms_for_forumlist``. """
+        engine = PermissionResolutionEngine(self.user)
+        return await engine.aget_perms_for_forumlist(forums, perm_codenames)
 
-            # The following 3 lists can already be made outside of the loop over forums
-            # But only for non-anonymous users so we do it here
-            globally_granted_all_users_perms = list(
-                filter(lambda p: p.has_perm and p.forum_id is None, all_users_perms)
-            )
-            globally_granted_group_perms = list(
-                filter(lambda p: p.has_perm and p.forum_id is None, group_perms)
-            )
-            globally_nongranted_group_perms = list(
-                filter(lambda p: not p.has_perm and p.forum_id is None, group_perms)
-            )
+    def get_shared_perms(self):
+        """ Returns the permissions of the user that are shared across requests.
 
-        # Computes the list of permissions that are non-granted for all the forums.
-        globally_nongranted_user_perms = list(
-            filter(lambda p: not p.has_perm and p.forum_id is None, user_perms)
+        This returns a dictionary of forum ID to (set of permission codenames) that is stored in
+        the permission cache - or in the anonymous permission snapshot for the anonymous user - or
+        ``None`` if none of them can be used. The ``'global'`` key contains the permissions of the
+        forums that are not targeted by specific permissions.
+
+        """
+        if self._shared_perms is not None:
+            return self._shared_perms
+
+        snapshot = (
+            anonymous_snapshot.get()
+            if self.user.is_anonymous and anonymous_snapshot.enabled else None
         )
-        # Computes the list of permissions that are granted for all the forums.
-        globally_granted_user_perms = list(
-            filter(lambda p: p.has_perm and p.forum_id is None, user_perms)
+        if snapshot is not None and snapshot.perms is not None:
+            self._shared_perms = snapshot.perms
+            return self._shared_perms
+
+        if snapshot is None and not permission_cache.enabled:
+            return None
+
+        shared_perms = None
+        if permission_cache.enabled:
+            cache_key = '{}:perms'.format(self.get_cache_key())
+            shared_perms = permission_cache.get(cache_key)
+        if shared_perms is None:
+            engine = PermissionResolutionEngine(self.user)
+            shared_perms = {
+                forum_id if forum_id is not None else 'global': engine.get_codenames(mask)
+                for forum_id, mask in engine.get_independent_masks().items()
+            }
+            if permission_cache.enabled:
+                permission_cache.set(cache_key, shared_perms)
+
+        if snapshot is not None:
+            snapshot.perms = shared_perms
+        self._shared_perms = shared_perms
+        return shared_perms
+
+    async def aget_shared_perms(self):
+        """ Asynchronous version of ``get_shared_perms``. """
+        if self._shared_perms is not None:
+            return self._shared_perms
+
+        snapshot = (
+            await anonymous_snapshot.aget()
+            if self.user.is_anonymous and anonymous_snapshot.enabled else None
         )
-        globally_granted_user_permcodes = [
-            p.permission.codename for p in globally_granted_user_perms
-        ]
-        # If the considered user has no global permissions, the permissions defined by the
-        # DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS settings are used instead.
-        if self.user.is_authenticated and not globally_granted_user_permcodes:
-            globally_granted_user_permcodes = machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS  # noqa: E501
-
-        forum_to_permissions = OrderedDict()
-        for f in forums:
-            """
-            In every place that we check on f.id we first check if f is actually there
-            It might be None because some tests only try global permissions without forum
-            """
-            # (Re)set these variables for each loop
-            permcodes, granted_group_permcodes, granted_all_users_permcodes = set(), set(), set()
-
-            # ########## BLOCK FOR PERMS SPECIFIC TO ONE LOGGED IN USER ###########
-            per_forum_granted_user_perms = list(
-                filter(lambda p: p.has_perm and f and p.forum_id == f.id, user_perms)
-            )
-            per_forum_granted_user_permcodes = [
-                p.permission.codename for p in per_forum_granted_user_perms
-            ]
-            per_forum_nongranted_user_perms = list(
-                filter(lambda p: not p.has_perm and f and p.forum_id == f.id, user_perms)
+        if snapshot is not None and snapshot.perms is not None:
+            self._shared_perms = snapshot.perms
+            return self._shared_perms
+
+        if snapshot is None and not permission_cache.enabled:
+            return None
+
+        shared_perms = None
+        if permission_cache.enabled:
+            cache_key = '{}:perms'.format(await self.aget_cache_key())
+            shared_perms = await permission_cache.aget(cache_key)
+        if shared_perms is None:
+            engine = PermissionResolutionEngine(self.user)
+            shared_perms = {
+                forum_id if forum_id is not None else 'global': engine.get_codenames(mask)
+                for forum_id, mask in (await engine.aget_independent_masks()).items()
+            }
+            if permission_cache.enabled:
+                await permission_cache.aset(cache_key, shared_perms)
+
+        if snapshot is not None:
+            snapshot.perms = shared_perms
+        self._shared_perms = shared_perms
+        return shared_perms
+
+    def get_cache_key(self):
+        """ Returns the prefix of the permission cache keys associated with the user. """
+        if self._cache_key is None:
+            self._cache_key = permission_cache.get_principal_key(self.get_fingerprint())
+        return self._cache_key
+
+    async def aget_cache_key(self):
+        """ Asynchronous version of ``get_cache_key``. """
+        if self._cache_key is None:
+            self._cache_key = permission_cache.get_principal_key(
+                await self.aget_fingerprint(), await permission_cache.aget_generation(),
             )
-            per_forum_nongranted_user_permcodes = [
-                p.permission.codename for p in per_forum_nongranted_user_perms
-            ]
-
-            per_forum_granted_group_perms = []
-            per_forum_nongranted_group_perms = []
-            per_forum_nongranted_all_users_permcodes = []
-            # ########## BLOCK FOR PERMS SPECIFIC TO GROUPS OF LOGGED IN USER ###########
-            # If the user is a registered user, we have to check the permissions of its groups
-            # in order to determine the additional permissions they could have.
-            if not self.user.is_anonymous:
-                if group_perms:
-                    # A permission can be non-granted on user-forum level, and that takes
-                    # precedence over granted group permissions so we do not add those to the list.
-                    per_forum_granted_group_perms = list(
-                        filter(lambda p: p.has_perm and f and p.forum_id == f.id and
-                               p.permission_id not in
-                               [q.permission_id for q in per_forum_nongranted_user_perms],
-                               group_perms)
-                    )
-                    per_forum_granted_group_permcodes = [
-                        p.permission.codename for p in per_forum_granted_group_perms
-                    ]
-                    # A permission can be granted on user-forum level, and that takes precedence
-                    # over nongranted group permissions so we do not add those to the list.
-                    per_forum_nongranted_group_perms = list(
-                        filter(lambda p: not p.has_perm and f and p.forum_id == f.id and
-                               p.permission_id not in
-                               [q.permission_id for q in per_forum_granted_user_perms],
-                               group_perms)
-                    )
-
-                    # Filter the globally granted group perms to those that were:
-                    # - not set to non-granted on global-user level
-                    # - and not set to non-granted on forum-group level
-                    # - and not set to non-granted on forum-user level
-                    globally_granted_group_perms = list(
-                        filter(lambda p: p.has_perm and p.forum_id is None and
-                               p.permission_id not in
-                               [q.permission_id for q in globally_nongranted_user_perms] and
-                               p.permission_id not in
-                               [y.permission_id for y in per_forum_nongranted_group_perms] and
-                               p.permission_id not in
-                               [z.permission_id for z in per_forum_nongranted_user_perms],
-                               globally_granted_group_perms)
-                    )
-                    globally_granted_group_permcodes = [
-                        p.permission.codename for p in globally_granted_group_perms
-                    ]
-
-                    # Filter the globally non granted group perms to those that were:
-                    # - not set to granted on global- user level
-                    # - and not set to granted on forum-group level
-                    # - and not set to granted on forum-user level
-                    globally_nongranted_group_perms = list(
-                        filter(lambda p: not p.has_perm and p.forum_id is None and
-                               p.permission_id not in
-                               [q.permission_id for q in globally_granted_user_perms] and
-                               p.permission_id not in
-                               [y.permission_id for y in per_forum_granted_group_perms] and
-                               p.permission_id not in
-                               [z.permission_id for z in per_forum_granted_user_perms],
-                               globally_nongranted_group_perms)
-                    )
-                    granted_group_permcodes = set(globally_granted_group_permcodes +
-                                                  per_forum_granted_group_permcodes)
-
-                # ######### BLOCK FOR PERMS FOR EVERY LOGGED IN USER ##########
-                # A permission can be non-granted on user-forum or group-forum level, and
-                # that takes precedence over granted all_users permissions so we do not add
-                # those to the list.
-                per_forum_granted_all_users_perms = list(
-                    filter(lambda p: p.has_perm and f and p.forum_id == f.id and
-                           p.permission_id not in
-                           [q.permission_id for q in per_forum_nongranted_user_perms] and
-                           p.permission_id not in
-                           [z.permission_id for z in per_forum_nongranted_group_perms],
-                           all_users_perms)
-                )
-                per_forum_granted_all_users_permcodes = [
-                    p.permission.codename for p in per_forum_granted_all_users_perms
-                ]
+        return self._cache_key
+
+    def get_fingerprint(self):
+        """ Returns the permission fingerprint of the user.
+
+        The permissions of a user only depend on whether it is anonymous, on its groups and on the
+        permissions that target this specific user. Users sharing the same fingerprint are thus
+        granted the same permissions: the ID of the user is part of the fingerprint only if some
+        permissions target this user specifically.
 
-                # A permission can be granted on user-forum or group-forum level, and that takes
-                # precedence over nongranted all_user permissions so we do not add those to
-                # the list
-                per_forum_nongranted_all_users_perms = list(
-                    filter(lambda p: not p.has_perm and f and p.forum_id == f.id and
-                           p.permission_id not in
-                           [q.permission_id for q in per_forum_granted_user_perms] and
-                           p.permission_id not in
-                           [z.permission_id for z in per_forum_granted_group_perms],
-                           all_users_perms)
+        """
+        if self._fingerprint is None:
+            if self.user.is_anonymous:
+                self._fingerprint = ('anonymous', )
+            else:
+                self._fingerprint = self._get_fingerprint_from_rows(
+                    list(self._get_fingerprint_rows()),
                 )
-                per_forum_nongranted_all_users_permcodes = [
-                    p.permission.codename for p in per_forum_nongranted_all_users_perms
-                ]
-                # Filter the globally granted all users perms to those that were:
-                # - not set to non-granted on forum-all_user level
-                # - and not set to non-granted on global-user level
-                # - and not set to non-granted on global-group level
-                # - and not set to non-granted on forum-group level
-                # - and not set to non-granted on forum-user level
-                globally_granted_all_users_perms = list(
-                    filter(lambda p: p.has_perm and p.forum_id is None and
-                           p.permission_id not in
-                           [y.permission_id for y in per_forum_nongranted_all_users_perms] and
-                           p.permission_id not in
-                           [q.permission_id for q in globally_nongranted_user_perms] and
-                           p.permission_id not in
-                           [a.permission_id for a in globally_nongranted_group_perms] and
-                           p.permission_id not in
-                           [x.permission_id for x in per_forum_nongranted_group_perms] and
-                           p.permission_id not in
-                           [z.permission_id for z in per_forum_nongranted_user_perms],
-                           globally_granted_all_users_perms)
+        return self._fingerprint
+
+    async def aget_fingerprint(self):
+        """ Asynchronous version of ``get_fingerprint``. """
+        if self._fingerprint is None:
+            if self.user.is_anonymous:
+                self._fingerprint = ('anonymous', )
+            else:
+                self._fingerprint = self._get_fingerprint_from_rows(
+                    [row async for row in self._get_fingerprint_rows()],
                 )
-                globally_granted_all_users_permcodes = [
-                    p.permission.codename for p in globally_granted_all_users_perms
-                ]
-                granted_all_users_permcodes = set(globally_granted_all_users_permcodes +
-                                                  per_forum_granted_all_users_permcodes)
-
-            # Finally computes the list of permission codenames that are
-            # granted to the user for the considered forum.
-            # We can not do this earlier because
-            # globally_granted_user_perms can be from the setting
-            # DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS in which case
-            # it only contains permission codes and not actual permission
-            # objects that we can loop over and check against.
-            granted_user_permcodes = [
-                c for c in globally_granted_user_permcodes if
-                c not in per_forum_nongranted_user_permcodes and
-                c not in per_forum_nongranted_all_users_permcodes
-            ]
-            permcodes = set(granted_user_permcodes +
-                            per_forum_granted_user_permcodes)
-            # Includes the permissions granted for the user's groups and for all logged
-            # in users (that were not overruled by more specific targets) in the initial
-            # set of permission codenames.
-            forum_to_permissions[f] = permcodes.union(granted_group_permcodes,
-                                                      granted_all_users_permcodes)
-
-        return forum_to_permissions
+        return self._fingerprint
+
+    def share_perms_with(self, checker):
+        """ Makes the checker reuse the permissions resolved by another checker.
+
+        The other checker must be associated with a user having the same permission fingerprint.
+
+        """
+        self._forum_perms_cache = checker._forum_perms_cache
+        self._fingerprint = checker._fingerprint
+        self._cache_key = checker._cache_key
+        self._shared_perms = checker._shared_perms
+
+    def _get_fingerprint_rows(self):
+        return (
+            get_user_model().objects
+            .filter(pk=self.user.pk)
+            .annotate(
+                has_user_perms=Exists(
+                    UserForumPermission.objects.filter(user_id=OuterRef('pk')),
+                ),
+            )
+            .values_list('groups__id', 'has_user_perms')
+        )
+
+    def _get_fingerprint_from_rows(self, rows):
+        group_ids = tuple(sorted(group_id for group_id, _ in rows if group_id is not None))
+        has_user_perms = rows[0][1] if rows else False
+        return ('authenticated', group_ids, self.user.id if has_user_perms else None)
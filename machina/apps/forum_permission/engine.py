@@ -0,0 +1,293 @@
+"""
+    Forum permission resolution engine
+    ==================================
+
+    This module defines a ``PermissionResolutionEngine`` abstraction that computes the permissions
+    granted to a user for a list of forums. Permission rows are loaded once and each permission
+    codename is mapped to a bit position so that the precedence rules can be resolved using integer
+    bit operations for each forum.
+
+"""
+
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q, QuerySet
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+
+
+GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
+UserForumPermission = get_model('forum_permission', 'UserForumPermission')
+
+
+class PermissionResolutionEngine:
+    """ Resolves the permissions of a user for a list of forums.
+
+    The precedence rules that are applied are the following ones:
+
+        - forum > global
+        - user > group > all_authenticated_users
+
+    Each permission codename is associated with a bit. The permission rows of the considered user
+    are indexed into (granted, non-granted) bitmasks per target (user, groups, all authenticated
+    users) and per forum, which allows to compute the set of granted permissions of each forum using
+    a constant number of integer operations.
+
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._codename_bits = {}
+        self._codenames = []
+        self._mask_codenames_cache = {}
+
+    def get_bit(self, codename):
+        """ Returns the bit associated with the given permission codename. """
+        bit = self._codename_bits.get(codename)
+        if bit is None:
+            bit = self._codename_bits[codename] = 1 << len(self._codenames)
+            self._codenames.append(codename)
+        return bit
+
+    def get_mask(self, codenames):
+        """ Returns the bitmask corresponding to the given permission codenames. """
+        mask = 0
+        for codename in codenames:
+            mask |= self.get_bit(codename)
+        return mask
+
+    def get_codenames(self, mask):
+        """ Returns the set of permission codenames corresponding to the given bitmask. """
+        codenames = self._mask_codenames_cache.get(mask)
+        if codenames is None:
+            codenames = frozenset(
+                codename for i, codename in enumerate(self._codenames) if mask & (1 << i)
+            )
+            self._mask_codenames_cache[mask] = codenames
+        return codenames
+
+    def get_perms_for_forumlist(self, forums, perm_codenames=None):
+        """ Returns a dictionary of [forum] to (set of permission codenames) for the user. """
+        return OrderedDict(
+            (forum, set(self.get_codenames(mask)))
+            for forum, mask in self.get_masks_for_forumlist(forums, perm_codenames)
+        )
+
+    async def aget_perms_for_forumlist(self, forums, perm_codenames=None):
+        """ Asynchronous version of ``get_perms_for_forumlist``. """
+        return OrderedDict(
+            (forum, set(self.get_codenames(mask)))
+            for forum, mask in await self.aget_masks_for_forumlist(forums, perm_codenames)
+        )
+
+    def get_masks_for_forumlist(self, forums, perm_codenames=None):
+        """ Returns a list of (forum, bitmask of granted permissions) two-tuples for the user. """
+        forums = list(forums)
+        forum_masks = self.index_permission_rows(
+            self._get_permission_rows(forums, perm_codenames))
+        return self._get_forumlist_masks(forums, forum_masks)
+
+    async def aget_masks_for_forumlist(self, forums, perm_codenames=None):
+        """ Asynchronous version of ``get_masks_for_forumlist``. """
+        forums = list(forums)
+        forum_masks = self.index_permission_rows(
+            await self._aget_permission_rows(forums, perm_codenames))
+        return self._get_forumlist_masks(forums, forum_masks)
+
+    def get_independent_masks(self, forum_ids=None, perm_codenames=None):
+        """ Returns a dictionary of forum ID to bitmask of granted permissions for the user.
+
+        Unlike ``get_masks_for_forumlist``, each forum is resolved as if it was the only forum of
+        the list, which is what ``ForumPermissionChecker.get_perms`` does. The ``None`` key
+        contains the global permissions. If ``forum_ids`` is not specified, only the forums that are
+        targeted by specific permission rows are included: all the other forums share the
+        permissions of the ``None`` key.
+
+        """
+        forum_masks = self.index_permission_rows(
+            self._get_permission_rows(forum_ids, perm_codenames))
+        return self._get_independent_masks(forum_masks, forum_ids)
+
+    async def aget_independent_masks(self, forum_ids=None, perm_codenames=None):
+        """ Asynchronous version of ``get_independent_masks``. """
+        forum_masks = self.index_permission_rows(
+            await self._aget_permission_rows(forum_ids, perm_codenames))
+        return self._get_independent_masks(forum_masks, forum_ids)
+
+    def index_permission_rows(self, rows):
+        """ Indexes the given permission rows into bitmasks.
+
+        The returned dictionary contains global (granted, non-granted) masks and per-forum
+        {forum ID: [granted, non-granted]} masks for the user itself, its groups and all the
+        authenticated users.
+
+        """
+        is_anonymous = self.user.is_anonymous
+        user_global, group_global, all_users_global = [0, 0], [0, 0], [0, 0]
+        user_forums, group_forums, all_users_forums = {}, {}, {}
+
+        for codename, forum_id, has_perm, user_id, authenticated_user in rows['user']:
+            bit = self.get_bit(codename)
+            index = 0 if has_perm else 1
+            targets = []
+            if is_anonymous or user_id is not None:
+                targets.append((user_global, user_forums))
+            if not is_anonymous and authenticated_user:
+                targets.append((all_users_global, all_users_forums))
+            for global_masks, forum_masks in targets:
+                if forum_id is None:
+                    global_masks[index] |= bit
+                else:
+                    forum_masks.setdefault(forum_id, [0, 0])[index] |= bit
+
+        for codename, forum_id, has_perm in rows['group']:
+            bit = self.get_bit(codename)
+            index = 0 if has_perm else 1
+            if forum_id is None:
+                group_global[index] |= bit
+            else:
+                group_forums.setdefault(forum_id, [0, 0])[index] |= bit
+
+        return {
+            'user_global': user_global,
+            'group_global': group_global,
+            'all_users_global': all_users_global,
+            'user_forums': user_forums,
+            'group_forums': group_forums,
+            'all_users_forums': all_users_forums,
+        }
+
+    def resolve(self, forum_masks, forum_ids):
+        """ Returns the list of bitmasks of granted permissions for the given list of forum IDs.
+
+        A ``None`` forum ID can be used in order to compute the global permissions.
+
+        """
+        is_anonymous = self.user.is_anonymous
+        user_forums = forum_masks['user_forums']
+        group_forums = forum_masks['group_forums']
+        all_users_forums = forum_masks['all_users_forums']
+        user_global_granted, user_global_nongranted = forum_masks['user_global']
+
+        # If the considered user has no global permissions, the permissions defined by the
+        # DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS settings are used instead.
+        user_global_granted_or_default = user_global_granted
+        if self.user.is_authenticated and not user_global_granted:
+            user_global_granted_or_default = self.get_mask(
+                machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS)
+
+        # The global group and all-users masks are narrowed by the overrides of each forum and
+        # remain narrowed for the subsequent forums of the list. This is consistent with how these
+        # permissions have always been resolved by the ForumPermissionChecker.
+        group_global_granted, group_global_nongranted = forum_masks['group_global']
+        all_users_global_granted = forum_masks['all_users_global'][0]
+
+        no_masks = (0, 0)
+        masks = []
+        for forum_id in forum_ids:
+            forum_user_granted, forum_user_nongranted = user_forums.get(forum_id, no_masks)
+
+            granted_group = granted_all_users = forum_all_users_nongranted = 0
+
+            if not is_anonymous:
+                forum_group = group_forums.get(forum_id, no_masks)
+                forum_all_users = all_users_forums.get(forum_id, no_masks)
+
+                # A permission non-granted (resp. granted) on user-forum level takes precedence over
+                # the same permission granted (resp. non-granted) on group-forum level.
+                forum_group_granted = forum_group[0] & ~forum_user_nongranted
+                forum_group_nongranted = forum_group[1] & ~forum_user_granted
+
+                group_global_granted &= ~(
+                    user_global_nongranted | forum_group_nongranted | forum_user_nongranted
+                )
+                group_global_nongranted &= ~(
+                    user_global_granted | forum_group_granted | forum_user_granted
+                )
+                granted_group = group_global_granted | forum_group_granted
+
+                # All-users permissions are overridden by user and group permissions.
+                forum_all_users_granted = (
+                    forum_all_users[0] & ~forum_user_nongranted & ~forum_group_nongranted
+                )
+                forum_all_users_nongranted = (
+                    forum_all_users[1] & ~forum_user_granted & ~forum_group_granted
+                )
+
+                all_users_global_granted &= ~(
+                    forum_all_users_nongranted | user_global_nongranted | group_global_nongranted |
+                    forum_group_nongranted | forum_user_nongranted
+                )
+                granted_all_users = all_users_global_granted | forum_all_users_granted
+
+            granted_user = (
+                user_global_granted_or_default & ~forum_user_nongranted &
+                ~forum_all_users_nongranted
+            )
+
+            masks.append(granted_user | forum_user_granted | granted_group | granted_all_users)
+
+        return masks
+
+    def _get_forumlist_masks(self, forums, forum_masks):
+        return list(zip(
+            forums,
+            self.resolve(forum_masks, [f.id if f is not None else None for f in forums]),
+        ))
+
+    def _get_independent_masks(self, forum_masks, forum_ids):
+        if forum_ids is None:
+            forum_ids = set(forum_masks['user_forums'])
+            forum_ids.update(forum_masks['group_forums'], forum_masks['all_users_forums'])
+        masks = {fid: self.resolve(forum_masks, [fid])[0] for fid in forum_ids}
+        masks[None] = self.resolve(forum_masks, [None])[0]
+        return masks
+
+    async def _aget_permission_rows(self, forums, perm_codenames=None):
+        """ Asynchronous version of ``_get_permission_rows`` ; the rows are fetched eagerly. """
+        rows = self._get_permission_rows(forums, perm_codenames)
+        for key, value in rows.items():
+            rows[key] = [row async for row in value] if isinstance(value, QuerySet) else value
+        return rows
+
+    def _get_permission_rows(self, forums, perm_codenames=None):
+        """ Returns the user and group permission rows to consider for the given forums.
+
+        The ``forums`` argument can contain forum instances or forum IDs. The rows associated with
+        all the forums are returned if it is ``None``.
+
+        """
+        forum_filter = (
+            Q(forum__isnull=True) | Q(forum__in=[f for f in forums if f is not None])
+            if forums is not None else Q()
+        )
+
+        user_perms = UserForumPermission.objects.filter(forum_filter)
+        if perm_codenames:
+            user_perms = user_perms.filter(permission__codename__in=perm_codenames)
+
+        if self.user.is_anonymous:
+            user_perms = user_perms.filter(anonymous_user=True)
+            group_perms = []
+        else:
+            user_perms = user_perms.filter(Q(authenticated_user=True) | Q(user=self.user))
+
+            user_model = get_user_model()
+            user_groups_related_name = user_model.groups.field.related_query_name()
+            group_perms = (
+                GroupForumPermission.objects
+                .filter(**{'group__{}'.format(user_groups_related_name): self.user})
+                .filter(forum_filter)
+            )
+            if perm_codenames:
+                group_perms = group_perms.filter(permission__codename__in=perm_codenames)
+            group_perms = group_perms.values_list('permission__codename', 'forum_id', 'has_perm')
+
+        return {
+            'user': user_perms.values_list(
+                'permission__codename', 'forum_id', 'has_perm', 'user_id', 'authenticated_user',
+            ),
+            'group': group_perms,
+        }
@@ -8,26 +8,37 @@
 """
 
 import datetime as dt
-from functools import reduce
+import hashlib
+import inspect
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
 from django.utils.timezone import now
-from mptt.utils import get_cached_trees
 
+from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
-from machina.core.loading import get_class
+from machina.core.loading import get_class, get_classes
 
 
 Forum = get_model('forum', 'Forum')
+GrantedForum = get_model('forum_permission', 'GrantedForum')
 GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
 Post = get_model('forum_conversation', 'Post')
+Topic = get_model('forum_conversation', 'Topic')
+TopicPoll = get_model('forum_polls', 'TopicPoll')
 TopicPollVote = get_model('forum_polls', 'TopicPollVote')
 UserForumPermission = get_model('forum_permission', 'UserForumPermission')
 
 ForumPermissionChecker = get_class('forum_permission.checker', 'ForumPermissionChecker')
 
-get_anonymous_user_forum_key = get_class(
-    'forum_permission.shortcuts', 'get_anonymous_user_forum_key')
+can_have_anonymous_user_forum_key, get_anonymous_user_forum_key = get_classes(
+    'forum_permission.shortcuts',
+    ['can_have_anonymous_user_forum_key', 'get_anonymous_user_forum_key'],
+)
+anonymous_snapshot = get_class('forum_permission.snapshot', 'snapshot')
+forum_tree = get_class('forum.tree', 'forum_tree')
+permission_cache = get_class('forum_permission.cache', 'cache')
 
 
 class PermissionHandler:
@@ -37,6 +48,10 @@ class PermissionHandler:
     verifications on forums. It uses the ``ForumPermissionChecker`` class to perform these
     verifications.
 
+    Each public method has an asynchronous counterpart prefixed with ``a`` (eg. ``acan_add_post``)
+    that can be awaited from asynchronous views. These methods rely on the asynchronous interface
+    of the ORM.
+
     """
 
     def __init__(self):
@@ -52,6 +67,14 @@ class PermissionHandler:
         # checked.
         self._user_perm_checkers_cache = {}
 
+        # This one will store the ForumPermissionChecker instances whose resolved permissions are
+        # shared with the checkers of other users having the same permission fingerprint.
+        self._profile_perm_checkers_cache = {}
+
+        # This one will store the querysets of the IDs of the granted forums that are materialized
+        # when the queryset mode is used.
+        self._granted_forum_ids_querysets_cache = {}
+
     # Filtering methods
     # --
 
@@ -63,23 +86,83 @@ class PermissionHandler:
         if user.is_superuser:
             return qs
 
+        if machina_settings.PERMISSION_QUERYSET_MODE:
+            return qs.filter(
+                id__in=self._get_granted_forum_ids_queryset(
+                    user, ['can_see_forum', 'can_read_forum', ], use_tree_hierarchy=True,
+                ),
+            )
+
         # Check whether the forums can be viewed by the given user
         forums_to_hide = self._get_hidden_forum_ids(qs, user)
 
         return qs.exclude(id__in=forums_to_hide)
 
+    async def aforum_list_filter(self, qs, user):
+        """ Asynchronous version of ``forum_list_filter``. """
+        if user.is_superuser:
+            return qs
+
+        if machina_settings.PERMISSION_QUERYSET_MODE:
+            return qs.filter(
+                id__in=await sync_to_async(self._get_granted_forum_ids_queryset)(
+                    user, ['can_see_forum', 'can_read_forum', ], use_tree_hierarchy=True,
+                ),
+            )
+
+        visible_forums = await self._aget_forums_for_user(
+            user, ['can_see_forum', 'can_read_forum', ], use_tree_hierarchy=True,
+        )
+        return qs.filter(id__in=[f.id for f in visible_forums])
+
     def get_readable_forums(self, forums, user):
         """ Returns a queryset of forums that can be read by the considered user. """
         # Any superuser should be able to read all the forums.
         if user.is_superuser:
             return forums
 
+        if (
+            machina_settings.PERMISSION_QUERYSET_MODE and
+            isinstance(forums, (models.Manager, models.QuerySet))
+        ):
+            return forums.filter(
+                id__in=self._get_granted_forum_ids_queryset(
+                    user, ['can_read_forum', ], use_tree_hierarchy=True,
+                ),
+            )
+
         # Fetches the forums that can be read by the given user.
-        readable_forums = self._get_forums_for_user(
-            user, ['can_read_forum', ], use_tree_hierarchy=True)
-        return forums.filter(id__in=[f.id for f in readable_forums]) \
+        readable_forum_ids = {
+            f.id for f in self._get_forums_for_user(
+                user, ['can_read_forum', ], use_tree_hierarchy=True)
+        }
+        return forums.filter(id__in=readable_forum_ids) \
             if isinstance(forums, (models.Manager, models.QuerySet)) \
-            else list(filter(lambda f: f in readable_forums, forums))
+            else [f for f in forums if f.id in readable_forum_ids]
+
+    async def aget_readable_forums(self, forums, user):
+        """ Asynchronous version of ``get_readable_forums``. """
+        if user.is_superuser:
+            return forums
+
+        if (
+            machina_settings.PERMISSION_QUERYSET_MODE and
+            isinstance(forums, (models.Manager, models.QuerySet))
+        ):
+            # The materialization of the granted forums is not available asynchronously.
+            return forums.filter(
+                id__in=await sync_to_async(self._get_granted_forum_ids_queryset)(
+                    user, ['can_read_forum', ], use_tree_hierarchy=True,
+                ),
+            )
+
+        readable_forum_ids = {
+            f.id for f in await self._aget_forums_for_user(
+                user, ['can_read_forum', ], use_tree_hierarchy=True)
+        }
+        return forums.filter(id__in=readable_forum_ids) \
+            if isinstance(forums, (models.Manager, models.QuerySet)) \
+            else [f for f in forums if f.id in readable_forum_ids]
 
     # Verification methods
     # --
@@ -90,24 +173,44 @@ class PermissionHandler:
         """ Given a forum, checks whether the user can read its content. """
         return self._perform_basic_permission_check(forum, user, 'can_read_forum')
 
+    async def acan_read_forum(self, forum, user):
+        """ Asynchronous version of ``can_read_forum``. """
+        return await self._acall_permission_method(self.can_read_forum, forum, user)
+
     # Posts and topics
 
     def can_add_topic(self, forum, user):
         """ Given a forum, checks whether the user can append topics to it. """
         return self._perform_basic_permission_check(forum, user, 'can_start_new_topics')
 
+    async def acan_add_topic(self, forum, user):
+        """ Asynchronous version of ``can_add_topic``. """
+        return await self._acall_permission_method(self.can_add_topic, forum, user)
+
     def can_add_stickies(self, forum, user):
         """ Given a forum, checks whether the user can append stickies to it. """
         return self._perform_basic_permission_check(forum, user, 'can_post_stickies')
 
+    async def acan_add_stickies(self, forum, user):
+        """ Asynchronous version of ``can_add_stickies``. """
+        return await self._acall_permission_method(self.can_add_stickies, forum, user)
+
     def can_add_announcements(self, forum, user):
         """ Given a forum, checks whether the user can append announcements to it. """
         return self._perform_basic_permission_check(forum, user, 'can_post_announcements')
 
+    async def acan_add_announcements(self, forum, user):
+        """ Asynchronous version of ``can_add_announcements``. """
+        return await self._acall_permission_method(self.can_add_announcements, forum, user)
+
     def can_post_without_approval(self, forum, user):
         """ Given a forum, checks whether the user can add a posts and topics without approval. """
         return self._perform_basic_permission_check(forum, user, 'can_post_without_approval')
 
+    async def acan_post_without_approval(self, forum, user):
+        """ Asynchronous version of ``can_post_without_approval``. """
+        return await self._acall_permission_method(self.can_post_without_approval, forum, user)
+
     def can_add_post(self, topic, user):
         """ Given a topic, checks whether the user can append posts to it. """
         can_add_post = self._perform_basic_permission_check(
@@ -119,6 +222,10 @@ class PermissionHandler:
         )
         return can_add_post
 
+    async def acan_add_post(self, topic, user):
+        """ Asynchronous version of ``can_add_post``. """
+        return await self._acall_permission_method(self.can_add_post, topic, user)
+
     def can_edit_post(self, post, user):
         """ Given a forum post, checks whether the user can edit the latter. """
         checker = self._get_checker(user)
@@ -138,6 +245,10 @@ class PermissionHandler:
         )
         return can_edit
 
+    async def acan_edit_post(self, post, user):
+        """ Asynchronous version of ``can_edit_post``. """
+        return await self._acall_permission_method(self.can_edit_post, post, user)
+
     def can_delete_post(self, post, user):
         """
         Given a forum post, checks whether the user can delete the latter.
@@ -156,19 +267,25 @@ class PermissionHandler:
         )
         return can_delete
 
+    async def acan_delete_post(self, post, user):
+        """ Asynchronous version of ``can_delete_post``. """
+        return await self._acall_permission_method(self.can_delete_post, post, user)
+
     # Polls
 
     def can_create_polls(self, forum, user):
         """ Given a forum, checks whether the user can add a topic with an embedded poll. """
         return self._perform_basic_permission_check(forum, user, 'can_create_polls')
 
+    async def acan_create_polls(self, forum, user):
+        """ Asynchronous version of ``can_create_polls``. """
+        return await self._acall_permission_method(self.can_create_polls, forum, user)
+
     def can_vote_in_poll(self, poll, user):
         """ Given a poll, checks whether the user can answer to it. """
         # First we have to check if the poll is curently open
-        if poll.duration:
-            poll_dtend = poll.created + dt.timedelta(days=poll.duration)
-            if poll_dtend < now():
-                return False
+        if self._is_poll_closed(poll):
+            return False
 
         # Is this user allowed to vote in polls in the current forum?
         can_vote = (
@@ -177,24 +294,55 @@ class PermissionHandler:
         )
 
         # Retrieve the user votes for the considered poll
+        user_votes, can_vote = self._get_user_poll_votes(poll, user, can_vote)
+
+        # If the user has already voted, they can vote again if the vote changes are allowed
+        if user_votes.exists() and can_vote:
+            can_vote = poll.user_changes
+
+        return can_vote
+
+    async def acan_vote_in_poll(self, poll, user):
+        """ Asynchronous version of ``can_vote_in_poll``. """
+        if self._is_poll_closed(poll):
+            return False
+
+        forum = await self._aload_related_forum(poll)
+        can_vote = (
+            await self._aperform_basic_permission_check(forum, user, 'can_vote_in_polls') and
+            not poll.topic.is_locked
+        )
+
+        user_votes, can_vote = self._get_user_poll_votes(poll, user, can_vote)
+        if can_vote and await user_votes.aexists():
+            can_vote = poll.user_changes
+
+        return can_vote
+
+    def _is_poll_closed(self, poll):
+        if poll.duration:
+            poll_dtend = poll.created + dt.timedelta(days=poll.duration)
+            if poll_dtend < now():
+                return True
+        return False
+
+    def _get_user_poll_votes(self, poll, user, can_vote):
+        """ Returns the votes of the user for the given poll and whether the user can vote. """
         user_votes = TopicPollVote.objects.filter(poll_option__poll=poll)
         if user.is_anonymous:
-            forum_key = get_anonymous_user_forum_key(user)
+            forum_key = get_anonymous_user_forum_key(user, create=False)
             if forum_key:
                 user_votes = user_votes.filter(anonymous_key=forum_key)
             else:
-                # If the forum key of the anonymous user cannot be retrieved, the user should not be
-                # allowed to vote in the considered poll.
+                # If no forum key can be associated with the anonymous user, the user should not be
+                # allowed to vote in the considered poll. Otherwise the forum key will be generated
+                # when the user votes.
                 user_votes = user_votes.none()
-                can_vote = False
+                can_vote = can_vote and can_have_anonymous_user_forum_key(user)
         else:
             user_votes = user_votes.filter(voter=user)
 
-        # If the user has already voted, they can vote again if the vote changes are allowed
-        if user_votes.exists() and can_vote:
-            can_vote = poll.user_changes
-
-        return can_vote
+        return user_votes, can_vote
 
     # Attachments
 
@@ -202,10 +350,18 @@ class PermissionHandler:
         """ Given a forum, checks whether the user can add attachments to posts. """
         return self._perform_basic_permission_check(forum, user, 'can_attach_file')
 
+    async def acan_attach_files(self, forum, user):
+        """ Asynchronous version of ``can_attach_files``. """
+        return await self._acall_permission_method(self.can_attach_files, forum, user)
+
     def can_download_files(self, forum, user):
         """ Given a forum, checks whether the user can download files attached to posts. """
         return self._perform_basic_permission_check(forum, user, 'can_download_file')
 
+    async def acan_download_files(self, forum, user):
+        """ Asynchronous version of ``can_download_files``. """
+        return await self._acall_permission_method(self.can_download_files, forum, user)
+
     # Topic subscription
 
     def can_subscribe_to_topic(self, topic, user):
@@ -219,6 +375,16 @@ class PermissionHandler:
             self._perform_basic_permission_check(topic.forum, user, 'can_read_forum')
         )
 
+    async def acan_subscribe_to_topic(self, topic, user):
+        """ Asynchronous version of ``can_subscribe_to_topic``. """
+        return (
+            user.is_authenticated and
+            not await topic.ahas_subscriber(user) and
+            await self._aperform_basic_permission_check(
+                await self._aload_related_forum(topic), user, 'can_read_forum',
+            )
+        )
+
     def can_unsubscribe_from_topic(self, topic, user):
         """ Given a topic, checks whether the user can remove it from their subscription list. """
         # A user can unsubscribe from topics if they are authenticated and if they have the
@@ -230,30 +396,62 @@ class PermissionHandler:
             self._perform_basic_permission_check(topic.forum, user, 'can_read_forum')
         )
 
+    async def acan_unsubscribe_from_topic(self, topic, user):
+        """ Asynchronous version of ``can_unsubscribe_from_topic``. """
+        return (
+            user.is_authenticated and
+            await topic.ahas_subscriber(user) and
+            await self._aperform_basic_permission_check(
+                await self._aload_related_forum(topic), user, 'can_read_forum',
+            )
+        )
+
     # Moderation
 
     def get_moderation_queue_forums(self, user):
         """ Returns the list of forums whose posts can be approved by the considered user. """
         return self._get_forums_for_user(user, ['can_approve_posts', ])
 
+    async def aget_moderation_queue_forums(self, user):
+        """ Asynchronous version of ``get_moderation_queue_forums``. """
+        return await self._aget_forums_for_user(user, ['can_approve_posts', ])
+
     def can_access_moderation_queue(self, user):
         """ Returns True if the passed user can access the moderation queue. """
         return len(self.get_moderation_queue_forums(user)) > 0
 
+    async def acan_access_moderation_queue(self, user):
+        """ Asynchronous version of ``can_access_moderation_queue``. """
+        return len(await self.aget_moderation_queue_forums(user)) > 0
+
     def can_lock_topics(self, forum, user):
         """ Given a forum, checks whether the user can lock its topics. """
         return self._perform_basic_permission_check(forum, user, 'can_lock_topics')
 
+    async def acan_lock_topics(self, forum, user):
+        """ Asynchronous version of ``can_lock_topics``. """
+        return await self._acall_permission_method(self.can_lock_topics, forum, user)
+
     def can_move_topics(self, forum, user):
         """ Given a forum, checks whether the user can move its topics to another forum. """
         return self._perform_basic_permission_check(forum, user, 'can_move_topics')
 
+    async def acan_move_topics(self, forum, user):
+        """ Asynchronous version of ``can_move_topics``. """
+        return await self._acall_permission_method(self.can_move_topics, forum, user)
+
     def get_target_forums_for_moved_topics(self, user):
         """ Returns a list of forums in which the considered user can add topics that have been
             moved from another forum.
         """
         return [f for f in self._get_forums_for_user(user, ['can_move_topics', ]) if f.is_forum]
 
+    async def aget_target_forums_for_moved_topics(self, user):
+        """ Asynchronous version of ``get_target_forums_for_moved_topics``. """
+        return [
+            f for f in await self._aget_forums_for_user(user, ['can_move_topics', ]) if f.is_forum
+        ]
+
     def can_delete_topics(self, forum, user):
         """ Given a forum, checks whether the user can delete its topics.
 
@@ -263,10 +461,20 @@ class PermissionHandler:
         """
         return self._perform_basic_permission_check(forum, user, 'can_delete_posts')
 
+    async def acan_delete_topics(self, forum, user):
+        """ Asynchronous version of ``can_delete_topics``. """
+        return await self._acall_permission_method(self.can_delete_topics, forum, user)
+
     def can_update_topics_to_normal_topics(self, forum, user):
         """ Given a forum, checks whether the user can change its topic types to normal topics. """
         return self._perform_basic_permission_check(forum, user, 'can_edit_posts')
 
+    async def acan_update_topics_to_normal_topics(self, forum, user):
+        """ Asynchronous version of ``can_update_topics_to_normal_topics``. """
+        return await self._acall_permission_method(
+            self.can_update_topics_to_normal_topics, forum, user,
+        )
+
     def can_update_topics_to_sticky_topics(self, forum, user):
         """ Given a forum, checks whether the user can change its topic types to sticky topics. """
         return (
@@ -274,6 +482,12 @@ class PermissionHandler:
             self._perform_basic_permission_check(forum, user, 'can_post_stickies')
         )
 
+    async def acan_update_topics_to_sticky_topics(self, forum, user):
+        """ Asynchronous version of ``can_update_topics_to_sticky_topics``. """
+        return await self._acall_permission_method(
+            self.can_update_topics_to_sticky_topics, forum, user,
+        )
+
     def can_update_topics_to_announces(self, forum, user):
         """ Given a forum, checks whether the user can change its topic types to announces. """
         return (
@@ -281,19 +495,123 @@ class PermissionHandler:
             self._perform_basic_permission_check(forum, user, 'can_post_announcements')
         )
 
+    async def acan_update_topics_to_announces(self, forum, user):
+        """ Asynchronous version of ``can_update_topics_to_announces``. """
+        return await self._acall_permission_method(self.can_update_topics_to_announces, forum, user)
+
     def can_approve_posts(self, forum, user):
         """ Given a forum, checks whether the user can approve its posts. """
         return self._perform_basic_permission_check(forum, user, 'can_approve_posts')
 
+    async def acan_approve_posts(self, forum, user):
+        """ Asynchronous version of ``can_approve_posts``. """
+        return await self._acall_permission_method(self.can_approve_posts, forum, user)
+
+    # Batch verification
+    # --
+
+    def get_permissions(self, checks, user):
+        """ Evaluates a list of permission checks for the given user in a single pass.
+
+        The ``checks`` argument should be an iterable of (method name, object) two-tuples, where the
+        method name is the name of one of the public methods of the handler (eg. ``can_edit_post``)
+        and the object is the object to pass to this method (or ``None`` if the method only expects
+        a user). The permissions of all the involved forums are resolved at once before performing
+        the checks. Returns a dictionary of (method name, object) to the result of each check.
+
+        """
+        checks = list(checks)
+        self._validate_permission_checks(checks)
+
+        self._get_checker(user).prefetch_perms(
+            {self._get_related_forum(obj) for _, obj in checks} - {None},
+        )
+
+        return {
+            (method, obj): (
+                getattr(self, method)(obj, user) if obj is not None
+                else getattr(self, method)(user)
+            )
+            for method, obj in checks
+        }
+
+    async def aget_permissions(self, checks, user):
+        """ Asynchronous version of ``get_permissions``.
+
+        The method names are the names of the synchronous methods (eg. ``can_edit_post``): their
+        asynchronous versions are used to perform the checks.
+
+        """
+        checks = list(checks)
+        self._validate_permission_checks(checks)
+
+        forums = {await self._aload_related_forum(obj) for _, obj in checks}
+        await (await self._aget_checker(user)).aprefetch_perms(forums - {None})
+
+        results = {}
+        for method, obj in checks:
+            amethod = getattr(self, 'a{}'.format(method))
+            results[(method, obj)] = (
+                await amethod(obj, user) if obj is not None else await amethod(user)
+            )
+        return results
+
+    def _validate_permission_checks(self, checks):
+        for method, _ in checks:
+            if (
+                method.startswith('_') or
+                not callable(getattr(self, method, None)) or
+                inspect.iscoroutinefunction(getattr(self, method))
+            ):
+                raise ValueError('{} is not a permission method'.format(method))
+
     # Common
     # --
 
+    def _get_related_forum(self, obj):
+        """ Returns the forum related to an object whose permissions can be checked. """
+        if isinstance(obj, Forum):
+            return obj
+        elif isinstance(obj, Topic):
+            return obj.forum
+        elif isinstance(obj, (Post, TopicPoll)):
+            return obj.topic.forum
+
+    async def _aload_related_forum(self, obj):
+        """ Asynchronous version of ``_get_related_forum``.
+
+        The related objects that are not loaded yet (eg. the topic of a post or the forum of a
+        topic) are fetched and cached on the considered object so that the synchronous permission
+        methods can be used on this object afterwards.
+
+        """
+        if isinstance(obj, (Post, TopicPoll)):
+            if not type(obj).topic.is_cached(obj):
+                obj.topic = await Topic.objects.aget(pk=obj.topic_id)
+            obj = obj.topic
+        if isinstance(obj, Topic):
+            if not Topic.forum.is_cached(obj):
+                obj.forum = await Forum.objects.aget(pk=obj.forum_id)
+            obj = obj.forum
+        return obj if isinstance(obj, Forum) else None
+
+    async def _acall_permission_method(self, method, obj, user):
+        """ Calls a synchronous permission method once the related permissions are loaded.
+
+        The permissions of the forum related to the object are resolved asynchronously beforehand
+        so that the method does not perform any I/O.
+
+        """
+        forum = await self._aload_related_forum(obj)
+        await (await self._aget_checker(user)).aprefetch_perms([forum])
+        return method(obj, user)
+
     def _is_post_author(self, post, user):
         return (
-            (post.poster == user) if user.is_authenticated else
+            (post.poster_id == user.pk) if user.is_authenticated else
             (
                 post.anonymous_key is not None and
-                post.anonymous_key == get_anonymous_user_forum_key(user)
+                post.anonymous_key == get_anonymous_user_forum_key(user, create=False)
             )
         )
 
@@ -315,53 +633,235 @@ class PermissionHandler:
         that a forum which has an ancestor which is not in the granted forums set will not be
         returned.
         """
-        granted_forums_cache_key = '{}__{}'.format(
-            ':'.join(perm_codenames), user.id if not user.is_anonymous else 'anonymous',
-        )
+        forums = self._get_all_forums()
+
+        # First check if the user is a superuser and if so, returns the forum queryset immediately.
+        if user.is_superuser:  # pragma: no cover
+            return forums
+
+        # Users sharing the same permission fingerprint share the same granted forums when the
+        # permission cache is used.
+        checker = self._get_checker(user)
+        granted_forums_cache_key = self._get_granted_forums_cache_key(checker, user, perm_codenames)
 
         if granted_forums_cache_key in self._granted_forums_cache:
             return self._granted_forums_cache[granted_forums_cache_key]
 
-        forums = self._get_all_forums()
+        # The IDs of the granted forums can be shared across requests using the permission cache
+        # or the anonymous permission snapshot.
+        snapshot = (
+            anonymous_snapshot.get()
+            if user.is_anonymous and anonymous_snapshot.enabled else None
+        )
+        snapshot_key = (tuple(perm_codenames), use_tree_hierarchy)
+        shared_cache_key = (
+            self._get_granted_forums_shared_cache_key(
+                checker.get_cache_key(), perm_codenames, use_tree_hierarchy,
+            )
+            if permission_cache.enabled else None
+        )
+
+        allowed_forum_ids = None
+        if snapshot is not None:
+            allowed_forum_ids = snapshot.granted_forum_ids.get(snapshot_key)
+        if allowed_forum_ids is None and shared_cache_key is not None:
+            cached_forum_ids = permission_cache.get(shared_cache_key)
+            if cached_forum_ids is not None:
+                allowed_forum_ids = frozenset(cached_forum_ids)
+                if snapshot is not None:
+                    snapshot.granted_forum_ids[snapshot_key] = allowed_forum_ids
+
+        if allowed_forum_ids is not None:
+            allowed_forums = [f for f in forums if f.id in allowed_forum_ids]
+        else:
+            perms = checker.get_perms_for_forumlist(forums, perm_codenames)
+            allowed_forums = self._get_granted_forums_from_perms(
+                forums, perms, perm_codenames, use_tree_hierarchy,
+            )
+
+            if shared_cache_key is not None:
+                permission_cache.set(shared_cache_key, [f.id for f in allowed_forums])
+            if snapshot is not None:
+                snapshot.granted_forum_ids[snapshot_key] = frozenset(f.id for f in allowed_forums)
+
+        self._granted_forums_cache[granted_forums_cache_key] = allowed_forums
+        return allowed_forums
+
+    async def _aget_forums_for_user(self, user, perm_codenames, use_tree_hierarchy=False):
+        """ Asynchronous version of ``_get_forums_for_user``. """
+        forums = await self._aget_all_forums()
 
-        # First check if the user is a superuser and if so, returns the forum queryset immediately.
         if user.is_superuser:  # pragma: no cover
-            self._granted_forums_cache[granted_forums_cache_key] = forums
             return forums
+
+        checker = await self._aget_checker(user)
+        granted_forums_cache_key = self._get_granted_forums_cache_key(checker, user, perm_codenames)
+
+        if granted_forums_cache_key in self._granted_forums_cache:
+            return self._granted_forums_cache[granted_forums_cache_key]
+
+        snapshot = (
+            await anonymous_snapshot.aget()
+            if user.is_anonymous and anonymous_snapshot.enabled else None
+        )
+        snapshot_key = (tuple(perm_codenames), use_tree_hierarchy)
+        shared_cache_key = (
+            self._get_granted_forums_shared_cache_key(
+                await checker.aget_cache_key(), perm_codenames, use_tree_hierarchy,
+            )
+            if permission_cache.enabled else None
+        )
+
+        allowed_forum_ids = None
+        if snapshot is not None:
+            allowed_forum_ids = snapshot.granted_forum_ids.get(snapshot_key)
+        if allowed_forum_ids is None and shared_cache_key is not None:
+            cached_forum_ids = await permission_cache.aget(shared_cache_key)
+            if cached_forum_ids is not None:
+                allowed_forum_ids = frozenset(cached_forum_ids)
+                if snapshot is not None:
+                    snapshot.granted_forum_ids[snapshot_key] = allowed_forum_ids
+
+        if allowed_forum_ids is not None:
+            allowed_forums = [f for f in forums if f.id in allowed_forum_ids]
         else:
-            checker = self._get_checker(user)
-            perms = checker.get_perms_for_forumlist(forums, perm_codenames)
-            allowed_forums = []
-            # Check if the requested permissions are in the set of permissions for the forum
-            for f in forums:
-                if set(perm_codenames).issubset(perms[f]):
-                    allowed_forums.append(f)
+            perms = await checker.aget_perms_for_forumlist(forums, perm_codenames)
+            allowed_forums = self._get_granted_forums_from_perms(
+                forums, perms, perm_codenames, use_tree_hierarchy,
+            )
 
-            if use_tree_hierarchy:
-                allowed_forums = self._filter_granted_forums_using_tree(allowed_forums)
+            if shared_cache_key is not None:
+                await permission_cache.aset(shared_cache_key, [f.id for f in allowed_forums])
+            if snapshot is not None:
+                snapshot.granted_forum_ids[snapshot_key] = frozenset(f.id for f in allowed_forums)
 
         self._granted_forums_cache[granted_forums_cache_key] = allowed_forums
         return allowed_forums
 
-    def _filter_granted_forums_using_tree(self, granted_forums):
-        top_nodes = self._get_top_nodes()
-        d = reduce(
-            lambda a, b: a + self._filter_granted_node_using_tree(b, granted_forums), top_nodes, []
+    def _get_granted_forums_cache_key(self, checker, user, perm_codenames):
+        return '{}__{}'.format(
+            ':'.join(perm_codenames),
+            (
+                checker.get_fingerprint() if permission_cache.enabled
+                else user.id if not user.is_anonymous else 'anonymous'
+            ),
+        )
+
+    def _get_granted_forums_shared_cache_key(self, cache_key, perm_codenames, use_tree_hierarchy):
+        return '{}:forums:{}:{}'.format(
+            cache_key, ','.join(perm_codenames), int(use_tree_hierarchy),
         )
-        return Forum.objects.filter(id__in=d)
 
-    def _filter_granted_node_using_tree(self, f, granted_forums):
-        if f in granted_forums:
-            return [f.id, ] + reduce(
-                lambda a, b: a + self._filter_granted_node_using_tree(b, granted_forums),
-                f.get_children(), []
+    def _get_granted_forums_from_perms(self, forums, perms, perm_codenames, use_tree_hierarchy):
+        """ Returns the forums whose permissions include all the given permission codenames. """
+        allowed_forums = []
+        # Check if the requested permissions are in the set of permissions for the forum
+        for f in forums:
+            if set(perm_codenames).issubset(perms[f]):
+                allowed_forums.append(f)
+
+        if use_tree_hierarchy:
+            allowed_forums = self._filter_granted_forums_using_tree(allowed_forums)
+
+        return allowed_forums
+
+    def _get_granted_forum_ids_queryset(self, user, perm_codenames, use_tree_hierarchy=False):
+        """ Returns a queryset of the IDs of the forums that satisfy the given permission codenames.
+
+        The granted forums are materialized in the ``GrantedForum`` table for the permission profile
+        of the user - that is its permission fingerprint, the considered permission codenames and
+        the current permission generation - so that they can be used as a subquery. The rows
+        materialized while a permission change is not committed yet may be computed from the
+        previous permissions: they are never reused since the generation is bumped again once the
+        change is committed.
+
+        """
+        if not permission_cache.enabled:
+            raise ImproperlyConfigured(
+                'The permission queryset mode requires the MACHINA_PERMISSION_CACHE_NAME setting',
             )
-        return []
 
-    def _get_top_nodes(self):
-        if not hasattr(self, '_top_nodes'):
-            self._top_nodes = get_cached_trees(Forum.objects.all())
-        return self._top_nodes
+        checker = self._get_checker(user)
+        generation = permission_cache.get_generation()
+        profile_key = hashlib.md5(
+            '{}:{}:{}'.format(
+                permission_cache.get_principal_key(checker.get_fingerprint(), generation),
+                ','.join(perm_codenames),
+                int(use_tree_hierarchy),
+            ).encode('utf-8'),
+        ).hexdigest()
+
+        if profile_key in self._granted_forum_ids_querysets_cache:
+            return self._granted_forum_ids_querysets_cache[profile_key]
+
+        materialized_cache_key = '{}:granted_forums:{}'.format(
+            permission_cache.key_prefix, profile_key,
+        )
+        if not permission_cache.get(materialized_cache_key):
+            is_materialized = GrantedForum.objects.filter(
+                profile_key=profile_key, forum__isnull=True,
+            ).exists()
+            if not is_materialized:
+                granted_forums = self._get_forums_for_user(
+                    user, perm_codenames, use_tree_hierarchy,
+                )
+                with transaction.atomic():
+                    # The same profile can be materialized concurrently by another process: the
+                    # rows that already exist are left untouched.
+                    GrantedForum.objects.bulk_create(
+                        [
+                            GrantedForum(
+                                profile_key=profile_key, generation=generation, forum_id=f.id,
+                            )
+                            for f in granted_forums
+                        ] +
+                        [GrantedForum(profile_key=profile_key, generation=generation)],
+                        ignore_conflicts=True,
+                    )
+                    self._delete_stale_granted_forums(generation)
+            # The materialized forums can only be used by other processes once they are committed.
+            transaction.on_commit(lambda: permission_cache.set(materialized_cache_key, True))
+
+        granted_forum_ids = (
+            GrantedForum.objects
+            .filter(profile_key=profile_key, forum__isnull=False)
+            .values('forum_id')
+        )
+        self._granted_forum_ids_querysets_cache[profile_key] = granted_forum_ids
+        return granted_forum_ids
+
+    def _delete_stale_granted_forums(self, generation):
+        """ Deletes the granted forums materialized before the previous permission generation.
+
+        The granted forums of the previous generation are kept: they can still be used by the
+        subqueries built by the requests that are being processed.
+
+        """
+        previous_generation = GrantedForum.objects \
+            .filter(generation__lt=generation) \
+            .aggregate(previous_generation=models.Max('generation'))['previous_generation']
+        if previous_generation is not None:
+            GrantedForum.objects.filter(generation__lt=previous_generation).delete()
+
+    def _filter_granted_forums_using_tree(self, granted_forums):
+        """ Returns the granted forums whose ancestors are all granted.
+
+        The forums are walked once in tree order (tree ID, then left value). A forum that is not
+        granted prunes all its descendants, which are the forums of the same tree whose left values
+        are lower than its right value.
+
+        """
+        granted_forum_ids = {f.id for f in granted_forums}
+        allowed_forums = []
+        pruned_tree_id, pruned_rght = None, None
+        for forum in sorted(self._get_all_forums(), key=lambda f: (f.tree_id, f.lft)):
+            if forum.tree_id == pruned_tree_id and forum.lft < pruned_rght:
+                continue
+            if forum.id in granted_forum_ids:
+                allowed_forums.append(forum)
+            else:
+                pruned_tree_id, pruned_rght = forum.tree_id, forum.rght
+        return allowed_forums
 
     def _perform_basic_permission_check(self, forum, user, permission):
         """ Given a forum and a user, checks whether the latter has the passed permission.
@@ -380,19 +880,67 @@ class PermissionHandler:
         check = (user.is_superuser or checker.has_perm(permission, forum))
         return check
 
+    async def _aperform_basic_permission_check(self, forum, user, permission):
+        """ Asynchronous version of ``_perform_basic_permission_check``. """
+        checker = await self._aget_checker(user)
+        return user.is_superuser or await checker.ahas_perm(permission, forum)
+
     def _get_checker(self, user):
         """ Return a ForumPermissionChecker instance for the given user. """
         user_perm_checkers_cache_key = user.id if not user.is_anonymous else 'anonymous'
 
+        if user_perm_checkers_cache_key in self._user_perm_checkers_cache:
+            return self._user_perm_checkers_cache[user_perm_checkers_cache_key]
+
+        return self._register_checker(user, ForumPermissionChecker(user))
+
+    async def _aget_checker(self, user):
+        """ Asynchronous version of ``_get_checker``. """
+        user_perm_checkers_cache_key = user.id if not user.is_anonymous else 'anonymous'
+
         if user_perm_checkers_cache_key in self._user_perm_checkers_cache:
             return self._user_perm_checkers_cache[user_perm_checkers_cache_key]
 
         checker = ForumPermissionChecker(user)
+        if permission_cache.enabled and not user.is_superuser:
+            await checker.aget_fingerprint()
+        return self._register_checker(user, checker)
+
+    def _register_checker(self, user, checker):
+        user_perm_checkers_cache_key = user.id if not user.is_anonymous else 'anonymous'
+
+        # When the permission cache is used, the checkers of users having the same permission
+        # fingerprint share their resolved permissions.
+        if permission_cache.enabled and not user.is_superuser:
+            profile_checker = self._profile_perm_checkers_cache.setdefault(
+                checker.get_fingerprint(), checker,
+            )
+            if profile_checker is not checker:
+                checker.share_perms_with(profile_checker)
+
         self._user_perm_checkers_cache[user_perm_checkers_cache_key] = checker
         return checker
 
+    def _get_forum_tree(self):
+        """ Returns the snapshot of the tree of forums. """
+        if not hasattr(self, '_forum_tree'):
+            self._forum_tree = forum_tree.get()
+        return self._forum_tree
+
+    async def _aget_forum_tree(self):
+        """ Asynchronous version of ``_get_forum_tree``. """
+        if not hasattr(self, '_forum_tree'):
+            self._forum_tree = await forum_tree.aget()
+        return self._forum_tree
+
     def _get_all_forums(self):
         """ Returns all forums. """
         if not hasattr(self, '_all_forums'):
-            self._all_forums = list(Forum.objects.all())
+            self._all_forums = list(self._get_forum_tree().forums)
+        return self._all_forums
+
+    async def _aget_all_forums(self):
+        """ Asynchronous version of ``_get_all_forums``. """
+        if not hasattr(self, '_all_forums'):
+            self._all_forums = list((await self._aget_forum_tree()).forums)
         return self._all_forums
@@ -0,0 +1,58 @@
+"""
+    Copy forum permissions command
+    ==============================
+
+    This module defines a management command allowing to copy the permissions of a forum to other
+    forums.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+
+
+Forum = get_model('forum', 'Forum')
+
+copy_perms = get_class('forum_permission.shortcuts', 'copy_perms')
+
+
+class Command(BaseCommand):
+    help = 'Copies the user and group permissions of a forum to other forums.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('forum_from', type=int, help='The ID of the source forum.')
+        parser.add_argument(
+            'forums_to', type=int, nargs='+', help='The IDs of the target forums.',
+        )
+        parser.add_argument(
+            '--descendants', action='store_true',
+            help='Also copy the permissions to the descendants of the target forums.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            forum_from = Forum.objects.get(pk=options['forum_from'])
+        except Forum.DoesNotExist:
+            raise CommandError('Forum {} does not exist'.format(options['forum_from']))
+
+        forums_to = list(Forum.objects.filter(pk__in=options['forums_to']))
+        missing_ids = set(options['forums_to']) - {f.id for f in forums_to}
+        if missing_ids:
+            raise CommandError(
+                'Forums {} do not exist'.format(', '.join(str(i) for i in sorted(missing_ids))),
+            )
+        if options['descendants']:
+            forums_to = list(
+                Forum.objects.filter(pk__in=[
+                    f.id for forum in forums_to for f in forum.get_descendants(include_self=True)
+                ]),
+            )
+
+        forums_to = [f for f in forums_to if f.id != forum_from.id]
+        copy_perms(forum_from, forums_to)
+
+        self.stdout.write(
+            'Permissions of forum {} copied to {} forum(s)'.format(forum_from.id, len(forums_to)),
+        )
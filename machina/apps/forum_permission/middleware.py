@@ -7,38 +7,93 @@
 
 """
 
+import asyncio
 import uuid
+from functools import partial
 
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 
-from machina.core.loading import get_class
+from machina.core.loading import get_class, get_classes
 
 
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 
+register_request, unregister_request = get_classes(
+    'forum_permission.registry', ['register_request', 'unregister_request'],
+)
+
 
 class ForumPermissionMiddleware(MiddlewareMixin):
     """ This middleware attaches an instance of the PermissionHandler to each request.
 
-    This allows to cache the permissions for the lifetime of the request object. The middleware also
-    attaches a random identifier to each anonymous user in order to perform proper permission checks
-    for anonymous users. This identifier is stored in the session.
+    This allows to cache the permissions for the lifetime of the request object. The handler is
+    only instantiated when it is used for the first time. The request is also registered for the
+    current context so that the components that don't have access to the request (forms, signal
+    receivers, ...) reuse the same handler.
+
+    The middleware also allows to associate a random identifier to each anonymous user in order to
+    perform proper permission checks for anonymous users (eg. to identify the posts or the poll
+    votes of these users). This identifier is stored in the session but it is only generated when
+    it is needed (eg. when an anonymous user submits a post): browsing the forum anonymously does
+    not result in any session write.
 
     """
 
     anonymous_forum_key_session_id = '_anonymous_forum_key'
 
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self._acall(request)
+        token = register_request(request)
+        try:
+            self.process_request(request)
+            return self.get_response(request)
+        finally:
+            unregister_request(token)
+
+    async def _acall(self, request):
+        token = register_request(request)
+        try:
+            # The request is processed without performing any I/O: there is no need to run it in a
+            # thread pool.
+            self.process_request(request)
+            return await self.get_response(request)
+        finally:
+            unregister_request(token)
+
     def process_request(self, request):
-        if not request.user.is_authenticated:
-            # Get the anonymous forum key and attaches it the AnonymousUser instance.
-            anonymous_forum_key = request.session.get(self.anonymous_forum_key_session_id, None)
-            if anonymous_forum_key is None:
-                anonymous_forum_key = self.get_anonymous_forum_key()
-                request.session[self.anonymous_forum_key_session_id] = anonymous_forum_key
+        # The user is not evaluated before it is actually used.
+        request.user = SimpleLazyObject(partial(self.get_user, request, request.user))
+        request.forum_permission_handler = SimpleLazyObject(PermissionHandler)
+
+    def get_user(self, request, user):
+        """ Returns the user of the request.
+
+        A loader of the anonymous forum key is attached to anonymous users.
+
+        """
+        if not user.is_authenticated:
+            setattr(user, 'forum_key_loader', partial(self.load_anonymous_forum_key, request))
+        return user
+
+    def load_anonymous_forum_key(self, request, create=True):
+        """ Returns the anonymous forum key of the user of the given request.
+
+        The forum key is retrieved from the session. A new forum key is generated and stored in the
+        session if the user has no forum key yet and if ``create`` is set; otherwise ``None`` is
+        returned.
+
+        """
+        anonymous_forum_key = request.session.get(self.anonymous_forum_key_session_id, None)
+        if anonymous_forum_key is None and create:
+            anonymous_forum_key = self.get_anonymous_forum_key()
+            request.session[self.anonymous_forum_key_session_id] = anonymous_forum_key
 
+        if anonymous_forum_key is not None:
             setattr(request.user, 'forum_key', anonymous_forum_key)
 
-        request.forum_permission_handler = PermissionHandler()
+        return anonymous_forum_key
 
     def get_anonymous_forum_key(self):
         """ Returns a random anonymous forum key. """
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0011_auto_20190627_2132'),
+        ('forum_permission', '0005_userforumpermission_authenticated_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GrantedForum',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile_key', models.CharField(db_index=True, max_length=32, verbose_name='Profile key')),
+                ('generation', models.BigIntegerField(db_index=True, verbose_name='Permission generation')),
+                ('forum', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='forum.forum', verbose_name='Forum')),
+            ],
+            options={
+                'verbose_name': 'Granted forum',
+                'verbose_name_plural': 'Granted forums',
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+def delete_granted_forums(apps, schema_editor):
+    # The granted forums are materialized again when they are needed: the rows that could have been
+    # created twice are deleted before the unique constraints are added.
+    GrantedForum = apps.get_model('forum_permission', 'GrantedForum')
+    GrantedForum.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forum', '0012_forum_subtree_trackers'),
+        ('forum_permission', '0006_grantedforum'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_granted_forums, reverse_code=migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='grantedforum',
+            unique_together={('profile_key', 'generation', 'forum')},
+        ),
+        migrations.AddConstraint(
+            model_name='grantedforum',
+            constraint=models.UniqueConstraint(condition=models.Q(('forum__isnull', True)), fields=('profile_key', 'generation'), name='forum_permission_grantedforum_unique_materialized_profile'),
+        ),
+    ]
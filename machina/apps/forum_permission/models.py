@@ -7,7 +7,8 @@
 """
 
 from machina.apps.forum_permission.abstract_models import (
-    AbstractForumPermission, AbstractGroupForumPermission, AbstractUserForumPermission
+    AbstractForumPermission, AbstractGrantedForum, AbstractGroupForumPermission,
+    AbstractUserForumPermission
 )
 from machina.core.db.models import model_factory
 
@@ -15,3 +16,4 @@ from machina.core.db.models import model_factory
 ForumPermission = model_factory(AbstractForumPermission)
 GroupForumPermission = model_factory(AbstractGroupForumPermission)
 UserForumPermission = model_factory(AbstractUserForumPermission)
+GrantedForum = model_factory(AbstractGrantedForum)
@@ -6,15 +6,23 @@
 
 """
 
-from django.db.models.signals import post_migrate
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 from django.dispatch import receiver
 
 from machina.core.db.models import get_model
 from machina.core.loading import get_class
 
 
+Forum = get_model('forum', 'Forum')
 ForumPermission = get_model('forum_permission', 'ForumPermission')
+GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
+UserForumPermission = get_model('forum_permission', 'UserForumPermission')
+
 PermissionConfig = get_class('forum_permission.defaults', 'PermissionConfig')
+anonymous_snapshot = get_class('forum_permission.snapshot', 'snapshot')
+forum_moved = get_class('forum.signals', 'forum_moved')
+permission_cache = get_class('forum_permission.cache', 'cache')
 
 
 def create_permissions():
@@ -28,3 +36,42 @@ def create_global_permissions(sender, **kwargs):
     """ Creates all the permissions from the permission configuration during migrations. """
     if sender.name.endswith('forum_permission'):
         create_permissions()
+
+
+@receiver([post_save, post_delete], sender=ForumPermission)
+@receiver([post_save, post_delete], sender=GroupForumPermission)
+@receiver([post_save, post_delete], sender=UserForumPermission)
+def invalidate_cached_permissions(sender, **kwargs):
+    """ Invalidates the permissions stored in the permission cache. """
+    permission_cache.bump_generation()
+    if sender is not GroupForumPermission:
+        # Group permissions don't apply to the anonymous user.
+        anonymous_snapshot.invalidate()
+
+
+@receiver(post_save, sender=Forum)
+def invalidate_cached_permissions_on_forum_creation(sender, instance, created, **kwargs):
+    """ Invalidates the cached permissions when a forum is created.
+
+    Forums are saved each time their trackers are updated: only the creation of a forum, its
+    deletion or its move can change the list of forums that are granted to a user.
+
+    """
+    if created:
+        permission_cache.bump_generation()
+        anonymous_snapshot.invalidate()
+
+
+@receiver(post_delete, sender=Forum)
+@receiver(forum_moved)
+def invalidate_cached_permissions_on_forum_tree_change(sender, **kwargs):
+    """ Invalidates the cached permissions when the tree of forums changes. """
+    permission_cache.bump_generation()
+    anonymous_snapshot.invalidate()
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+def invalidate_cached_permissions_on_group_membership_change(sender, action, **kwargs):
+    """ Invalidates the cached permissions when the groups of a user change. """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        permission_cache.bump_generation()
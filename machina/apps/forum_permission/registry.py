@@ -0,0 +1,42 @@
+"""
+    Forum permission registry
+    =========================
+
+    This module defines a request-scoped registry of permission handlers. The
+    ``ForumPermissionMiddleware`` registers the request being processed so that every component
+    computing permissions during the request-response cycle (forms, template tags, signal receivers,
+    ...) can reuse the permission handler of the request - and its cached permissions - without
+    having access to the request object.
+
+"""
+
+from contextvars import ContextVar
+
+from machina.core.loading import get_class
+
+
+PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+
+
+_current_request = ContextVar('machina_forum_permission_request', default=None)
+
+
+def get_permission_handler():
+    """ Returns the permission handler of the request being processed.
+
+    A new permission handler is returned if no request is being processed in the current context
+    (eg. in management commands or if the ``ForumPermissionMiddleware`` is not used).
+
+    """
+    handler = getattr(_current_request.get(), 'forum_permission_handler', None)
+    return handler if handler is not None else PermissionHandler()
+
+
+def register_request(request):
+    """ Registers the request being processed in the current context and returns a reset token. """
+    return _current_request.set(request)
+
+
+def unregister_request(token):
+    """ Restores the request that was registered before the given token was issued. """
+    _current_request.reset(token)
@@ -7,16 +7,24 @@
 
 """
 
+from collections import OrderedDict
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser, Group
+from django.db import transaction
+from django.db.models import Q
 
 from machina.core.db.models import get_model
+from machina.core.loading import get_class
 
 
 ForumPermission = get_model('forum_permission', 'ForumPermission')
 GroupForumPermission = get_model('forum_permission', 'GroupForumPermission')
 UserForumPermission = get_model('forum_permission', 'UserForumPermission')
 
+anonymous_snapshot = get_class('forum_permission.snapshot', 'snapshot')
+permission_cache = get_class('forum_permission.cache', 'cache')
+
 ALL_AUTHENTICATED_USERS = object()  # object to check against if all authenticated users are meant
 
 
@@ -89,6 +97,175 @@ def remove_perm(perm, object, forum=None):
             GroupForumPermission.objects.filter(forum=forum, permission=perm, group=group).delete()
 
 
+def assign_perms(perms, objects, forums=None, has_perm=True):
+    """ Assigns a list of permissions to a list of users or groups for a list of forums.
+
+    The permissions are assigned globally if ``forums`` is not specified. Existing permissions are
+    updated and missing ones are created using bulk queries in a single transaction.
+    """
+    _save_perms(_get_perm_rows(
+        perms, objects, forums, lambda codename: has_perm,
+    ))
+
+
+def remove_perms(perms, objects, forums=None):
+    """ Removes a list of permissions from a list of users or groups for a list of forums.
+
+    The global permissions are removed if ``forums`` is not specified.
+    """
+    forums = forums if forums is not None else [None]
+    filters = OrderedDict()
+    for object in objects:
+        model, target = _get_target(object)
+        filters[model] = filters.get(model, Q()) | Q(**target)
+
+    with permission_cache.batch(), transaction.atomic():
+        for model, target_filter in filters.items():
+            model.objects.filter(
+                target_filter, _get_forum_filter(forums), permission__codename__in=perms,
+            ).delete()
+
+
+def set_perms(object, forum, perms):
+    """ Sets the permissions of a user or a group for a forum (or globally if ``forum`` is None).
+
+    ``perms`` is a dictionary of permission codenames to ``True`` (granted), ``False`` (not granted)
+    or ``None`` (not set: the related permission is removed).
+    """
+    with permission_cache.batch(), transaction.atomic():
+        _save_perms(_get_perm_rows(
+            [codename for codename, value in perms.items() if value is not None], [object],
+            [forum], lambda codename: perms[codename],
+        ))
+        remove_perms(
+            [codename for codename, value in perms.items() if value is None], [object], [forum],
+        )
+
+
+def copy_perms(forum_from, forums_to):
+    """ Copies the user and group permissions of a forum to a list of other forums.
+
+    The permissions already defined for the target forums are overridden by those of the source
+    forum ; the other ones are kept.
+    """
+    rows = []
+    for model in (UserForumPermission, GroupForumPermission):
+        target_fields = _get_target_fields(model)
+        for perm in model.objects.filter(forum=forum_from):
+            target = {f: getattr(perm, f) for f in target_fields}
+            rows.extend(
+                (model, target, forum_to.id, perm.permission_id, perm.has_perm)
+                for forum_to in forums_to
+            )
+    _save_perms(rows)
+
+
+def _get_perm_rows(perms, objects, forums, get_has_perm):
+    """ Returns the permission rows corresponding to the given permissions, targets and forums. """
+    forums = forums if forums is not None else [None]
+    permission_ids = dict(
+        ForumPermission.objects.filter(codename__in=perms).values_list('codename', 'id'),
+    )
+    for codename in perms:
+        if codename not in permission_ids:
+            raise ForumPermission.DoesNotExist(
+                'The {} forum permission does not exist'.format(codename),
+            )
+
+    targets = [_get_target(object) for object in objects]
+    return [
+        (model, target, forum.id if forum is not None else None, permission_ids[codename],
+         get_has_perm(codename))
+        for model, target in targets
+        for forum in forums
+        for codename in perms
+    ]
+
+
+def _save_perms(rows):
+    """ Creates or updates the given permission rows in a single transaction.
+
+    Each row is a (model, target fields, forum ID, permission ID, has_perm) tuple. The permission
+    cache is invalidated once.
+    """
+    rows_per_model = OrderedDict()
+    for model, target, forum_id, permission_id, has_perm in rows:
+        rows_per_model.setdefault(model, []).append((target, forum_id, permission_id, has_perm))
+
+    with permission_cache.batch(), transaction.atomic():
+        for model, model_rows in rows_per_model.items():
+            target_fields = _get_target_fields(model)
+
+            target_filter = Q()
+            for target in {tuple(sorted(t.items())) for t, _, _, _ in model_rows}:
+                target_filter |= Q(**dict(target))
+            existing_perms = {
+                _get_perm_key(p, target_fields): p
+                for p in model.objects.filter(
+                    target_filter,
+                    _get_forum_filter({forum_id for _, forum_id, _, _ in model_rows}),
+                    permission_id__in={permission_id for _, _, permission_id, _ in model_rows},
+                )
+            }
+
+            perms_to_create, perms_to_update = OrderedDict(), OrderedDict()
+            for target, forum_id, permission_id, has_perm in model_rows:
+                perm = model(forum_id=forum_id, permission_id=permission_id, **target)
+                key = _get_perm_key(perm, target_fields)
+                if key in existing_perms:
+                    perm = existing_perms[key]
+                    if perm.has_perm != has_perm:
+                        perm.has_perm = has_perm
+                        perms_to_update[key] = perm
+                else:
+                    perm.has_perm = has_perm
+                    perms_to_create[key] = perm
+
+            model.objects.bulk_create(perms_to_create.values())
+            if perms_to_update:
+                model.objects.bulk_update(perms_to_update.values(), ['has_perm'])
+
+            if perms_to_create or perms_to_update:
+                # Bulk operations don't send signals: the cached permissions are invalidated here.
+                permission_cache.bump_generation()
+                if model is not GroupForumPermission:
+                    anonymous_snapshot.invalidate()
+
+
+def _get_target(object):
+    """ Returns the permission model and the target fields associated with a user or a group. """
+    if object is ALL_AUTHENTICATED_USERS:
+        return UserForumPermission, {
+            'user_id': None, 'anonymous_user': False, 'authenticated_user': True,
+        }
+    user, group = get_identity(object)
+    if user:
+        return UserForumPermission, {
+            'user_id': user.id if not user.is_anonymous else None,
+            'anonymous_user': user.is_anonymous,
+            'authenticated_user': False,
+        }
+    return GroupForumPermission, {'group_id': group.id}
+
+
+def _get_target_fields(model):
+    if model is GroupForumPermission:
+        return ('group_id', )
+    return ('user_id', 'anonymous_user', 'authenticated_user')
+
+
+def _get_perm_key(perm, target_fields):
+    return (perm.permission_id, perm.forum_id) + tuple(getattr(perm, f) for f in target_fields)
+
+
+def _get_forum_filter(forum_ids):
+    forum_ids = [getattr(f, 'id', f) for f in forum_ids]
+    forum_filter = Q(forum__in=[f for f in forum_ids if f is not None])
+    if None in forum_ids:
+        forum_filter |= Q(forum__isnull=True)
+    return forum_filter
+
+
 def get_identity(identity):
     """ Returns a (user_obj, None) tuple or a (None, group_obj) tuple depending on the considered
         instance.
@@ -107,9 +284,26 @@ def get_identity(identity):
         )
 
 
-def get_anonymous_user_forum_key(user):
-    """ Returns the forum key identifier associated with the considered anonymous user. """
-    return (
-        user.forum_key if isinstance(user, AnonymousUser) and hasattr(user, 'forum_key')
-        else None
+def get_anonymous_user_forum_key(user, create=True):
+    """ Returns the forum key identifier associated with the considered anonymous user.
+
+    The forum key of anonymous users is loaded lazily by the ``ForumPermissionMiddleware``. A new
+    forum key is generated for the user if it has no forum key yet, unless ``create`` is set to
+    ``False``: this should be used when the forum key is only used to read existing data so that
+    no session write is triggered.
+
+    """
+    if not isinstance(user, AnonymousUser):
+        return None
+    forum_key = getattr(user, 'forum_key', None)
+    forum_key_loader = getattr(user, 'forum_key_loader', None)
+    if forum_key is None and forum_key_loader is not None:
+        forum_key = forum_key_loader(create=create)
+    return forum_key
+
+
+def can_have_anonymous_user_forum_key(user):
+    """ Returns whether a forum key identifier is or can be associated with the anonymous user. """
+    return isinstance(user, AnonymousUser) and (
+        getattr(user, 'forum_key', None) is not None or hasattr(user, 'forum_key_loader')
     )
@@ -0,0 +1,106 @@
+"""
+    Anonymous permission snapshot
+    =============================
+
+    This module defines an abstraction allowing to keep the permissions of the anonymous user in
+    process memory. These permissions are the same for every anonymous visitor so that they can be
+    resolved once and reused by all the requests of anonymous users.
+
+"""
+
+import time
+
+from django.db import transaction
+
+from machina.conf import settings as machina_settings
+from machina.core.loading import get_class
+
+
+permission_cache = get_class('forum_permission.cache', 'cache')
+
+
+class AnonymousPermissionSnapshotData:
+    """ Holds the permissions of the anonymous user for a given permission generation. """
+
+    def __init__(self, generation):
+        self.generation = generation
+        self.built_at = time.monotonic()
+
+        # The permissions of the anonymous user: a dictionary of forum ID (or 'global') to set of
+        # permission codenames.
+        self.perms = None
+
+        # The IDs of the forums that are granted for a given list of permission codenames.
+        self.granted_forum_ids = {}
+
+
+class AnonymousPermissionSnapshot:
+    """ The process-level snapshot of the permissions of the anonymous user.
+
+    The snapshot is built lazily and is associated with a generation. The snapshot relies on the
+    generation of the permission cache if the latter is enabled, which allows to invalidate the
+    snapshots of all the processes at once. Otherwise the snapshot can only be invalidated in the
+    current process: it is then used only if the ``MACHINA_ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT``
+    setting is set, which defines the maximum age of a snapshot.
+
+    """
+
+    def __init__(self):
+        self._local_generation = 0
+        self._data = None
+
+    @property
+    def enabled(self):
+        """ Returns ``True`` if the anonymous permission snapshot can be used. """
+        return (
+            permission_cache.enabled or
+            machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT is not None
+        )
+
+    def get_generation(self):
+        """ Returns the generation that the snapshot should be associated with. """
+        if permission_cache.enabled:
+            return (permission_cache.get_generation(), self._local_generation)
+        return (None, self._local_generation)
+
+    async def aget_generation(self):
+        """ Asynchronous version of ``get_generation``. """
+        if permission_cache.enabled:
+            return (await permission_cache.aget_generation(), self._local_generation)
+        return (None, self._local_generation)
+
+    def get(self):
+        """ Returns the current snapshot data ; a new one is initialized if it is stale. """
+        return self._get_data(self.get_generation())
+
+    async def aget(self):
+        """ Asynchronous version of ``get``. """
+        return self._get_data(await self.aget_generation())
+
+    def _get_data(self, generation):
+        timeout = machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT
+        data = self._data
+        if (
+            data is None or
+            data.generation != generation or
+            (timeout is not None and time.monotonic() - data.built_at > timeout)
+        ):
+            data = self._data = AnonymousPermissionSnapshotData(generation)
+        return data
+
+    def invalidate(self):
+        """ Invalidates the snapshot of the current process.
+
+        The snapshot is invalidated again once the current transaction is committed so that a
+        snapshot built by another thread from the rows that were not committed yet is not reused.
+
+        """
+        self._invalidate()
+        transaction.on_commit(self._invalidate)
+
+    def _invalidate(self):
+        self._local_generation += 1
+        self._data = None
+
+
+snapshot = AnonymousPermissionSnapshot()
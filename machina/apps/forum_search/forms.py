@@ -11,13 +11,12 @@ from django.utils.translation import gettext_lazy as _
 from haystack.forms import FacetedSearchForm
 from haystack.inputs import AutoQuery
 
-from machina.core.db.models import get_model
 from machina.core.loading import get_class
 
 
-Forum = get_model('forum', 'Forum')
+get_permission_handler = get_class('forum_permission.registry', 'get_permission_handler')
 
-PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+forum_tree = get_class('forum.tree', 'forum_tree')
 
 
 class SearchForm(FacetedSearchForm):
@@ -47,7 +46,9 @@ class SearchForm(FacetedSearchForm):
         self.fields['q'].widget.attrs['placeholder'] = _('Keywords or phrase')
         self.fields['search_poster_name'].widget.attrs['placeholder'] = _('Poster name')
 
-        self.allowed_forums = PermissionHandler().get_readable_forums(Forum.objects.all(), user)
+        self.allowed_forums = get_permission_handler().get_readable_forums(
+            list(forum_tree.get()), user,
+        )
         if self.allowed_forums:
             self.fields['search_forums'].choices = [
                 (f.id, '{} {}'.format('-' * f.margin_level, f.name)) for f in self.allowed_forums
@@ -74,7 +75,7 @@ class SearchForm(FacetedSearchForm):
         if 'search_forums' in self.cleaned_data and self.cleaned_data['search_forums']:
             sqs = sqs.filter(forum__in=self.cleaned_data['search_forums'])
         else:
-            forum_ids = self.allowed_forums.values_list('id', flat=True)
+            forum_ids = [f.id for f in self.allowed_forums]
             sqs = sqs.filter(forum__in=forum_ids) if forum_ids else sqs.none()
 
         return sqs
@@ -6,8 +6,13 @@
 
 """
 
+import datetime as dt
+import sys
+from array import array
+
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from machina.core.loading import get_class
@@ -63,3 +68,78 @@ class AbstractTopicReadTrack(models.Model):
 
     def __str__(self):
         return '{} - {}'.format(self.user, self.topic)
+
+
+class AbstractTopicReadState(models.Model):
+    """ Represents the topics of a forum that have been read by a given user.
+
+    The topic read marks of a user in a forum are stored in a single row as a packed array of
+    (topic ID, mark time) pairs sorted by topic ID. Mark times are stored as a number of
+    microseconds since the epoch (UTC if time zone support is enabled).
+
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='topic_read_states', on_delete=models.CASCADE,
+        verbose_name=_('User'),
+    )
+    forum = models.ForeignKey(
+        'forum.Forum', related_name='topic_read_states', on_delete=models.CASCADE,
+        verbose_name=_('Forum'),
+    )
+    marks = models.BinaryField(default=b'', verbose_name=_('Topic read marks'))
+
+    class Meta:
+        abstract = True
+        app_label = 'forum_tracking'
+        unique_together = ['user', 'forum', ]
+        verbose_name = _('Topic read state')
+        verbose_name_plural = _('Topic read states')
+
+    def __str__(self):
+        return '{} - {}'.format(self.user, self.forum)
+
+    def get_marks(self):
+        """ Returns a dictionary of topic ID to the mark time of the topics read by the user. """
+        values = array('q')
+        values.frombytes(bytes(self.marks))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return {
+            values[i]: _micros_to_datetime(values[i + 1]) for i in range(0, len(values), 2)
+        }
+
+    def set_marks(self, marks):
+        """ Replaces the topic read marks using a dictionary of topic ID to mark time. """
+        values = array('q')
+        for topic_id in sorted(marks):
+            values.extend((topic_id, _datetime_to_micros(marks[topic_id])))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.marks = values.tobytes()
+
+    def update_marks(self, marks):
+        """ Merges a dictionary of topic ID to mark time into the topic read marks.
+
+        The most recent mark time is kept for the topics that were already marked as read.
+
+        """
+        current_marks = self.get_marks()
+        for topic_id, mark_time in marks.items():
+            if current_marks.get(topic_id, mark_time) <= mark_time:
+                current_marks[topic_id] = mark_time
+        self.set_marks(current_marks)
+
+
+_EPOCH = dt.datetime(1970, 1, 1)
+
+
+def _datetime_to_micros(value):
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, dt.timezone.utc)
+    return (value - _EPOCH) // dt.timedelta(microseconds=1)
+
+
+def _micros_to_datetime(value):
+    value = _EPOCH + dt.timedelta(microseconds=value)
+    return timezone.make_aware(value, dt.timezone.utc) if settings.USE_TZ else value
@@ -12,6 +12,7 @@ from machina.core.db.models import get_model
 
 
 ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+TopicReadState = get_model('forum_tracking', 'TopicReadState')
 TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
 
 
@@ -29,5 +30,13 @@ class TopicReadTrackAdmin(admin.ModelAdmin):
     list_filter = ('mark_time',)
 
 
+class TopicReadStateAdmin(admin.ModelAdmin):
+    """ The Topic Read State model admin. """
+
+    list_display = ('__str__', 'user', 'forum',)
+    exclude = ('marks',)
+
+
 admin.site.register(ForumReadTrack, ForumReadTrackAdmin)
+admin.site.register(TopicReadState, TopicReadStateAdmin)
 admin.site.register(TopicReadTrack, TopicReadTrackAdmin)
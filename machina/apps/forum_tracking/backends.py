@@ -0,0 +1,291 @@
+"""
+    Forum tracking backends
+    =======================
+
+    This module defines the backends used to store the topic read marks of users. The forum read
+    marks are always stored as ``ForumReadTrack`` rows; the backend used for the topic read marks
+    is defined by the ``MACHINA_TRACKING_BACKEND`` setting.
+
+"""
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+
+
+ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+Topic = get_model('forum_conversation', 'Topic')
+TopicReadState = get_model('forum_tracking', 'TopicReadState')
+TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+
+
+class BaseTrackingBackend:
+    """ Defines the operations provided by a topic read marks backend.
+
+    A topic is unread by a user if the user did not mark it as read since its last update. If the
+    topic itself is not marked as read, the read mark of its forum is considered instead. The
+    asynchronous methods run the synchronous ones in a thread by default.
+
+    """
+
+    def get_unread_topics_filter(self, user):
+        """ Returns a ``Q`` object that filters the topics that are unread by the given user. """
+        raise NotImplementedError
+
+    def get_updated_topics_filter(self, user):
+        """ Returns a ``Q`` object filtering the topics updated since they were marked as read.
+
+        Only the topics that are marked as read by the user, or whose forum is marked as read by
+        the user, are considered.
+
+        """
+        raise NotImplementedError
+
+    def mark_topic_read(self, topic, user):
+        """ Marks a topic as read by the given user at the current date. """
+        raise NotImplementedError
+
+    def upsert_topic_marks(self, marks):
+        """ Creates or updates topic read marks from a dictionary of (user ID, topic ID) to mark
+        time. The most recent mark time is kept for the topics that were already marked as read.
+        """
+        raise NotImplementedError
+
+    def count_forum_topic_marks(self, forum, user):
+        """ Returns the number of topics of the given forum that are marked as read by the user. """
+        raise NotImplementedError
+
+    def delete_forum_topic_marks(self, forum_ids, user):
+        """ Deletes the topic read marks of the user in the given forums. """
+        raise NotImplementedError
+
+    async def aget_unread_topics_filter(self, user):
+        """ Asynchronous version of ``get_unread_topics_filter``. """
+        return await sync_to_async(self.get_unread_topics_filter)(user)
+
+    async def aget_updated_topics_filter(self, user):
+        """ Asynchronous version of ``get_updated_topics_filter``. """
+        return await sync_to_async(self.get_updated_topics_filter)(user)
+
+    async def amark_topic_read(self, topic, user):
+        """ Asynchronous version of ``mark_topic_read``. """
+        return await sync_to_async(self.mark_topic_read)(topic, user)
+
+    async def acount_forum_topic_marks(self, forum, user):
+        """ Asynchronous version of ``count_forum_topic_marks``. """
+        return await sync_to_async(self.count_forum_topic_marks)(forum, user)
+
+    async def adelete_forum_topic_marks(self, forum_ids, user):
+        """ Asynchronous version of ``delete_forum_topic_marks``. """
+        return await sync_to_async(self.delete_forum_topic_marks)(forum_ids, user)
+
+
+class RowTrackingBackend(BaseTrackingBackend):
+    """ Stores each topic read mark in its own ``TopicReadTrack`` row.
+
+    This is the default backend. It requires one row per user and read topic, but the unread topics
+    are identified by the database without any additional query.
+
+    """
+
+    def get_unread_topics_filter(self, user):
+        last_update = Coalesce(OuterRef('last_post_on'), OuterRef('created'))
+        topic_tracks = TopicReadTrack.objects.filter(topic=OuterRef('pk'), user=user)
+        forum_tracks = ForumReadTrack.objects.filter(forum=OuterRef('forum_id'), user=user)
+        return (
+            ~Exists(topic_tracks.filter(mark_time__gte=last_update)) &
+            (Exists(topic_tracks) | ~Exists(forum_tracks.filter(mark_time__gte=last_update)))
+        )
+
+    def get_updated_topics_filter(self, user):
+        return (
+            Q(tracks__user=user, tracks__mark_time__lt=F('last_post_on')) |
+            Q(
+                forum__tracks__user=user, forum__tracks__mark_time__lt=F('last_post_on'),
+                tracks__isnull=True,
+            )
+        )
+
+    def mark_topic_read(self, topic, user):
+        topic_track, created = TopicReadTrack.objects.get_or_create(topic=topic, user=user)
+        if not created:
+            topic_track.save()  # mark_time filled
+
+    def upsert_topic_marks(self, marks):
+        # The mark times of the created tracks are set to the current date by the database layer
+        # (``auto_now``), so that the mark times of all the tracks are written afterwards.
+        filters = {
+            'user_id__in': {user_id for user_id, _ in marks},
+            'topic_id__in': {topic_id for _, topic_id in marks},
+        }
+        existing_mark_times = {
+            (user_id, topic_id): mark_time
+            for user_id, topic_id, mark_time in TopicReadTrack.objects.filter(**filters)
+            .values_list('user_id', 'topic_id', 'mark_time')
+        }
+        TopicReadTrack.objects.bulk_create(
+            [
+                TopicReadTrack(user_id=user_id, topic_id=topic_id)
+                for user_id, topic_id in marks if (user_id, topic_id) not in existing_mark_times
+            ],
+            ignore_conflicts=True,
+        )
+
+        tracks = []
+        for track in TopicReadTrack.objects.filter(**filters):
+            key = (track.user_id, track.topic_id)
+            if key in marks and existing_mark_times.get(key, marks[key]) <= marks[key]:
+                track.mark_time = marks[key]
+                tracks.append(track)
+        TopicReadTrack.objects.bulk_update(tracks, ['mark_time'])
+
+    def count_forum_topic_marks(self, forum, user):
+        return TopicReadTrack.objects.filter(topic__forum=forum, user=user).count()
+
+    def delete_forum_topic_marks(self, forum_ids, user):
+        TopicReadTrack.objects.filter(topic__forum_id__in=forum_ids, user=user).delete()
+
+    async def aget_unread_topics_filter(self, user):
+        return self.get_unread_topics_filter(user)
+
+    async def aget_updated_topics_filter(self, user):
+        return self.get_updated_topics_filter(user)
+
+    async def amark_topic_read(self, topic, user):
+        topic_track, created = await TopicReadTrack.objects.aget_or_create(topic=topic, user=user)
+        if not created:
+            await topic_track.asave()
+
+    async def acount_forum_topic_marks(self, forum, user):
+        return await TopicReadTrack.objects.filter(topic__forum=forum, user=user).acount()
+
+    async def adelete_forum_topic_marks(self, forum_ids, user):
+        await TopicReadTrack.objects.filter(topic__forum_id__in=forum_ids, user=user).adelete()
+
+
+class CompactTrackingBackend(BaseTrackingBackend):
+    """ Stores the topic read marks of a user in a forum in a single ``TopicReadState`` row.
+
+    The topic read marks are only exceptions to the read mark of their forum: they are deleted as
+    soon as the forum is marked as read, so that the read state of a user is made of one forum read
+    mark per forum plus the few topics read since. The topic read marks of the user are loaded when
+    a filter is built and the related topics are turned into a list of IDs: this backend trades
+    very large ``TopicReadTrack`` tables against one additional query per filter.
+
+    """
+
+    def get_unread_topics_filter(self, user):
+        marks = self._get_marks(user)
+        read_ids, unread_ids = self._split_marked_topic_ids(marks, include_created=True)
+        last_update = Coalesce(OuterRef('last_post_on'), OuterRef('created'))
+        forum_tracks = ForumReadTrack.objects.filter(forum=OuterRef('forum_id'), user=user)
+        return Q(id__in=unread_ids) | (
+            ~Q(id__in=read_ids | unread_ids) &
+            ~Exists(forum_tracks.filter(mark_time__gte=last_update))
+        )
+
+    def get_updated_topics_filter(self, user):
+        marks = self._get_marks(user)
+        _, updated_ids = self._split_marked_topic_ids(marks, include_created=False)
+        return Q(id__in=updated_ids) | (
+            ~Q(id__in=set(marks)) &
+            Q(forum__tracks__user=user, forum__tracks__mark_time__lt=F('last_post_on'))
+        )
+
+    def mark_topic_read(self, topic, user):
+        self._update_states({(user.pk, topic.forum_id): {topic.pk: now()}})
+
+    def upsert_topic_marks(self, marks):
+        forum_ids = dict(
+            Topic.objects
+            .filter(id__in={topic_id for _, topic_id in marks})
+            .values_list('id', 'forum_id')
+        )
+        states_marks = {}
+        for (user_id, topic_id), mark_time in marks.items():
+            if topic_id in forum_ids:
+                states_marks.setdefault((user_id, forum_ids[topic_id]), {})[topic_id] = mark_time
+        self._update_states(states_marks)
+
+    def count_forum_topic_marks(self, forum, user):
+        marks = self._get_marks(user)
+        return Topic.objects.filter(forum=forum, id__in=set(marks)).count() if marks else 0
+
+    def delete_forum_topic_marks(self, forum_ids, user):
+        TopicReadState.objects.filter(forum_id__in=forum_ids, user=user).delete()
+
+    def _get_marks(self, user):
+        """ Returns a dictionary of topic ID to mark time of all the topic read marks of a user. """
+        marks = {}
+        for state in TopicReadState.objects.filter(user=user):
+            marks.update(state.get_marks())
+        return marks
+
+    def _split_marked_topic_ids(self, marks, include_created):
+        """ Splits the IDs of the marked topics into the topics that are read and the topics that
+        have been updated since they were marked as read.
+
+        The creation date of the topics without posts is considered as their last update only if
+        ``include_created`` is ``True``.
+
+        """
+        read_ids, updated_ids = set(), set()
+        if not marks:
+            return read_ids, updated_ids
+        topics = Topic.objects.filter(id__in=set(marks)) \
+            .values_list('id', 'last_post_on', 'created')
+        for topic_id, last_post_on, created in topics:
+            last_update = last_post_on or (created if include_created else None)
+            if last_update is not None and marks[topic_id] < last_update:
+                updated_ids.add(topic_id)
+            else:
+                read_ids.add(topic_id)
+        return read_ids, updated_ids
+
+    def _update_states(self, states_marks):
+        """ Merges a dictionary of (user ID, forum ID) to topic read marks into the read states. """
+        with transaction.atomic():
+            states = {
+                (state.user_id, state.forum_id): state
+                for state in TopicReadState.objects.select_for_update().filter(
+                    user_id__in={user_id for user_id, _ in states_marks},
+                    forum_id__in={forum_id for _, forum_id in states_marks},
+                )
+            }
+            created_states, updated_states = [], []
+            for (user_id, forum_id), marks in sorted(states_marks.items()):
+                state = states.get((user_id, forum_id))
+                if state is None:
+                    state = TopicReadState(user_id=user_id, forum_id=forum_id)
+                    created_states.append(state)
+                else:
+                    updated_states.append(state)
+                state.update_marks(marks)
+
+            # A read state created concurrently for the same user and forum is kept as is: at
+            # worst, the related topics are displayed as unread until they are viewed again.
+            TopicReadState.objects.bulk_create(created_states, ignore_conflicts=True)
+            TopicReadState.objects.bulk_update(updated_states, ['marks'])
+
+
+_backends = {}
+
+
+def get_tracking_backend():
+    """ Returns the tracking backend defined by the ``MACHINA_TRACKING_BACKEND`` setting. """
+    dotted_path = machina_settings.TRACKING_BACKEND
+    if dotted_path not in _backends:
+        try:
+            _backends[dotted_path] = import_string(dotted_path)()
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                'Could not import MACHINA_TRACKING_BACKEND {}: {}'.format(dotted_path, e),
+            )
+    return _backends[dotted_path]
@@ -0,0 +1,119 @@
+"""
+    Forum tracking buffer
+    =====================
+
+    This module defines an abstraction allowing to defer the topic read marks generated by topic
+    views. The marks are appended to a buffer stored in a Django cache and written to the database
+    in batches (see the ``flush_read_marks`` management command).
+
+"""
+
+import time
+
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
+from machina.core.buffer import CacheBuffer
+
+
+class ReadMarkBuffer(CacheBuffer):
+    """ The topic read mark buffer.
+
+    The buffer is enabled only if the ``MACHINA_TRACKING_BUFFER_CACHE_NAME`` setting is set. Each
+    buffered mark is a (user ID, topic ID, mark time) three-tuple. The marks of each user are also
+    kept in a short-lived overlay so that the topics viewed by a user are not displayed as unread to
+    this user before the marks are flushed.
+
+    """
+
+    cache_name_setting = 'TRACKING_BUFFER_CACHE_NAME'
+    verbose_name = 'tracking buffer'
+    key_prefix = 'machina:forum_tracking:marks'
+    overlay_key_prefix = 'machina:forum_tracking:overlay'
+
+    # The maximum number of marks kept in the overlay of a user.
+    overlay_size = 50
+    overlay_lock_timeout = 5
+    overlay_lock_attempts = 3
+
+    def add(self, topic, user, mark_time=None):
+        """ Appends a read mark of the given topic by the given user to the buffer. """
+        backend = self.get_backend()
+        mark_time = mark_time or now()
+        self._append(backend, (user.pk, topic.pk, mark_time))
+
+        def add_to_overlay(overlay):
+            overlay[topic.pk] = max(mark_time, overlay.get(topic.pk, mark_time))
+            if len(overlay) > self.overlay_size:
+                # The oldest marks are dropped first: they are the most likely to be flushed.
+                overlay = dict(
+                    sorted(overlay.items(), key=lambda item: item[1])[-self.overlay_size:],
+                )
+            return overlay
+
+        self._update_overlay(backend, user.pk, add_to_overlay)
+
+    def flush(self, apply, batch_size=1000):
+        """ Writes the buffered marks to the database using the given ``apply`` callable.
+
+        The marks are passed to ``apply`` by batches of at most ``batch_size`` marks, in the order
+        in which they were appended. The marks of a batch are removed from the buffer (and from the
+        overlays of their users) only once ``apply`` returns. Returns the number of marks that have
+        been flushed, or ``0`` if the buffer is being flushed by another process.
+
+        """
+        return super().flush(apply, batch_size=batch_size)
+
+    def get_overlay(self, user):
+        """ Returns a dictionary of topic ID to the mark time of the recent marks of a user. """
+        if not self.enabled or not user.is_authenticated:
+            return {}
+        return self.get_backend().get(self._get_overlay_key(user.pk)) or {}
+
+    def _on_batch_flushed(self, backend, marks):
+        self._prune_overlays(backend, marks)
+
+    def _prune_overlays(self, backend, marks):
+        """ Removes the marks that have been written from the overlays of their users. """
+        flushed_marks = {}
+        for user_id, topic_id, mark_time in marks:
+            user_marks = flushed_marks.setdefault(user_id, {})
+            user_marks[topic_id] = max(mark_time, user_marks.get(topic_id, mark_time))
+
+        for user_id, user_marks in flushed_marks.items():
+            self._update_overlay(backend, user_id, lambda overlay: {
+                topic_id: mark_time for topic_id, mark_time in overlay.items()
+                if topic_id not in user_marks or mark_time > user_marks[topic_id]
+            })
+
+    def _update_overlay(self, backend, user_id, update):
+        """ Replaces the overlay of a user by the result of ``update`` under a short-lived lock.
+
+        The overlay is left untouched if the lock can't be acquired: the overlay only prevents
+        recently read topics from being displayed as unread until the marks are flushed.
+
+        """
+        overlay_key = self._get_overlay_key(user_id)
+        lock_key = '{}:lock'.format(overlay_key)
+        for attempt in range(self.overlay_lock_attempts):
+            if backend.add(lock_key, True, timeout=self.overlay_lock_timeout):
+                break
+            time.sleep(0.01 * (attempt + 1))
+        else:
+            return
+        try:
+            overlay = update(backend.get(overlay_key) or {})
+            if overlay:
+                backend.set(
+                    overlay_key, overlay, machina_settings.TRACKING_BUFFER_OVERLAY_TIMEOUT,
+                )
+            else:
+                backend.delete(overlay_key)
+        finally:
+            backend.delete(lock_key)
+
+    def _get_overlay_key(self, user_id):
+        return '{}:{}'.format(self.overlay_key_prefix, user_id)
+
+
+read_mark_buffer = ReadMarkBuffer()
@@ -7,36 +7,103 @@
 
 """
 
-from django.db.models import F, Q
+import copy
 
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import BooleanField, Case, Q, QuerySet, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
 from machina.core.loading import get_class
 
 
 Forum = get_model('forum', 'Forum')
 ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
-TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+Topic = get_model('forum_conversation', 'Topic')
+
+get_permission_handler = get_class('forum_permission.registry', 'get_permission_handler')
+get_tracking_backend = get_class('forum_tracking.backends', 'get_tracking_backend')
+read_mark_buffer = get_class('forum_tracking.buffer', 'read_mark_buffer')
 
-PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+forum_tree = get_class('forum.tree', 'forum_tree')
 
 
 class TrackingHandler:
     """ Provides utility methods to compute unread forums and topics.
 
     The TrackingHandler allows to filter list of forums and list of topics in order to get only the
-    forums which contain unread topics or the unread topics.
+    forums which contain unread topics or the unread topics. Asynchronous counterparts of the
+    public methods, prefixed with ``a``, are also provided. The topic read marks are stored using
+    the backend defined by the ``MACHINA_TRACKING_BACKEND`` setting.
 
     """
 
+    # The trackers of forums used to compute the unread forums.
+    forum_tracker_fields = ('direct_topics_count', 'last_post_on', 'subtree_last_post_on')
+
     def __init__(self, request=None):
         self.request = request
-        self.perm_handler = request.forum_permission_handler if request \
-            else PermissionHandler()
+
+    @property
+    def perm_handler(self):
+        """ Returns the permission handler of the request or of the current context.
+
+        The handler is resolved lazily so that a tracking handler created outside of the
+        request-response cycle (eg. at import time) reuses the permission handler of the request
+        being processed.
+
+        """
+        return self.request.forum_permission_handler if self.request \
+            else get_permission_handler()
+
+    @property
+    def tracking_backend(self):
+        """ Returns the backend used to store the topic read marks. """
+        return get_tracking_backend()
 
     def get_unread_forums(self, user):
         """ Returns the list of unread forums for the given user. """
+        if not user.is_authenticated:
+            return []
+        readable_forums = self.perm_handler.get_readable_forums(list(forum_tree.get()), user)
+        trackers = Forum.objects.order_by().values_list('id', *self.forum_tracker_fields)
         return self.get_unread_forums_from_list(
-            user, self.perm_handler.get_readable_forums(Forum.objects.all(), user))
+            user, self._get_forums_with_trackers(readable_forums, trackers),
+        )
+
+    async def aget_unread_forums(self, user):
+        """ Asynchronous version of ``get_unread_forums``. """
+        if not user.is_authenticated:
+            return []
+        readable_forums = await self.perm_handler.aget_readable_forums(
+            list(await forum_tree.aget()), user,
+        )
+        trackers = Forum.objects.order_by().values_list('id', *self.forum_tracker_fields)
+        return await self.aget_unread_forums_from_list(
+            user,
+            self._get_forums_with_trackers(readable_forums, [t async for t in trackers]),
+        )
+
+    def _get_forums_with_trackers(self, forums, trackers):
+        """ Returns copies of the given forums of the tree snapshot with the given trackers.
+
+        The trackers of the forums of the tree snapshot can be outdated (the snapshot is not
+        invalidated when they are updated): only the trackers that are used to compute the unread
+        forums are loaded again, without filtering the forums by ID.
+
+        """
+        trackers = {forum_id: values for forum_id, *values in trackers}
+        forums_with_trackers = []
+        for forum in forums:
+            # The forums of the tree snapshot are shared: they must not be modified.
+            forum = copy.copy(forum)
+            for name, value in zip(self.forum_tracker_fields, trackers.get(forum.id, ())):
+                setattr(forum, name, value)
+            forums_with_trackers.append(forum)
+        return forums_with_trackers
 
     def get_unread_forums_from_list(self, user, forums):
         """ Returns the list of unread forums for the given user from a given list of forums. """
@@ -46,72 +113,246 @@ class TrackingHandler:
         if not user.is_authenticated:
             return unread_forums
 
-        unread = ForumReadTrack.objects.get_unread_forums_from_list(forums, user)
+        unread = ForumReadTrack.objects.get_unread_forums_from_list(
+            forums, user, read_forum_ids=self._get_overlay_read_forum_ids(user),
+        )
         unread_forums.extend(unread)
 
         return unread_forums
 
+    async def aget_unread_forums_from_list(self, user, forums):
+        """ Asynchronous version of ``get_unread_forums_from_list``. """
+        if not user.is_authenticated:
+            return []
+        return await ForumReadTrack.objects.aget_unread_forums_from_list(
+            forums, user, read_forum_ids=await self._aget_overlay_read_forum_ids(user),
+        )
+
     def get_unread_topics(self, topics, user):
-        """ Returns a list of unread topics for the given user from a given set of topics. """
-        unread_topics = []
+        """ Returns a list of unread topics for the given user from a given set of topics.
 
+        The unread topics are returned in the order of the considered topics. If these topics have
+        been annotated using ``annotate_unread_topics``, no additional query is performed.
+
+        """
         # A user which is not authenticated will never see a topic as unread.
         # If there are no topics to consider, we stop here.
         if not user.is_authenticated or topics is None or not len(topics):
-            return unread_topics
-
-        # A topic can be unread if a track for itself exists with a mark time that
-        # is less important than its update date.
-        topic_ids = [topic.id for topic in topics]
-        topic_tracks = TopicReadTrack.objects.filter(topic__in=topic_ids, user=user)
-        tracked_topics = dict(topic_tracks.values_list('topic__pk', 'mark_time'))
-
-        if tracked_topics:
-            for topic in topics:
-                topic_last_modification_date = topic.last_post_on or topic.created
-                if (
-                    topic.id in tracked_topics.keys() and
-                    topic_last_modification_date > tracked_topics[topic.id]
-                ):
-                    unread_topics.append(topic)
-
-        # A topic can be unread if a track for its associated forum exists with
-        # a mark time that is less important than its creation or update date.
-        forum_ids = [topic.forum_id for topic in topics]
-        forum_tracks = ForumReadTrack.objects.filter(forum_id__in=forum_ids, user=user)
-        tracked_forums = dict(forum_tracks.values_list('forum__pk', 'mark_time'))
-
-        if tracked_forums:
-            for topic in topics:
-                topic_last_modification_date = topic.last_post_on or topic.created
-                if (
-                    (topic.forum_id in tracked_forums.keys() and topic.id not in tracked_topics) and
-                    topic_last_modification_date > tracked_forums[topic.forum_id]
-                ):
-                    unread_topics.append(topic)
-
-        # A topic can be unread if no tracks exists for it
-        for topic in topics:
-            if topic.forum_id not in tracked_forums and topic.id not in tracked_topics:
-                unread_topics.append(topic)
-
-        return list(set(unread_topics))
+            return []
+
+        if self._are_annotated(topics):
+            return [topic for topic in topics if topic.is_unread]
+
+        unread_topic_ids = set(
+            self._get_unread_topic_ids(topics, self.get_unread_topics_filter(user)),
+        )
+        return [topic for topic in topics if topic.id in unread_topic_ids]
+
+    async def aget_unread_topics(self, topics, user):
+        """ Asynchronous version of ``get_unread_topics``. """
+        if isinstance(topics, QuerySet):
+            topics = [topic async for topic in topics]
+        if not user.is_authenticated or topics is None or not len(topics):
+            return []
+
+        if self._are_annotated(topics):
+            return [topic for topic in topics if topic.is_unread]
+
+        unread_topic_ids = {
+            topic_id async for topic_id in
+            self._get_unread_topic_ids(topics, await self.aget_unread_topics_filter(user))
+        }
+        return [topic for topic in topics if topic.id in unread_topic_ids]
+
+    def annotate_unread_topics(self, topics, user):
+        """ Annotates a queryset of topics with an ``is_unread`` flag for the given user.
+
+        The unread status of the topics is computed by the database in the same query as the topics
+        themselves.
+
+        """
+        if not user.is_authenticated:
+            return topics.annotate(is_unread=Value(False, output_field=BooleanField()))
+        return topics.annotate(
+            is_unread=Case(
+                When(self.get_unread_topics_filter(user), then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ),
+        )
+
+    def get_unread_topics_filter(self, user):
+        """ Returns a ``Q`` object that filters the topics that are unread by the given user.
+
+        A topic is unread if the user did not mark it as read since its last update. If the topic
+        itself is not tracked, the track of its forum is considered instead. Topics whose forum is
+        not tracked either are unread.
+
+        """
+        return self._apply_read_mark_overlay(
+            self.tracking_backend.get_unread_topics_filter(user),
+            self._get_overlay_read_topics(user),
+        )
+
+    async def aget_unread_topics_filter(self, user):
+        """ Asynchronous version of ``get_unread_topics_filter``. """
+        return self._apply_read_mark_overlay(
+            await self.tracking_backend.aget_unread_topics_filter(user),
+            await self._aget_overlay_read_topics(user),
+        )
+
+    def _apply_read_mark_overlay(self, unread_filter, overlay_read_topics):
+        # The topics read by the user whose read marks are not flushed yet are excluded.
+        if overlay_read_topics:
+            unread_filter &= ~Q(id__in=sorted(overlay_read_topics))
+        return unread_filter
+
+    def _get_overlay_read_topics(self, user):
+        """ Returns the topics read by the user according to the read mark overlay.
+
+        The read mark overlay holds the most recent read marks of the user that are not flushed yet,
+        keyed by topic: a topic of the overlay is read if it was not updated since it was marked as
+        read. The read topics are returned as a dictionary of topic ID to forum ID.
+
+        """
+        overlay = read_mark_buffer.get_overlay(user)
+        if not overlay:
+            return {}
+        return self._filter_overlay_read_topics(overlay, self._get_overlay_topics(overlay))
+
+    async def _aget_overlay_read_topics(self, user):
+        overlay = read_mark_buffer.get_overlay(user)
+        if not overlay:
+            return {}
+        return self._filter_overlay_read_topics(
+            overlay, [topic async for topic in self._get_overlay_topics(overlay)],
+        )
+
+    def _get_overlay_topics(self, overlay):
+        return (
+            Topic.objects
+            .filter(id__in=sorted(overlay))
+            .annotate(last_update=Coalesce('last_post_on', 'created'))
+            .values_list('id', 'forum_id', 'last_update')
+        )
+
+    def _filter_overlay_read_topics(self, overlay, topics):
+        return {
+            topic_id: forum_id for topic_id, forum_id, last_update in topics
+            if last_update <= overlay[topic_id]
+        }
+
+    def _get_overlay_read_forum_ids(self, user):
+        """ Returns the IDs of the forums whose topics are all read according to the overlay.
+
+        These forums would be marked as read once the read marks of the overlay are flushed.
+
+        """
+        overlay_read_topics = self._get_overlay_read_topics(user)
+        if not overlay_read_topics:
+            return set()
+        unread_filter = self._apply_read_mark_overlay(
+            self.tracking_backend.get_unread_topics_filter(user), overlay_read_topics,
+        )
+        forum_ids = set(overlay_read_topics.values())
+        return forum_ids - set(self._get_unread_topics_forum_ids(forum_ids, unread_filter))
+
+    async def _aget_overlay_read_forum_ids(self, user):
+        overlay_read_topics = await self._aget_overlay_read_topics(user)
+        if not overlay_read_topics:
+            return set()
+        unread_filter = self._apply_read_mark_overlay(
+            await self.tracking_backend.aget_unread_topics_filter(user), overlay_read_topics,
+        )
+        forum_ids = set(overlay_read_topics.values())
+        return forum_ids - {
+            forum_id async for forum_id in
+            self._get_unread_topics_forum_ids(forum_ids, unread_filter)
+        }
+
+    def _get_unread_topics_forum_ids(self, forum_ids, unread_filter):
+        return (
+            Topic.approved_objects
+            .filter(forum_id__in=forum_ids)
+            .filter(unread_filter)
+            .order_by()
+            .values_list('forum_id', flat=True)
+            .distinct()
+        )
+
+    def get_unread_topics_queryset(self, user):
+        """ Returns a queryset of the approved topics that are unread by the given user.
+
+        Only the topics of the forums that can be read by the user are considered. The unread status
+        of the topics is computed by the database, so that the topics are never loaded in memory.
+
+        """
+        if not user.is_authenticated:
+            return Topic.objects.none()
+
+        forums = self.perm_handler.get_readable_forums(Forum.objects.all(), user)
+        return (
+            Topic.approved_objects
+            .filter(forum__in=forums)
+            .filter(self.get_unread_topics_filter(user))
+        )
+
+    def get_unread_topics_count(self, user, limit=None):
+        """ Returns the number of topics that are unread by the given user.
+
+        The count stops at ``limit`` topics (``MACHINA_UNREAD_TOPICS_COUNT_LIMIT`` by default) so
+        that it remains cheap for users with a large number of unread topics.
+
+        """
+        limit = limit or machina_settings.UNREAD_TOPICS_COUNT_LIMIT
+        return self.get_unread_topics_queryset(user).values('id')[:limit].count()
+
+    def _are_annotated(self, topics):
+        return all(hasattr(topic, 'is_unread') for topic in topics)
+
+    def _get_unread_topic_ids(self, topics, unread_filter):
+        """ Returns a queryset of the IDs of the unread topics among the given topics. """
+        return (
+            Topic.objects
+            .filter(id__in=[topic.id for topic in topics])
+            .filter(unread_filter)
+            .values_list('id', flat=True)
+        )
 
     def mark_forums_read(self, forums, user):
-        """ Marks a list of forums as read. """
+        """ Marks a list of forums as read.
+
+        The tracks of all the forums are created or updated at once using the same mark time, inside
+        a transaction.
+
+        """
         if not forums or not user.is_authenticated:
             return
 
         forums = sorted(forums, key=lambda f: f.level)
+        forum_ids = [forum.id for forum in forums]
+
+        with transaction.atomic():
+            # Update all forum tracks to the current date for the considered forums
+            self._upsert_forum_tracks(forum_ids, user)
+            # Delete all the unnecessary topic read marks
+            self.tracking_backend.delete_forum_topic_marks(forum_ids, user)
+            # Update parent forum tracks
+            self._update_parent_forum_tracks(forums[0], user)
+
+    async def amark_forums_read(self, forums, user):
+        """ Asynchronous version of ``mark_forums_read``. """
+        if isinstance(forums, QuerySet):
+            forums = [forum async for forum in forums]
+        if not forums or not user.is_authenticated:
+            return
 
-        # Update all forum tracks to the current date for the considered forums
-        for forum in forums:
-            forum_track = ForumReadTrack.objects.get_or_create(forum=forum, user=user)[0]
-            forum_track.save()
-        # Delete all the unnecessary topic tracks
-        TopicReadTrack.objects.filter(topic__forum__in=forums, user=user).delete()
-        # Update parent forum tracks
-        self._update_parent_forum_tracks(forums[0], user)
+        forums = sorted(forums, key=lambda f: f.level)
+        forum_ids = [forum.id for forum in forums]
+
+        await self._aupsert_forum_tracks(forum_ids, user)
+        await self.tracking_backend.adelete_forum_topic_marks(forum_ids, user)
+        await self._aupdate_parent_forum_tracks(forums[0], user)
 
     def mark_topic_read(self, topic, user):
         """ Marks a topic as read. """
@@ -128,63 +369,230 @@ class TrackingHandler:
             forum_track is None or
             (topic.last_post_on and forum_track.mark_time < topic.last_post_on)
         ):
-            topic_track, created = TopicReadTrack.objects.get_or_create(topic=topic, user=user)
-            if not created:
-                topic_track.save()  # mark_time filled
-
-            # If no other topic is unread inside the considered forum, the latter should also be
-            # marked as read.
-            unread_topics = (
-                forum.topics
-                .filter(
-                    Q(tracks__user=user, tracks__mark_time__lt=F('last_post_on')) |
-                    Q(
-                        forum__tracks__user=user, forum__tracks__mark_time__lt=F('last_post_on'),
-                        tracks__isnull=True,
-                    )
+            self.tracking_backend.mark_topic_read(topic, user)
+            self._update_forum_track(forum, user, forum_track is not None, topic)
+
+    def buffer_topic_read(self, topic, user):
+        """ Marks a topic as read using the read mark buffer.
+
+        The mark is only written to the database when the buffer is flushed (see
+        ``flush_read_marks``). In the meantime, the topic is not considered unread by the user.
+
+        """
+        if not user.is_authenticated:
+            return
+        read_mark_buffer.add(topic, user)
+
+    def flush_read_marks(self, batch_size=1000):
+        """ Writes the read marks of the read mark buffer to the database.
+
+        The marks are processed by batches of ``batch_size`` marks. Returns the number of marks that
+        have been flushed, or ``0`` if the buffer is being flushed by another process.
+
+        """
+        return read_mark_buffer.flush(self.apply_read_marks, batch_size=batch_size)
+
+    def apply_read_marks(self, marks):
+        """ Writes a list of (user ID, topic ID, mark time) topic read marks to the database.
+
+        The marks of the same topic by the same user are coalesced. The topic read marks are created
+        or updated using bulk queries, then the forums whose topics have all been read are marked as
+        read.
+
+        """
+        latest_marks = {}
+        for user_id, topic_id, mark_time in marks:
+            if latest_marks.get((user_id, topic_id), mark_time) <= mark_time:
+                latest_marks[(user_id, topic_id)] = mark_time
+
+        users = get_user_model()._default_manager.in_bulk({user_id for user_id, _ in latest_marks})
+        topics = Topic.objects.in_bulk({topic_id for _, topic_id in latest_marks})
+        forum_tracks = {
+            (user_id, forum_id): mark_time
+            for user_id, forum_id, mark_time in ForumReadTrack.objects.filter(
+                user_id__in=users, forum_id__in={topic.forum_id for topic in topics.values()},
+            ).values_list('user_id', 'forum_id', 'mark_time')
+        }
+
+        # The marks of deleted users or topics and of topics that are already read through the
+        # track of their forum are ignored, as in ``mark_topic_read``.
+        pending_marks = {}
+        for (user_id, topic_id), mark_time in latest_marks.items():
+            topic = topics.get(topic_id)
+            if topic is None or user_id not in users:
+                continue
+            forum_mark_time = forum_tracks.get((user_id, topic.forum_id))
+            if (
+                forum_mark_time is None or
+                (topic.last_post_on and forum_mark_time < topic.last_post_on)
+            ):
+                pending_marks[(user_id, topic_id)] = mark_time
+        if not pending_marks:
+            return
+
+        with transaction.atomic():
+            self.tracking_backend.upsert_topic_marks(pending_marks)
+
+            forums = Forum.objects.in_bulk({topic.forum_id for topic in topics.values()})
+            for user_id, forum_id in sorted({
+                (user_id, topics[topic_id].forum_id) for user_id, topic_id in pending_marks
+            }):
+                self._update_forum_track(
+                    forums[forum_id], users[user_id], (user_id, forum_id) in forum_tracks,
                 )
-                .exclude(id=topic.id)
-            )
 
-            forum_topic_tracks = TopicReadTrack.objects.filter(topic__forum=forum, user=user)
+    async def amark_topic_read(self, topic, user):
+        """ Asynchronous version of ``mark_topic_read``. """
+        if not user.is_authenticated:
+            return
+
+        forum = (
+            topic.forum if Topic.forum.is_cached(topic)
+            else await Forum.objects.aget(pk=topic.forum_id)
+        )
+        try:
+            forum_track = await ForumReadTrack.objects.aget(forum=forum, user=user)
+        except ForumReadTrack.DoesNotExist:
+            forum_track = None
+
+        if (
+            forum_track is None or
+            (topic.last_post_on and forum_track.mark_time < topic.last_post_on)
+        ):
+            backend = self.tracking_backend
+            await backend.amark_topic_read(topic, user)
+
+            unread_topics = self._get_unread_forum_topics(
+                forum, await backend.aget_updated_topics_filter(user),
+            ).exclude(id=topic.id)
+
             if (
-                not unread_topics.exists() and
+                not await unread_topics.aexists() and
                 (
                     forum_track is not None or
-                    forum_topic_tracks.count() == forum.topics.filter(approved=True).count()
+                    await backend.acount_forum_topic_marks(forum, user) ==
+                    await forum.topics.filter(approved=True).acount()
                 )
             ):
-                # The topics that are marked as read inside the forum for the given user will be
-                # deleted while the forum track associated with the user must be created or updated.
-                # This is done only if there are as many topic tracks as approved topics in case
-                # the related forum has not beem previously marked as read.
-                TopicReadTrack.objects.filter(topic__forum=forum, user=user).delete()
-                forum_track, _ = ForumReadTrack.objects.get_or_create(forum=forum, user=user)
-                forum_track.save()
+                await backend.adelete_forum_topic_marks([forum.id], user)
+                forum_track, _ = await ForumReadTrack.objects.aget_or_create(
+                    forum=forum, user=user,
+                )
+                await forum_track.asave()
 
-                # Update parent forum tracks
-                self._update_parent_forum_tracks(forum, user)
+                await self._aupdate_parent_forum_tracks(forum, user)
 
-    def _update_parent_forum_tracks(self, forum, user):
-        for forum in forum.get_ancestors(ascending=True):
-            # If no other topics are unread inside the considered forum, the latter should also
-            # be marked as read.
-            unread_topics = (
-                forum.topics
-                .filter(
-                    Q(tracks__user=user, tracks__mark_time__lt=F('last_post_on')) |
-                    Q(
-                        forum__tracks__user=user, forum__tracks__mark_time__lt=F('last_post_on'),
-                        tracks__isnull=True,
-                    ),
-                )
+    def _update_forum_track(self, forum, user, forum_tracked, topic=None):
+        """ Marks a forum as read if all its topics have been read by the user. """
+        # If no other topic is unread inside the considered forum, the latter should also be
+        # marked as read.
+        backend = self.tracking_backend
+        unread_topics = self._get_unread_forum_topics(
+            forum, backend.get_updated_topics_filter(user),
+        )
+        if topic is not None:
+            unread_topics = unread_topics.exclude(id=topic.id)
+
+        if (
+            not unread_topics.exists() and
+            (
+                forum_tracked or
+                backend.count_forum_topic_marks(forum, user) ==
+                forum.topics.filter(approved=True).count()
             )
-            if unread_topics.exists():
+        ):
+            # The topics that are marked as read inside the forum for the given user will be
+            # deleted while the forum track associated with the user must be created or updated.
+            # This is done only if there are as many topic read marks as approved topics in case
+            # the related forum has not beem previously marked as read.
+            backend.delete_forum_topic_marks([forum.id], user)
+            self._upsert_forum_tracks([forum.id], user)
+
+            # Update parent forum tracks
+            self._update_parent_forum_tracks(forum, user)
+
+    def _upsert_forum_tracks(self, forum_ids, user):
+        """ Creates or updates the tracks of the given forums using the same mark time. """
+        ForumReadTrack.objects.bulk_create(
+            [ForumReadTrack(forum_id=forum_id, user=user) for forum_id in forum_ids],
+            ignore_conflicts=True,
+        )
+        ForumReadTrack.objects.filter(forum_id__in=forum_ids, user=user).update(mark_time=now())
+
+    async def _aupsert_forum_tracks(self, forum_ids, user):
+        """ Asynchronous version of ``_upsert_forum_tracks``. """
+        await ForumReadTrack.objects.abulk_create(
+            [ForumReadTrack(forum_id=forum_id, user=user) for forum_id in forum_ids],
+            ignore_conflicts=True,
+        )
+        await ForumReadTrack.objects.filter(forum_id__in=forum_ids, user=user) \
+            .aupdate(mark_time=now())
+
+    def _update_parent_forum_tracks(self, forum, user):
+        """ Marks the ancestors of a forum as read, up to the first one with unread topics.
+
+        The ancestors with unread topics are determined using a single query relying on the MPTT
+        interval of the forum, so that the number of queries does not depend on the depth of the
+        forum.
+
+        """
+        ancestor_ids = list(
+            forum.get_ancestors(ascending=True).values_list('id', flat=True),
+        )
+        if not ancestor_ids:
+            return
+
+        backend = self.tracking_backend
+        unread_forum_ids = set(
+            self._get_unread_ancestor_topics(forum, backend.get_updated_topics_filter(user))
+            .values_list('forum_id', flat=True),
+        )
+        forum_ids = self._get_ancestor_ids_to_mark(ancestor_ids, unread_forum_ids)
+        if forum_ids:
+            # The topics that are marked as read inside the forums for the given user will be
+            # deleted while the forum tracks associated with the user must be created or updated.
+            backend.delete_forum_topic_marks(forum_ids, user)
+            self._upsert_forum_tracks(forum_ids, user)
+
+    async def _aupdate_parent_forum_tracks(self, forum, user):
+        ancestor_ids = [
+            forum_id async for forum_id in
+            forum.get_ancestors(ascending=True).values_list('id', flat=True)
+        ]
+        if not ancestor_ids:
+            return
+
+        backend = self.tracking_backend
+        unread_forum_ids = {
+            forum_id async for forum_id in
+            self._get_unread_ancestor_topics(forum, await backend.aget_updated_topics_filter(user))
+            .values_list('forum_id', flat=True)
+        }
+        forum_ids = self._get_ancestor_ids_to_mark(ancestor_ids, unread_forum_ids)
+        if forum_ids:
+            await backend.adelete_forum_topic_marks(forum_ids, user)
+            await self._aupsert_forum_tracks(forum_ids, user)
+
+    def _get_ancestor_ids_to_mark(self, ancestor_ids, unread_forum_ids):
+        """ Returns the IDs of the ancestors preceding the first one with unread topics. """
+        forum_ids = []
+        for forum_id in ancestor_ids:
+            if forum_id in unread_forum_ids:
                 break
+            forum_ids.append(forum_id)
+        return forum_ids
+
+    def _get_unread_ancestor_topics(self, forum, updated_topics_filter):
+        """ Returns a queryset of the unread topics of the ancestors of a forum. """
+        return (
+            Topic.objects
+            .filter(
+                forum__tree_id=forum.tree_id, forum__lft__lt=forum.lft, forum__rght__gt=forum.rght,
+            )
+            .filter(updated_topics_filter)
+            .distinct()
+        )
 
-            # The topics that are marked as read inside the forum for the given user
-            # wil be deleted while the forum track associated with the user must be
-            # created or updated.
-            TopicReadTrack.objects.filter(topic__forum=forum, user=user).delete()
-            forum_track, _ = ForumReadTrack.objects.get_or_create(forum=forum, user=user)
-            forum_track.save()
+    def _get_unread_forum_topics(self, forum, updated_topics_filter):
+        """ Returns a queryset of the topics of the forum that are unread by the user. """
+        return forum.topics.filter(updated_topics_filter)
@@ -0,0 +1,35 @@
+"""
+    Flush read marks command
+    ========================
+
+    This module defines a management command allowing to write the buffered topic read marks to the
+    database.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from machina.core.loading import get_class
+
+
+TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
+
+read_mark_buffer = get_class('forum_tracking.buffer', 'read_mark_buffer')
+
+
+class Command(BaseCommand):
+    help = 'Writes the buffered topic read marks to the database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='The number of read marks written at once.',
+        )
+
+    def handle(self, *args, **options):
+        if not read_mark_buffer.enabled:
+            raise CommandError('The read mark buffer is not enabled')
+
+        count = TrackingHandler().flush_read_marks(batch_size=options['batch_size'])
+
+        self.stdout.write('{} read mark(s) flushed'.format(count))
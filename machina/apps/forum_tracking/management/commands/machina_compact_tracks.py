@@ -0,0 +1,252 @@
+"""
+    Compact tracks command
+    ======================
+
+    This module defines a management command allowing to delete the topic tracks that are made
+    redundant by forum tracks and to collapse the topic tracks of inactive users into forum tracks.
+
+"""
+
+import datetime as dt
+import time
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, Min, OuterRef, Q
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from machina.core.db.models import get_model
+
+
+ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+Topic = get_model('forum_conversation', 'Topic')
+TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+
+
+class Command(BaseCommand):
+    help = 'Deletes the topic tracks that are made redundant by forum tracks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='The number of rows processed in each transaction.',
+        )
+        parser.add_argument(
+            '--inactive-days', type=int,
+            help=(
+                'Collapse the topic tracks of the users who did not log in during this number of '
+                'days into forum tracks.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        deleted_count = self.delete_redundant_topic_tracks(options['batch_size'])
+        collapsed_count = 0
+        if options['inactive_days'] is not None:
+            collapsed_count = self.collapse_inactive_users_topic_tracks(
+                now() - dt.timedelta(days=options['inactive_days']), options['batch_size'],
+            )
+        duration = time.monotonic() - start
+
+        self.stdout.write(
+            '{} redundant topic track(s) deleted, {} topic track(s) of inactive users collapsed '
+            'in {:.2f}s ({:.0f} rows/s)'.format(
+                deleted_count, collapsed_count, duration,
+                (deleted_count + collapsed_count) / duration if duration else 0,
+            ),
+        )
+
+    def delete_redundant_topic_tracks(self, batch_size):
+        """ Deletes the topic tracks whose mark time is not later than the one of their forum track.
+
+        Such a topic track can only cause its topic to be displayed as unread even though the forum
+        of the topic has been marked as read since. The tracks are deleted by batches, each batch
+        in its own transaction. The condition is checked again when the tracks are deleted, so that
+        the tracks updated in the meantime are kept.
+
+        """
+        redundant_filter = Exists(
+            ForumReadTrack.objects.filter(
+                user=OuterRef('user_id'), forum=OuterRef('topic__forum_id'),
+                mark_time__gte=OuterRef('mark_time'),
+            ),
+        )
+        redundant_tracks = TopicReadTrack.objects.filter(redundant_filter).order_by('id')
+
+        count = 0
+        last_id = 0
+        while True:
+            # The IDs of each batch are loaded before the tracks are deleted, so that the table is
+            # never read and modified at the same time.
+            batch = list(
+                redundant_tracks.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size],
+            )
+            if not batch:
+                return count
+            last_id = batch[-1]
+            with transaction.atomic():
+                count += TopicReadTrack.objects \
+                    .filter(redundant_filter, id__in=batch) \
+                    .delete()[0]
+
+    def collapse_inactive_users_topic_tracks(self, last_login_before, batch_size):
+        """ Replaces the topic tracks of inactive users by forum tracks.
+
+        The topic tracks of a user who did not log in since ``last_login_before`` (or who never
+        logged in) are processed user by user, each user in its own transaction. In each forum, the
+        forum track of the user is moved forward to the most recent mark time that doesn't cause
+        a topic that is not tracked to be considered as read. The topic tracks that become useless
+        (the topics being read or unread with or without them) are then deleted, so that the unread
+        topics of the user remain the same.
+
+        """
+        inactive_users = get_user_model()._default_manager.filter(
+            Q(last_login__lt=last_login_before) | Q(last_login__isnull=True),
+        )
+        user_ids = (
+            TopicReadTrack.objects
+            .filter(user__in=inactive_users)
+            .order_by('user_id')
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+
+        count = 0
+        last_user_id = 0
+        while True:
+            batch = list(user_ids.filter(user_id__gt=last_user_id)[:batch_size])
+            if not batch:
+                return count
+            last_user_id = batch[-1]
+            for user_id in batch:
+                with transaction.atomic():
+                    count += self._collapse_user_topic_tracks(user_id, batch_size)
+
+    def _collapse_user_topic_tracks(self, user_id, batch_size):
+        """ Replaces the topic tracks of a user by forum tracks without changing the unread topics.
+
+        With a forum track of mark time ``M``, a topic that is not tracked is read if it was last
+        updated at ``M`` or before. So the topic tracks that can be deleted are the ones of the read
+        topics last updated at ``M`` or before and the ones of the unread topics last updated after
+        ``M``.
+
+        """
+        tracks = list(
+            TopicReadTrack.objects
+            .select_for_update()
+            .filter(user_id=user_id)
+            .values_list('id', 'topic_id', 'mark_time'),
+        )
+        topic_updates = {}
+        for batch in self._get_batches([topic_id for _, topic_id, _ in tracks], batch_size):
+            topic_updates.update(
+                (topic_id, (forum_id, last_update))
+                for topic_id, forum_id, last_update in Topic.objects
+                .filter(id__in=batch)
+                .annotate(last_update=Coalesce('last_post_on', 'created'))
+                .values_list('id', 'forum_id', 'last_update')
+            )
+        # The tracks of the topics deleted in the meantime are left to the deletion of their topic.
+        tracks = [track for track in tracks if track[1] in topic_updates]
+        forum_ids = {forum_id for forum_id, _ in topic_updates.values()}
+        forum_marks = dict(
+            ForumReadTrack.objects
+            .select_for_update()
+            .filter(user_id=user_id, forum_id__in=forum_ids)
+            .values_list('forum_id', 'mark_time'),
+        )
+
+        # The forum tracks can't be moved beyond the first update of the unread topics that are not
+        # tracked.
+        last_update = Coalesce(OuterRef('last_post_on'), OuterRef('created'))
+        first_unread_updates = dict(
+            Topic.objects
+            .filter(forum_id__in=forum_ids)
+            .annotate(last_update=Coalesce('last_post_on', 'created'))
+            .filter(
+                ~Exists(TopicReadTrack.objects.filter(topic=OuterRef('pk'), user_id=user_id)),
+                ~Exists(
+                    ForumReadTrack.objects.filter(
+                        forum=OuterRef('forum_id'), user_id=user_id, mark_time__gte=last_update,
+                    ),
+                ),
+            )
+            .order_by()
+            .values('forum_id')
+            .annotate(first_update=Min('last_update'))
+            .values_list('forum_id', 'first_update'),
+        )
+        marks = {}
+        for _, topic_id, mark_time in tracks:
+            forum_id = topic_updates[topic_id][0]
+            first_unread_update = first_unread_updates.get(forum_id)
+            if (
+                (first_unread_update is None or mark_time < first_unread_update) and
+                (forum_id not in forum_marks or forum_marks[forum_id] < mark_time) and
+                marks.get(forum_id, mark_time) <= mark_time
+            ):
+                marks[forum_id] = mark_time
+        if marks:
+            self._upsert_forum_tracks({(user_id, forum_id): marks[forum_id] for forum_id in marks})
+            forum_marks.update(marks)
+
+        track_ids = []
+        for track_id, topic_id, mark_time in tracks:
+            forum_id, last_update = topic_updates[topic_id]
+            forum_mark_time = forum_marks.get(forum_id)
+            read_by_forum_track = forum_mark_time is not None and last_update <= forum_mark_time
+            if read_by_forum_track == (last_update <= mark_time):
+                track_ids.append(track_id)
+
+        count = 0
+        for batch in self._get_batches(track_ids, batch_size):
+            count += TopicReadTrack.objects.filter(id__in=batch).delete()[0]
+        return count
+
+    def _upsert_forum_tracks(self, marks):
+        """ Moves the forum tracks of a dictionary of (user ID, forum ID) to mark time forward. """
+        filters = {
+            'user_id__in': {user_id for user_id, _ in marks},
+            'forum_id__in': {forum_id for _, forum_id in marks},
+        }
+        # The existing tracks are locked before being compared to the marks, so that a track moved
+        # forward in the meantime is never moved backward.
+        existing_tracks = {
+            (track.user_id, track.forum_id): track
+            for track in ForumReadTrack.objects.select_for_update().filter(**filters)
+        }
+        # The mark times of the created tracks are set to the current date by the database layer
+        # (``auto_now``), so that they are written afterwards in the same transaction.
+        ForumReadTrack.objects.bulk_create(
+            [
+                ForumReadTrack(user_id=user_id, forum_id=forum_id)
+                for user_id, forum_id in marks if (user_id, forum_id) not in existing_tracks
+            ],
+            ignore_conflicts=True,
+        )
+        created_tracks = ForumReadTrack.objects.select_for_update() \
+            .filter(**filters).exclude(id__in=[track.id for track in existing_tracks.values()])
+
+        tracks = []
+        for track in existing_tracks.values():
+            key = (track.user_id, track.forum_id)
+            if key in marks and track.mark_time < marks[key]:
+                track.mark_time = marks[key]
+                tracks.append(track)
+        for track in created_tracks:
+            key = (track.user_id, track.forum_id)
+            if key in marks:
+                track.mark_time = marks[key]
+                tracks.append(track)
+        ForumReadTrack.objects.bulk_update(tracks, ['mark_time'])
+
+    def _get_batches(self, iterable, batch_size):
+        iterator = iter(iterable)
+        batch = list(islice(iterator, batch_size))
+        while batch:
+            yield batch
+            batch = list(islice(iterator, batch_size))
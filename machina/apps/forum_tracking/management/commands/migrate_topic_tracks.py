@@ -0,0 +1,55 @@
+"""
+    Migrate topic tracks command
+    ============================
+
+    This module defines a management command allowing to copy the topic tracks to the read states
+    used by the compact tracking backend.
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+
+
+TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+
+CompactTrackingBackend = get_class('forum_tracking.backends', 'CompactTrackingBackend')
+
+
+class Command(BaseCommand):
+    help = 'Copies the topic tracks to the read states used by the compact tracking backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='The number of topic tracks copied at once.',
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the topic tracks once they have been copied.',
+        )
+
+    def handle(self, *args, **options):
+        backend = CompactTrackingBackend()
+        batch_size = options['batch_size']
+        count, last_id = 0, 0
+        while True:
+            tracks = list(
+                TopicReadTrack.objects
+                .filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'user_id', 'topic_id', 'mark_time')[:batch_size]
+            )
+            if not tracks:
+                break
+            backend.upsert_topic_marks({
+                (user_id, topic_id): mark_time for _, user_id, topic_id, mark_time in tracks
+            })
+            if options['delete']:
+                TopicReadTrack.objects.filter(id__in=[track[0] for track in tracks]).delete()
+            count += len(tracks)
+            last_id = tracks[-1][0]
+
+        self.stdout.write('{} topic track(s) migrated'.format(count))
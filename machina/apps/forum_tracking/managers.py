@@ -17,32 +17,55 @@ ForumVisibilityContentTree = get_class('forum.visibility', 'ForumVisibilityConte
 class ForumReadTrackManager(models.Manager):
     """ Provides useful manager methods for the ``ForumReadTrack`` model. """
 
-    def get_unread_forums_from_list(self, forums, user):
+    def get_unread_forums_from_list(self, forums, user, read_forum_ids=()):
         """ Filter a list of forums and return only those which are unread.
 
         Given a list of forums find and returns the list of forums that are unread for the passed
         user. If a forum is unread all of its ancestors are also unread and will be included in the
-        final list.
+        final list. The ancestors are resolved using the parent links of a
+        ``ForumVisibilityContentTree`` built from the list, so that only the tracks of the user are
+        queried. The unread forums are returned in the order of the considered list. The forums
+        whose IDs are in ``read_forum_ids`` are considered read, unless one of their descendants is
+        unread.
         """
-        unread_forums = []
-        visibility_contents = ForumVisibilityContentTree.from_forums(forums)
-        forum_ids_to_visibility_nodes = visibility_contents.as_dict
-
-        tracks = super().get_queryset().select_related('forum').filter(
-            user=user,
-            forum__in=forums)
-        tracked_forums = []
-
-        for track in tracks:
-            forum_last_post_on = forum_ids_to_visibility_nodes[track.forum_id].last_post_on
-            if (forum_last_post_on and track.mark_time < forum_last_post_on) \
-                    and track.forum not in unread_forums:
-                unread_forums.extend(track.forum.get_ancestors(include_self=True))
-            tracked_forums.append(track.forum)
+        forums = list(forums)
+        tracks = (
+            super().get_queryset()
+            .filter(user=user, forum__in=forums)
+            .values_list('forum_id', 'mark_time')
+        )
+        return self._get_unread_forums_from_tracks(forums, dict(tracks), read_forum_ids)
+
+    async def aget_unread_forums_from_list(self, forums, user, read_forum_ids=()):
+        """ Asynchronous version of ``get_unread_forums_from_list``. """
+        forums = list(forums)
+        tracks = (
+            super().get_queryset()
+            .filter(user=user, forum__in=forums)
+            .values_list('forum_id', 'mark_time')
+        )
+        return self._get_unread_forums_from_tracks(
+            forums, {forum_id: mark_time async for forum_id, mark_time in tracks}, read_forum_ids,
+        )
+
+    def _get_unread_forums_from_tracks(self, forums, tracked_forums, read_forum_ids):
+        nodes = ForumVisibilityContentTree.from_forums(forums).as_dict
+        unread_forum_ids = set()
 
         for forum in forums:
-            if forum not in tracked_forums and forum not in unread_forums \
-                    and forum.direct_topics_count > 0:
-                unread_forums.extend(forum.get_ancestors(include_self=True))
+            if forum.id in read_forum_ids:
+                unread = False
+            elif forum.id in tracked_forums:
+                forum_last_post_on = nodes[forum.id].last_post_on
+                unread = bool(forum_last_post_on and tracked_forums[forum.id] < forum_last_post_on)
+            else:
+                unread = forum.direct_topics_count > 0
+
+            # The ancestors of an unread forum are also unread. The ancestors of a forum that is
+            # already unread have already been added.
+            node = nodes[forum.id] if unread else None
+            while node is not None and node.obj.id not in unread_forum_ids:
+                unread_forum_ids.add(node.obj.id)
+                node = node.parent
 
-        return list(set(unread_forums))
+        return [forum for forum in forums if forum.id in unread_forum_ids]
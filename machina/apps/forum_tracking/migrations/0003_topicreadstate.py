@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('forum', '0011_auto_20190627_2132'),
+        ('forum_tracking', '0002_auto_20160607_0502'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicReadState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('marks', models.BinaryField(default=b'', verbose_name='Topic read marks')),
+                ('forum', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_read_states', to='forum.forum', verbose_name='Forum')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='topic_read_states', to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Topic read state',
+                'verbose_name_plural': 'Topic read states',
+                'abstract': False,
+                'unique_together': {('user', 'forum')},
+            },
+        ),
+    ]
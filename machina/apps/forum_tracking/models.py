@@ -7,10 +7,11 @@
 """
 
 from machina.apps.forum_tracking.abstract_models import (
-    AbstractForumReadTrack, AbstractTopicReadTrack
+    AbstractForumReadTrack, AbstractTopicReadState, AbstractTopicReadTrack
 )
 from machina.core.db.models import model_factory
 
 
 ForumReadTrack = model_factory(AbstractForumReadTrack)
+TopicReadState = model_factory(AbstractTopicReadState)
 TopicReadTrack = model_factory(AbstractTopicReadTrack)
@@ -12,15 +12,20 @@ from machina.core.loading import get_class
 
 
 topic_viewed = get_class('forum_conversation.signals', 'topic_viewed')
+read_mark_buffer = get_class('forum_tracking.buffer', 'read_mark_buffer')
 
 
 @receiver(topic_viewed)
 def update_user_trackers(sender, topic, user, request, response, **kwargs):
     """ Receiver to mark a topic being viewed as read.
 
-    This can result in marking the related forum tracker as read.
+    This can result in marking the related forum tracker as read. The read mark is deferred if the
+    read mark buffer is enabled.
 
     """
     TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')  # noqa
-    track_handler = TrackingHandler()
-    track_handler.mark_topic_read(topic, user)
+    track_handler = TrackingHandler(request)
+    if read_mark_buffer.enabled:
+        track_handler.buffer_topic_read(topic, user)
+    else:
+        track_handler.mark_topic_read(topic, user)
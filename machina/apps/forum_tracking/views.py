@@ -8,9 +8,11 @@
 
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.db.models import F, Q
+from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import ListView, TemplateView
 from django.views.generic.detail import BaseDetailView, SingleObjectTemplateResponseMixin
@@ -127,7 +129,13 @@ class MarkTopicsReadView(
 
 
 class UnreadTopicsView(LoginRequiredMixin, ListView):
-    """ Displays unread topics for the current user. """
+    """ Displays unread topics for the current user.
+
+    The unread topics are filtered by the database and paginated using a keyset: each page starts
+    after the last post date and the ID of the last topic of the previous page (the ``after``
+    parameter). This way, the cost of a page does not depend on the total number of topics.
+
+    """
 
     context_object_name = 'topics'
     paginate_by = machina_settings.FORUM_TOPICS_NUMBER_PER_PAGE
@@ -135,9 +143,65 @@ class UnreadTopicsView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         """ Returns the list of items for this view. """
-        forums = self.request.forum_permission_handler.get_readable_forums(
-            Forum.objects.all(), self.request.user,
+        return (
+            track_handler.get_unread_topics_queryset(self.request.user)
+            .select_related('forum', 'poster', 'last_post', 'last_post__poster')
+            .order_by(F('last_post_on').desc(nulls_last=True), '-id')
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        """ Returns the topics of the page starting after the cursor of the request. """
+        cursor = self.parse_cursor(self.request.GET.get('after'))
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(*cursor))
+
+        # One more topic is fetched in order to know whether a next page exists.
+        topics = list(queryset[:page_size + 1])
+        self.next_cursor = (
+            self.get_cursor(topics[page_size - 1]) if len(topics) > page_size else None
+        )
+        self.has_previous = cursor is not None
+
+        return (None, None, topics[:page_size], self.has_previous or self.next_cursor is not None)
+
+    def get_context_data(self, **kwargs):
+        """ Returns the context data to provide to the template. """
+        context = super().get_context_data(**kwargs)
+        limit = machina_settings.UNREAD_TOPICS_COUNT_LIMIT
+        context['next_cursor'] = self.next_cursor
+        context['has_previous'] = self.has_previous
+        context['unread_topics_count'] = track_handler.get_unread_topics_count(
+            self.request.user, limit + 1,
+        )
+        context['unread_topics_count_limit'] = limit
+        return context
+
+    def get_cursor(self, topic):
+        """ Returns the cursor allowing to fetch the topics following the given one. """
+        return '{},{}'.format(
+            topic.last_post_on.isoformat() if topic.last_post_on else '', topic.id,
+        )
+
+    def parse_cursor(self, cursor):
+        """ Returns the (last post date, ID) two-tuple encoded by the given cursor. """
+        if not cursor:
+            return None
+        try:
+            last_post_on, topic_id = cursor.split(',')
+            parsed_last_post_on = parse_datetime(last_post_on) if last_post_on else None
+            topic_id = int(topic_id)
+        except ValueError:
+            parsed_last_post_on = topic_id = None
+        if topic_id is None or (last_post_on and parsed_last_post_on is None):
+            raise Http404(_('Invalid page.'))
+        return parsed_last_post_on, topic_id
+
+    def get_cursor_filter(self, last_post_on, topic_id):
+        """ Returns a Q object filtering the topics that follow the given cursor. """
+        if last_post_on is None:
+            return Q(last_post_on__isnull=True, id__lt=topic_id)
+        return (
+            Q(last_post_on__lt=last_post_on) |
+            Q(last_post_on=last_post_on, id__lt=topic_id) |
+            Q(last_post_on__isnull=True)
         )
-        topics = Topic.objects.filter(forum__in=forums)
-        topics_pk = map(lambda t: t.pk, track_handler.get_unread_topics(topics, self.request.user))
-        return Topic.approved_objects.filter(pk__in=topics_pk).order_by('-last_post_on')
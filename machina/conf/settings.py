@@ -45,6 +45,11 @@ DEFAULT_FORUM_IMAGE_SETTINGS = {
 }
 
 FORUM_TOPICS_NUMBER_PER_PAGE = getattr(settings, 'MACHINA_FORUM_TOPICS_NUMBER_PER_PAGE', 20)
+FORUM_TREE_CACHE_NAME = getattr(settings, 'MACHINA_FORUM_TREE_CACHE_NAME', None)
+
+COUNTER_BUFFER_CACHE_NAME = getattr(settings, 'MACHINA_COUNTER_BUFFER_CACHE_NAME', None)
+COUNTER_BUFFER_FLUSH_INTERVAL = getattr(settings, 'MACHINA_COUNTER_BUFFER_FLUSH_INTERVAL', 60)
+COUNTER_BUFFER_FLUSH_SIZE = getattr(settings, 'MACHINA_COUNTER_BUFFER_FLUSH_SIZE', 1000)
 
 
 # Conversation
@@ -53,6 +58,7 @@ POST_CONTENT_MAX_LENGTH = getattr(settings, 'MACHINA_POST_CONTENT_MAX_LENGTH', N
 
 TOPIC_POSTS_NUMBER_PER_PAGE = getattr(settings, 'MACHINA_TOPIC_POSTS_NUMBER_PER_PAGE', 15)
 TOPIC_REVIEW_POSTS_NUMBER = getattr(settings, 'MACHINA_TOPIC_REVIEW_POSTS_NUMBER', 10)
+INCREMENTAL_TRACKERS = getattr(settings, 'MACHINA_INCREMENTAL_TRACKERS', False)
 
 
 # Polls
@@ -101,3 +107,21 @@ PROFILE_POSTS_NUMBER_PER_PAGE = getattr(settings, 'MACHINA_PROFILE_POSTS_NUMBER_
 DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS = getattr(
     settings, 'MACHINA_DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS', []
 )
+PERMISSION_CACHE_NAME = getattr(settings, 'MACHINA_PERMISSION_CACHE_NAME', None)
+PERMISSION_CACHE_TIMEOUT = getattr(settings, 'MACHINA_PERMISSION_CACHE_TIMEOUT', 60 * 60)
+ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = getattr(
+    settings, 'MACHINA_ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT', None
+)
+PERMISSION_QUERYSET_MODE = getattr(settings, 'MACHINA_PERMISSION_QUERYSET_MODE', False)
+
+
+# Tracking
+UNREAD_TOPICS_COUNT_LIMIT = getattr(settings, 'MACHINA_UNREAD_TOPICS_COUNT_LIMIT', 1000)
+TRACKING_BACKEND = getattr(
+    settings, 'MACHINA_TRACKING_BACKEND',
+    'machina.apps.forum_tracking.backends.RowTrackingBackend',
+)
+TRACKING_BUFFER_CACHE_NAME = getattr(settings, 'MACHINA_TRACKING_BUFFER_CACHE_NAME', None)
+TRACKING_BUFFER_OVERLAY_TIMEOUT = getattr(
+    settings, 'MACHINA_TRACKING_BUFFER_OVERLAY_TIMEOUT', 60 * 10
+)
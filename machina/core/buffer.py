@@ -0,0 +1,172 @@
+"""
+    Cache buffer
+    ============
+
+    This module defines a base class for the buffers allowing to defer database writes: the entries
+    to write are appended to a buffer stored in a Django cache and written to the database in
+    batches.
+
+"""
+
+import time
+import uuid
+
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from machina.conf import settings as machina_settings
+
+
+class LockExpired(Exception):
+    """ The lock of a buffer expired before a batch of entries was written. """
+
+
+class CacheBuffer:
+    """ A buffer of entries stored in a Django cache.
+
+    The buffer is enabled only if the setting whose name is given by ``cache_name_setting`` is set.
+    Each entry is stored under its own key: the keys are numbered using a sequence counter so that
+    entries can be appended concurrently by many processes. The index of an entry is reserved
+    before the entry is stored, so a flush never goes past a missing entry unless it has been
+    missing for ``missing_timeout`` seconds (eg. if it has been evicted from the cache). The
+    flushed entries are only removed from the buffer once they have been written.
+
+    Subclasses define the entries they append and how these entries are written to the database.
+
+    """
+
+    # The name of the setting defining the name of the cache used to store the buffer.
+    cache_name_setting = None
+    # The name of the buffer used in error messages.
+    verbose_name = None
+    # The prefix of the keys of the buffer.
+    key_prefix = None
+
+    # The number of seconds after which a buffered entry expires if the buffer is not flushed.
+    entry_timeout = 60 * 60 * 24
+    # The number of seconds after which an entry whose index is reserved but which is still missing
+    # is considered lost.
+    missing_timeout = 60
+    # The number of seconds during which the buffer is locked by a flush ; the lock is extended
+    # after each batch.
+    lock_timeout = 60
+
+    @property
+    def sequence_key(self):
+        return '{}:sequence'.format(self.key_prefix)
+
+    @property
+    def flushed_key(self):
+        return '{}:flushed'.format(self.key_prefix)
+
+    @property
+    def lock_key(self):
+        return '{}:lock'.format(self.key_prefix)
+
+    @property
+    def cache_name(self):
+        return getattr(machina_settings, self.cache_name_setting)
+
+    def get_backend(self):
+        """ Returns the associated cache backend or ``None`` if the buffer is disabled. """
+        if not self.cache_name:
+            return None
+        try:
+            cache = caches[self.cache_name]
+        except InvalidCacheBackendError:
+            raise ImproperlyConfigured(
+                'The {} cache backend ({}) is not configured'.format(
+                    self.verbose_name, self.cache_name,
+                ),
+            )
+        return cache
+
+    @property
+    def enabled(self):
+        """ Returns ``True`` if the buffer is enabled. """
+        return bool(self.cache_name)
+
+    def _append(self, backend, entry):
+        """ Appends an entry to the buffer and returns its index. """
+        try:
+            index = backend.incr(self.sequence_key)
+        except ValueError:
+            backend.add(self.sequence_key, 0, timeout=None)
+            index = backend.incr(self.sequence_key)
+        backend.set(self._get_entry_key(index), entry, timeout=self.entry_timeout)
+        return index
+
+    def flush(self, apply, batch_size=1000, max_batches=None):
+        """ Writes the buffered entries to the database using the given ``apply`` callable.
+
+        The entries are passed to ``apply`` by batches of at most ``batch_size`` entries (and at
+        most ``max_batches`` batches), in the order in which they were appended. Each batch is
+        written in its own transaction, which is rolled back if the lock of the buffer expired in
+        the meantime. Returns the number of entries that have been flushed, or ``0`` if the buffer
+        is being flushed by another process.
+
+        """
+        backend = self.get_backend()
+        token = uuid.uuid4().hex
+        if not backend.add(self.lock_key, token, timeout=self.lock_timeout):
+            return 0
+        count = batches_count = 0
+        try:
+            while max_batches is None or batches_count < max_batches:
+                first_index, keys, entries = self._peek(backend, batch_size)
+                if not keys:
+                    break
+                with transaction.atomic():
+                    if entries:
+                        apply(entries)
+                    # The entries may be read again by the process holding the lock now if the lock
+                    # expired during the write: they are not committed.
+                    if backend.get(self.lock_key) != token:
+                        raise LockExpired
+                backend.delete_many(keys)
+                backend.set(self.flushed_key, first_index + len(keys) - 1, timeout=None)
+                backend.touch(self.lock_key, self.lock_timeout)
+                self._on_batch_flushed(backend, entries)
+                count += len(entries)
+                batches_count += 1
+        except LockExpired:
+            pass
+        finally:
+            if backend.get(self.lock_key) == token:
+                backend.delete(self.lock_key)
+        return count
+
+    def _on_batch_flushed(self, backend, entries):
+        """ Called once a batch of entries has been written and removed from the buffer. """
+
+    def _peek(self, backend, limit):
+        """ Returns the first index, the keys and the entries of the next batch of entries. """
+        last_index = backend.get(self.sequence_key) or 0
+        first_index = (backend.get(self.flushed_key) or 0) + 1
+        if first_index > last_index + 1:
+            # The sequence counter has been evicted from the cache: it restarted from the beginning.
+            first_index = 1
+        keys = [
+            self._get_entry_key(index)
+            for index in range(first_index, min(first_index + limit, last_index + 1))
+        ]
+        entries = backend.get_many(keys) if keys else {}
+
+        # The batch stops before the first missing entry, which may be about to be stored by the
+        # process that reserved its index.
+        for position, key in enumerate(keys):
+            if key not in entries and not self._is_lost(backend, first_index + position):
+                keys = keys[:position]
+                break
+        return first_index, keys, [entries[key] for key in keys if key in entries]
+
+    def _is_lost(self, backend, index):
+        """ Returns ``True`` if the entry of the given index has been missing for too long. """
+        key = '{}:missing:{}'.format(self.key_prefix, index)
+        backend.add(key, time.time(), timeout=self.missing_timeout * 2)
+        missing_since = backend.get(key)
+        return missing_since is not None and time.time() - missing_since >= self.missing_timeout
+
+    def _get_entry_key(self, index):
+        return '{}:{}'.format(self.key_prefix, index)
@@ -5,10 +5,24 @@ from django import template
 from machina.core.loading import get_class
 
 
-PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+get_permission_handler = get_class('forum_permission.registry', 'get_permission_handler')
 
 register = template.Library()
 
+_allowed_method_names_cache = {}
+
+
+def get_allowed_method_names(perm_handler):
+    """ Returns the names of the permission handler methods that can be used in templates. """
+    handler_class = perm_handler.__class__
+    if handler_class not in _allowed_method_names_cache:
+        allowed_methods = inspect.getmembers(perm_handler, predicate=inspect.ismethod)
+        _allowed_method_names_cache[handler_class] = [
+            a[0] for a in allowed_methods
+            if not a[0].startswith('_') and not inspect.iscoroutinefunction(a[1])
+        ]
+    return _allowed_method_names_cache[handler_class]
+
 
 @register.simple_tag(takes_context=True)
 def get_permission(context, method, *args, **kwargs):
@@ -19,12 +33,25 @@ def get_permission(context, method, *args, **kwargs):
 
         {% get_permission 'can_access_moderation_panel' request.user as var %}
 
+    The permissions that were precomputed for the current user by the view (using the
+    ``precomputed_permissions`` context variable) are used if available.
+
     """
     request = context.get('request', None)
-    perm_handler = request.forum_permission_handler if request else PermissionHandler()
 
-    allowed_methods = inspect.getmembers(perm_handler, predicate=inspect.ismethod)
-    allowed_method_names = [a[0] for a in allowed_methods if not a[0].startswith('_')]
+    precomputed_permissions = context.get('precomputed_permissions', None)
+    if (
+        precomputed_permissions and request is not None and len(args) == 2 and not kwargs and
+        args[1] is request.user
+    ):
+        try:
+            return precomputed_permissions[(method, args[0])]
+        except (KeyError, TypeError):
+            pass
+
+    perm_handler = request.forum_permission_handler if request else get_permission_handler()
+
+    allowed_method_names = get_allowed_method_names(perm_handler)
 
     if method not in allowed_method_names:
         raise template.TemplateSyntaxError(
@@ -19,3 +19,19 @@ def get_unread_topics(context, topics, user):
     """
     request = context.get('request', None)
     return TrackingHandler(request=request).get_unread_topics(topics, user)
+
+
+@register.simple_tag(takes_context=True)
+def get_unread_topics_count(context, user, limit=None):
+    """ This will return the number of unread topics for the given user.
+
+    The count stops at ``MACHINA_UNREAD_TOPICS_COUNT_LIMIT`` topics (or at the given limit) so that
+    it can be displayed on every page.
+
+    Usage::
+
+        {% get_unread_topics_count request.user as unread_topics_count %}
+
+    """
+    request = context.get('request', None)
+    return TrackingHandler(request=request).get_unread_topics_count(user, limit)
@@ -2,6 +2,7 @@ import pytest
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages import constants as MSG  # noqa
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models.signals import pre_delete
 from django.urls import reverse
 from django.utils.encoding import force_bytes
 from faker import Faker
@@ -27,9 +28,11 @@ ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
 Post = get_model('forum_conversation', 'Post')
 Topic = get_model('forum_conversation', 'Topic')
 TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+UserForumPermission = get_model('forum_permission', 'UserForumPermission')
 
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
 remove_perm = get_class('forum_permission.shortcuts', 'remove_perm')
 
 
@@ -212,6 +215,22 @@ class TestTopicView(BaseClientTestCase):
         assert response.context_data['poll'] == poll
         assert isinstance(response.context_data['poll_form'], TopicPollVoteForm)
 
+    def test_embed_the_precomputed_permissions_of_the_displayed_posts_into_the_context(self):
+        # Setup
+        assign_perm('can_edit_own_posts', self.user, self.top_level_forum)
+        correct_url = reverse('forum_conversation:topic', kwargs={
+            'forum_slug': self.top_level_forum.slug, 'forum_pk': self.top_level_forum.pk,
+            'slug': self.topic.slug, 'pk': self.topic.id})
+        # Run
+        response = self.client.get(correct_url)
+        # Check
+        permissions = response.context_data['precomputed_permissions']
+        for post in response.context_data['posts']:
+            assert permissions[('can_edit_post', post)] is True
+            assert permissions[('can_delete_post', post)] is False
+        assert permissions[('can_lock_topics', self.top_level_forum)] is False
+        assert permissions[('can_add_post', self.topic)] is False
+
     def test_cannot_be_browsed_by_users_who_cannot_browse_the_related_forum(self):
         # Setup
         remove_perm('can_read_forum', self.user, self.top_level_forum)
@@ -309,6 +328,26 @@ class TestTopicCreateView(BaseClientTestCase):
         last_url, status_code = response.redirect_chain[-1]
         assert topic_url in last_url
 
+    def test_resolves_the_permissions_of_the_user_only_once(self, django_assert_max_num_queries):
+        # Setup
+        correct_url = reverse('forum_conversation:topic_create', kwargs={
+            'forum_slug': self.top_level_forum.slug, 'forum_pk': self.top_level_forum.pk})
+        post_data = {
+            'subject': faker.text(max_nb_chars=200),
+            'content': '[b]{}[/b]'.format(faker.text()),
+            'topic_type': Topic.TOPIC_POST,
+        }
+        # Run
+        # The trackers of the forum are rolled up in a savepoint after locking its ancestors.
+        with django_assert_max_num_queries(22) as captured:
+            response = self.client.post(correct_url, post_data)
+        # Check
+        assert response.status_code == 302
+        assert len([
+            q for q in captured.captured_queries
+            if UserForumPermission._meta.db_table in q['sql']
+        ]) == 1
+
     def test_redirects_to_the_forum_if_the_post_is_not_approved(self):
         # Setup
         remove_perm('can_post_without_approval', self.user, self.top_level_forum)
@@ -1254,6 +1293,25 @@ class TestPostDeleteView(BaseClientTestCase):
         last_url, status_code = response.redirect_chain[-1]
         assert topic_url in last_url
 
+    def test_deletes_the_post_in_a_unit_of_work(self):
+        # Setup
+        correct_url = reverse(
+            'forum_conversation:post_delete',
+            kwargs={'forum_slug': self.top_level_forum.slug, 'forum_pk': self.top_level_forum.pk,
+                    'topic_slug': self.topic.slug, 'topic_pk': self.topic.pk,
+                    'pk': self.post.pk})
+        states = []
+        # Run
+        with mock_signal_receiver(
+                pre_delete, sender=Post,
+                wraps=lambda **kwargs: states.append(deferred_trackers.active)):
+            self.client.post(correct_url, follow=True)
+        # Check
+        assert states == [True]
+        topic = Topic.objects.get(pk=self.topic.pk)
+        assert topic.posts_count == 1
+        assert topic.last_post == self.first_post
+
     def test_redirects_to_the_forum_view_if_no_posts_remain(self):
         # Setup
         self.post.delete()
@@ -1,10 +1,12 @@
 import pytest
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import pre_delete
 from django.urls import reverse
 from faker import Faker
 
 from machina.core.db.models import get_model
 from machina.core.loading import get_class
+from machina.test.context_managers import mock_signal_receiver
 from machina.test.factories import (
     ForumReadTrackFactory, PostFactory, TopicPollFactory, TopicPollOptionFactory, create_forum,
     create_topic
@@ -14,6 +16,7 @@ from machina.test.testcases import BaseClientTestCase
 
 faker = Faker()
 
+Forum = get_model('forum', 'Forum')
 ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
 Post = get_model('forum_conversation', 'Post')
 Topic = get_model('forum_conversation', 'Topic')
@@ -21,6 +24,7 @@ TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
 
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
 remove_perm = get_class('forum_permission.shortcuts', 'remove_perm')
 
 
@@ -206,6 +210,25 @@ class TestTopicDeleteView(BaseClientTestCase):
         # Check
         assert response.status_code == 200
 
+    def test_deletes_the_topic_in_a_unit_of_work(self):
+        # Setup
+        other_topic = create_topic(forum=self.top_level_forum, poster=self.user)
+        PostFactory.create(topic=other_topic, poster=self.user)
+        correct_url = reverse(
+            'forum_moderation:topic_delete',
+            kwargs={'slug': self.topic.slug, 'pk': self.topic.pk})
+        states = []
+        # Run
+        with mock_signal_receiver(
+                pre_delete, sender=Topic,
+                wraps=lambda **kwargs: states.append(deferred_trackers.active)):
+            self.client.post(correct_url, follow=True)
+        # Check
+        assert states == [True]
+        forum = Forum.objects.get(pk=self.top_level_forum.pk)
+        assert forum.direct_topics_count == 1
+        assert forum.last_post == other_topic.last_post
+
     def test_can_delete_topics(self):
         # Setup
         correct_url = reverse(
@@ -1,4 +1,5 @@
 import shutil
+from unittest import mock
 
 import pytest
 from django.conf import settings
@@ -107,6 +108,21 @@ class TestFacetedSearchView(BaseClientTestCase):
         assert len(response.context['page'].object_list) == 1
         assert response.context['page'].object_list[0].object == self.post_1
 
+    def test_reuses_the_permission_handler_of_the_request(self, django_assert_max_num_queries):
+        # Setup
+        management.call_command('update_index', verbosity=0)
+        correct_url = reverse('forum_search:search')
+        get_data = {'q': self.topic_1.subject}
+        # Run
+        with mock.patch.object(
+            PermissionHandler, '__init__', autospec=True, side_effect=PermissionHandler.__init__,
+        ) as handler_init:
+            with django_assert_max_num_queries(12):
+                response = self.client.get(correct_url, data=get_data)
+        # Check
+        assert response.status_code == 200
+        assert handler_init.call_count == 1
+
     def test_can_search_with_pagination(self):
         """
         Check that pagination has well formed links
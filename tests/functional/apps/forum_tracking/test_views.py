@@ -1,7 +1,11 @@
+from unittest import mock
+
 import pytest
+from django.db.models import F
 from django.urls import reverse
 from faker import Faker
 
+from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
 from machina.core.loading import get_class
 from machina.test.factories import (
@@ -14,11 +18,13 @@ from machina.test.testcases import BaseClientTestCase
 faker = Faker()
 
 Forum = get_model('forum', 'Forum')
+Topic = get_model('forum_conversation', 'Topic')
 
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
 
 TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
+UnreadTopicsView = get_class('forum_tracking.views', 'UnreadTopicsView')
 
 
 class TestMarkForumsReadView(BaseClientTestCase):
@@ -245,3 +251,65 @@ class TestUnreadTopicsView(BaseClientTestCase):
         # Check
         assert response.status_code == 200
         assert not response.context_data['topics']
+
+    def test_paginates_the_unread_topics_using_a_cursor(self):
+        # Setup
+        for forum in (self.forum_1, self.forum_4, self.forum_3):
+            for _ in range(3):
+                PostFactory.create(topic=create_topic(forum=forum, poster=self.u1), poster=self.u1)
+        Topic.objects.filter(forum=self.forum_4).update(last_post_on=None)
+        expected_topics = list(
+            Topic.objects.filter(forum__in=[self.forum_1, self.forum_4])
+            .order_by(F('last_post_on').desc(nulls_last=True), '-id')
+        )
+        correct_url = reverse('forum_tracking:unread_topics')
+        topics = []
+        # Run
+        with mock.patch.object(UnreadTopicsView, 'paginate_by', 4):
+            response = self.client.get(correct_url)
+            while True:
+                assert response.status_code == 200
+                assert response.context_data['unread_topics_count'] == 6
+                topics.extend(response.context_data['topics'])
+                if not response.context_data['next_cursor']:
+                    break
+                response = self.client.get(
+                    correct_url, {'after': response.context_data['next_cursor']})
+        # Check
+        assert topics == expected_topics
+
+    def test_uses_a_constant_number_of_queries(self, django_assert_max_num_queries):
+        # Setup
+        for _ in range(30):
+            topic = create_topic(forum=self.forum_4, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+        correct_url = reverse('forum_tracking:unread_topics')
+        # Run & check
+        with django_assert_max_num_queries(12):
+            response = self.client.get(correct_url)
+        assert len(response.context_data['topics']) == UnreadTopicsView.paginate_by
+        assert response.context_data['next_cursor']
+
+    def test_caps_the_number_of_unread_topics(self):
+        # Setup
+        machina_settings.UNREAD_TOPICS_COUNT_LIMIT = 2
+        for _ in range(3):
+            topic = create_topic(forum=self.forum_4, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+        correct_url = reverse('forum_tracking:unread_topics')
+        # Run
+        try:
+            response = self.client.get(correct_url)
+        finally:
+            machina_settings.UNREAD_TOPICS_COUNT_LIMIT = 1000
+        # Check
+        assert response.context_data['unread_topics_count'] == 3
+        assert 'More than 2 unread topics found' in response.content.decode()
+
+    def test_cannot_be_browsed_with_an_invalid_cursor(self):
+        # Setup
+        correct_url = reverse('forum_tracking:unread_topics')
+        # Run
+        response = self.client.get(correct_url, {'after': 'invalid,cursor'})
+        # Check
+        assert response.status_code == 404
@@ -322,3 +322,30 @@ class TestGetPermissionTag(object):
             t = Template(self.loadstatement + raw_template)
             with pytest.raises(TemplateSyntaxError):
                 t.render(context)
+
+    def test_uses_the_permissions_precomputed_for_the_current_user(self):
+        # Setup
+        def get_rendered(post, user, precomputed_permissions):
+            request = self.get_request()
+            request.user = user
+            ForumPermissionMiddleware(lambda r: HttpResponse("Response")).process_request(request)
+            t = Template(
+                self.loadstatement +
+                '{% get_permission \'can_edit_post\' post request.user as user_can_edit_post %}'
+                '{% if user_can_edit_post %}CAN_EDIT{% else %}CANNOT_EDIT{% endif %}')
+            c = Context({
+                'post': post, 'request': request,
+                'precomputed_permissions': precomputed_permissions,
+            })
+            rendered = t.render(c)
+
+            return rendered
+
+        assign_perm('can_edit_own_posts', self.u1, self.forum_1)
+
+        # Run & check
+        assert get_rendered(self.post_1, self.u1, {}) == 'CAN_EDIT'
+        assert get_rendered(
+            self.post_1, self.u1, {('can_edit_post', self.post_1): False}) == 'CANNOT_EDIT'
+        assert get_rendered(
+            self.post_1, self.u1, {('can_edit_post', self.post_2): False}) == 'CAN_EDIT'
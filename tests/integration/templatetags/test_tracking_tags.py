@@ -103,3 +103,22 @@ class TestUnreadTopicsTag(BaseTrackingTagsTestCase):
         context, rendered = get_rendered(self.forum_1.topics.all(), self.u2)
         assert rendered == ''
         assert set(context['unread_topics']) == set(self.forum_1.topics.all())
+
+
+class TestUnreadTopicsCountTag(BaseTrackingTagsTestCase):
+    def test_can_count_the_unread_topics(self):
+        # Setup
+        request = self.get_request()
+        request.user = self.u2
+        ForumPermissionMiddleware(lambda r: HttpResponse("Response")).process_request(request)
+        TopicReadTrackFactory.create(topic=self.forum_2_topic, user=self.u2)
+        PostFactory.create(topic=create_topic(forum=self.forum_1, poster=self.u1), poster=self.u1)
+        t = Template(
+            self.loadstatement +
+            '{% get_unread_topics_count request.user as count %}'
+            '{% get_unread_topics_count request.user 1 as capped_count %}'
+            '{{ count }} {{ capped_count }}')
+        # Run
+        rendered = t.render(Context({'request': request}))
+        # Check
+        assert rendered == '2 1'
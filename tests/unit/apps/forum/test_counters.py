@@ -0,0 +1,160 @@
+import pytest
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+from machina.test.factories import (
+    UserFactory, create_category_forum, create_forum, create_link_forum, create_topic
+)
+
+
+Forum = get_model('forum', 'Forum')
+Topic = get_model('forum_conversation', 'Topic')
+
+counter_buffer = get_class('forum.counters', 'counter_buffer')
+forum_tree = get_class('forum.tree', 'forum_tree')
+update_forum_redirects_counter = get_class('forum.receivers', 'update_forum_redirects_counter')
+update_topic_counter = get_class('forum_conversation.receivers', 'update_topic_counter')
+
+
+@pytest.mark.django_db
+class TestCounterBuffer(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.user = UserFactory.create()
+        self.top_level_cat = create_category_forum()
+        self.forum = create_forum(parent=self.top_level_cat)
+        self.link = create_link_forum(parent=self.top_level_cat, link_redirects=True)
+        self.topics = [create_topic(forum=self.forum, poster=self.user) for _ in range(3)]
+        yield
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = None
+        machina_settings.COUNTER_BUFFER_FLUSH_SIZE = 1000
+        caches['default'].clear()
+
+    def view_topic(self, topic):
+        update_topic_counter(sender=None, topic=topic, user=self.user, request=None, response=None)
+
+    def get_views_counts(self):
+        return list(
+            Topic.objects.filter(pk__in=[t.pk for t in self.topics])
+            .order_by('pk').values_list('views_count', flat=True),
+        )
+
+    def test_defers_the_increments_until_the_buffer_is_flushed(self):
+        # Setup
+        for topic in (self.topics[0], self.topics[2], self.topics[0]):
+            self.view_topic(topic)
+        update_forum_redirects_counter(
+            sender=None, forum=self.link, user=self.user, request=None, response=None)
+        assert self.get_views_counts() == [0, 0, 0]
+        version = forum_tree.get_version()
+        # Run
+        call_command('flush_counters', '--batch-size', 2)
+        # Check
+        assert self.get_views_counts() == [2, 0, 1]
+        assert Forum.objects.get(pk=self.link.pk).link_redirects_count == 1
+        assert forum_tree.get_version() == version  # The counters are not part of the tree.
+        assert counter_buffer.flush() == 0
+
+    def test_writes_one_update_per_row(self, django_assert_num_queries):
+        # Setup
+        for _ in range(10):
+            for topic in self.topics[:2]:
+                self.view_topic(topic)
+        # Run & check
+        with django_assert_num_queries(4):  # The updates are performed in a savepoint.
+            assert counter_buffer.flush() == 20
+        assert self.get_views_counts() == [10, 10, 0]
+
+    def test_is_flushed_once_it_holds_the_maximum_number_of_increments(
+            self, django_capture_on_commit_callbacks):
+        # Setup
+        machina_settings.COUNTER_BUFFER_FLUSH_SIZE = 3
+        # Run
+        for _ in range(5):
+            with django_capture_on_commit_callbacks(execute=True):
+                self.view_topic(self.topics[1])
+        # Check
+        assert self.get_views_counts() == [0, 3, 0]
+
+    def test_writes_a_single_batch_when_flushed_by_a_request(
+            self, django_capture_on_commit_callbacks):
+        # Setup
+        machina_settings.COUNTER_BUFFER_FLUSH_SIZE = 3
+        for _ in range(5):
+            self.view_topic(self.topics[0])
+        # Run
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            self.view_topic(self.topics[2])
+        # Check
+        assert len(callbacks) == 1
+        assert self.get_views_counts() == [3, 0, 0]
+        assert counter_buffer.flush() == 3
+        assert self.get_views_counts() == [5, 0, 1]
+
+    def test_keeps_the_increments_if_they_cannot_be_written(self, monkeypatch):
+        # Setup
+        self.view_topic(self.topics[0])
+
+        def apply(increments):
+            raise ValueError
+
+        monkeypatch.setattr(counter_buffer, '_apply', apply)
+        # Run
+        with pytest.raises(ValueError):
+            counter_buffer.flush()
+        # Check
+        monkeypatch.undo()
+        assert counter_buffer.flush() == 1
+        assert self.get_views_counts() == [1, 0, 0]
+
+    def test_does_not_go_past_an_increment_that_is_not_stored_yet(self, monkeypatch):
+        # Setup
+        backend = caches['default']
+        self.view_topic(self.topics[0])
+        # The index of an increment is reserved by another process which did not store it yet.
+        backend.incr(counter_buffer.sequence_key)
+        self.view_topic(self.topics[1])
+        # Run & check
+        assert counter_buffer.flush() == 1
+        assert self.get_views_counts() == [1, 0, 0]
+        monkeypatch.setattr(counter_buffer, 'missing_timeout', 0)
+        assert counter_buffer.flush() == 1
+        assert self.get_views_counts() == [1, 1, 0]
+
+    def test_does_not_write_the_increments_if_the_lock_expires(self, monkeypatch):
+        # Setup
+        self.view_topic(self.topics[0])
+        apply = counter_buffer._apply
+
+        def apply_slowly(increments):
+            apply(increments)
+            caches['default'].set(counter_buffer.lock_key, 'other-process')
+
+        monkeypatch.setattr(counter_buffer, '_apply', apply_slowly)
+        # Run & check
+        assert counter_buffer.flush() == 0
+        assert self.get_views_counts() == [0, 0, 0]
+        assert caches['default'].get(counter_buffer.lock_key) == 'other-process'
+
+    def test_is_not_flushed_concurrently(self):
+        # Setup
+        self.view_topic(self.topics[0])
+        caches['default'].add(counter_buffer.lock_key, True)
+        # Run & check
+        assert counter_buffer.flush() == 0
+        assert self.get_views_counts() == [0, 0, 0]
+
+    def test_updates_the_counters_immediately_if_it_is_not_enabled(self):
+        # Setup
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = None
+        # Run
+        self.view_topic(self.topics[0])
+        # Check
+        assert self.get_views_counts() == [1, 0, 0]
+        with pytest.raises(CommandError):
+            call_command('flush_counters')
@@ -2,6 +2,7 @@ import pytest
 from django.core.exceptions import ValidationError
 
 from machina.apps.forum.signals import forum_moved
+from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
 from machina.test.context_managers import mock_signal_receiver
 from machina.test.factories import (
@@ -111,3 +112,135 @@ class TestForum(object):
         assert created is True
         assert isinstance(forum, Forum)
         assert forum.name == "Test Forum"
+
+
+@pytest.mark.django_db
+class TestForumSubtreeTrackers(object):
+    @pytest.fixture(autouse=True, params=[False, True])
+    def setup(self, request):
+        machina_settings.INCREMENTAL_TRACKERS = request.param
+        self.u1 = UserFactory.create()
+
+        # Set up a category containing a forum with a sub-forum and another top-level forum
+        self.top_level_cat = create_category_forum()
+        self.forum = create_forum(parent=self.top_level_cat)
+        self.sub_forum = create_forum(parent=self.forum)
+        self.other_forum = create_forum()
+        yield
+        machina_settings.INCREMENTAL_TRACKERS = False
+
+    def create_post(self, forum, **kwargs):
+        topic = create_topic(forum=forum, poster=self.u1)
+        return PostFactory.create(topic=topic, poster=self.u1, **kwargs)
+
+    def check_subtree_trackers(self):
+        for forum in Forum.objects.all():
+            forums = forum.get_descendants(include_self=True)
+            last_forum = forums.filter(last_post_on__isnull=False).order_by('-last_post_on').first()
+            assert forum.subtree_posts_count == sum(f.direct_posts_count for f in forums)
+            assert forum.subtree_topics_count == sum(f.direct_topics_count for f in forums)
+            assert forum.subtree_last_post_id == (last_forum.last_post_id if last_forum else None)
+            assert forum.subtree_last_post_on == (last_forum.last_post_on if last_forum else None)
+
+    def test_rolls_up_the_trackers_of_its_sub_forums(self):
+        # Run
+        self.create_post(self.forum)
+        post = self.create_post(self.sub_forum)
+        PostFactory.create(topic=post.topic, poster=self.u1)
+        self.create_post(self.sub_forum, approved=False)
+        # Check
+        top_level_cat = Forum.objects.get(pk=self.top_level_cat.pk)
+        assert top_level_cat.subtree_posts_count == 3
+        assert top_level_cat.subtree_topics_count == 2
+        assert top_level_cat.subtree_last_post == post.topic.last_post
+        self.check_subtree_trackers()
+
+    def test_updates_the_trackers_of_its_ancestors_when_posts_are_deleted(self):
+        # Setup
+        self.create_post(self.forum)
+        post = self.create_post(self.sub_forum)
+        last_post = PostFactory.create(topic=post.topic, poster=self.u1)
+        # Run
+        last_post.delete()
+        post.topic.refresh_from_db()
+        post.topic.delete()
+        # Check
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_posts_count == 1
+        self.check_subtree_trackers()
+
+    def test_updates_the_trackers_of_its_ancestors_when_a_topic_is_moved(self):
+        # Setup
+        post = self.create_post(self.sub_forum)
+        # Run
+        post.topic.forum = self.other_forum
+        post.topic.save()
+        # Check
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_topics_count == 0
+        assert Forum.objects.get(pk=self.other_forum.pk).subtree_topics_count == 1
+        self.check_subtree_trackers()
+
+    def test_updates_the_trackers_of_its_ancestors_when_it_is_moved(self):
+        # Setup
+        self.create_post(self.sub_forum)
+        self.create_post(self.forum)
+        # Run
+        self.sub_forum.parent = self.other_forum
+        self.sub_forum.save()
+        # Check
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_posts_count == 1
+        assert Forum.objects.get(pk=self.other_forum.pk).subtree_posts_count == 1
+        self.check_subtree_trackers()
+
+    def test_updates_the_trackers_of_its_ancestors_when_it_is_deleted(self):
+        # Setup
+        self.create_post(self.sub_forum)
+        self.create_post(self.forum)
+        # Run
+        Forum.objects.get(pk=self.sub_forum.pk).delete()
+        # Check
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_posts_count == 1
+        self.check_subtree_trackers()
+
+    def test_compares_the_last_posts_of_its_sub_forums_using_their_dates_only(self):
+        # Setup
+        post = self.create_post(self.forum)
+        # The last post of the sub-forum has been deleted but its date is kept.
+        Forum.objects.filter(pk=self.sub_forum.pk).update(
+            subtree_last_post=None, subtree_last_post_on=post.topic.last_post_on,
+        )
+        forum = Forum.objects.get(pk=self.forum.pk)
+        # Run
+        forum.update_subtree_trackers()
+        # Check
+        assert Forum.objects.get(pk=self.forum.pk).subtree_last_post_on == \
+            post.topic.last_post_on
+
+    def move_sub_forum(self):
+        # The sub-forum is moved using another instance than the one used by the tests.
+        stale_sub_forum = Forum.objects.get(pk=self.sub_forum.pk)
+        sub_forum = Forum.objects.get(pk=self.sub_forum.pk)
+        sub_forum.parent = self.other_forum
+        sub_forum.save()
+        return stale_sub_forum
+
+    def test_rolls_up_its_trackers_over_its_current_ancestors(self):
+        # Setup
+        self.create_post(self.sub_forum)
+        stale_sub_forum = self.move_sub_forum()
+        Forum.objects.filter(pk=self.other_forum.pk).update(subtree_posts_count=0)
+        # Run
+        stale_sub_forum.update_trackers()
+        # Check
+        assert Forum.objects.get(pk=self.other_forum.pk).subtree_posts_count == 1
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_posts_count == 0
+        self.check_subtree_trackers()
+
+    def test_applies_deltas_to_its_current_ancestors(self):
+        # Setup
+        self.create_post(self.sub_forum)
+        stale_sub_forum = self.move_sub_forum()
+        # Run
+        stale_sub_forum.update_trackers_incrementally(posts_delta=1)
+        # Check
+        assert Forum.objects.get(pk=self.other_forum.pk).subtree_posts_count == 2
+        assert Forum.objects.get(pk=self.top_level_cat.pk).subtree_posts_count == 0
@@ -0,0 +1,173 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from faker import Faker
+
+from machina.apps.forum_conversation.forms import TopicForm
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+from machina.test.factories import (
+    PostFactory, UserFactory, build_topic, create_category_forum, create_forum, create_topic
+)
+
+
+faker = Faker()
+
+Forum = get_model('forum', 'Forum')
+Post = get_model('forum_conversation', 'Post')
+Topic = get_model('forum_conversation', 'Topic')
+
+PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
+assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
+deferred_trackers = get_class('forum.trackers', 'deferred_trackers')
+
+
+@pytest.mark.django_db
+class TestDeferredTrackers(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.user = UserFactory.create()
+        self.top_level_cat = create_category_forum()
+        self.forum = create_forum(parent=self.top_level_cat)
+        self.other_forum = create_forum(parent=self.top_level_cat)
+        self.topic = create_topic(forum=self.forum, poster=self.user)
+        self.first_post = PostFactory.create(topic=self.topic, poster=self.user)
+        self.last_post = PostFactory.create(topic=self.topic, poster=self.user)
+
+    def count_updates(self, queries, model):
+        # Only the updates writing the direct trackers of single rows are considered, unlike the
+        # updates of foreign keys performed by deletions or of the totals of the ancestor forums.
+        table = model._meta.db_table
+        field = 'direct_posts_count' if model is Forum else 'posts_count'
+        return len([
+            query for query in queries
+            if query['sql'].startswith('UPDATE "{}"'.format(table)) and
+            'WHERE "{}"."id" = '.format(table) in query['sql'] and
+            ' "{}" = '.format(field) in query['sql']
+        ])
+
+    def check_trackers(self, *forums):
+        for forum in forums:
+            forum = Forum.objects.get(pk=forum.pk)
+            topics = forum.topics.filter(approved=True)
+            assert forum.direct_topics_count == topics.count()
+            assert forum.direct_posts_count == sum(topic.posts_count for topic in topics)
+            last_topic = topics.order_by('-last_post_on').first()
+            assert forum.last_post_id == (last_topic.last_post_id if last_topic else None)
+            for topic in Topic.objects.filter(forum=forum):
+                posts = topic.posts.filter(approved=True).order_by('created')
+                assert topic.posts_count == posts.count()
+                assert topic.first_post_id == topic.posts.order_by('created').first().pk
+                assert topic.last_post_id == posts.last().pk
+
+    def test_updates_the_trackers_of_a_created_topic_once(self):
+        # Setup
+        assign_perm('can_read_forum', self.user, self.forum)
+        assign_perm('can_start_new_topics', self.user, self.forum)
+        assign_perm('can_post_without_approval', self.user, self.forum)
+        form = TopicForm(
+            data={
+                'subject': faker.text(max_nb_chars=200),
+                'content': '[b]{}[/b]'.format(faker.text()),
+                'topic_type': Topic.TOPIC_POST,
+            },
+            user=self.user, forum=self.forum, topic=None,
+        )
+        assert form.is_valid()
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                post = form.save()
+        # Check
+        assert self.count_updates(context.captured_queries, Topic) == 1
+        assert self.count_updates(context.captured_queries, Forum) == 1
+        assert post.topic.first_post == post
+        assert post.topic.posts_count == 1
+        self.check_trackers(self.forum)
+
+    def test_updates_the_trackers_once_for_many_replies(self):
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                for _ in range(3):
+                    PostFactory.create(topic=self.topic, poster=self.user)
+        # Check
+        assert self.count_updates(context.captured_queries, Topic) == 1
+        assert self.count_updates(context.captured_queries, Forum) == 1
+        assert self.topic.posts_count == 5
+        self.check_trackers(self.forum)
+
+    def test_updates_the_trackers_of_an_edited_post_once(self):
+        # Setup
+        self.first_post.subject = faker.text(max_nb_chars=200)
+        self.first_post.approved = False
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                self.first_post.save()
+        # Check
+        assert self.count_updates(context.captured_queries, Topic) == 1
+        assert self.count_updates(context.captured_queries, Forum) == 1
+        topic = Topic.objects.get(pk=self.topic.pk)
+        assert topic.subject == self.first_post.subject
+        assert not topic.approved
+        self.check_trackers(self.forum)
+
+    def test_updates_the_trackers_of_deleted_posts_once(self):
+        # Setup
+        topic = create_topic(forum=self.forum, poster=self.user)
+        post = PostFactory.create(topic=topic, poster=self.user)
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                self.last_post.delete()
+                post.delete()
+        # Check
+        assert self.count_updates(context.captured_queries, Topic) == 1
+        assert self.count_updates(context.captured_queries, Forum) == 1
+        assert not Topic.objects.filter(pk=topic.pk).exists()
+        self.check_trackers(self.forum)
+
+    def test_updates_the_trackers_of_a_moved_topic_once(self):
+        # Setup
+        self.topic.forum = self.other_forum
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                self.topic.save()
+        # Check
+        assert self.count_updates(context.captured_queries, Topic) == 2
+        assert self.count_updates(context.captured_queries, Forum) == 2
+        self.check_trackers(self.forum, self.other_forum)
+
+    def test_merges_nested_units_of_work(self):
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            with deferred_trackers.atomic():
+                PostFactory.create(topic=self.topic, poster=self.user)
+                with deferred_trackers.atomic():
+                    PostFactory.create(topic=self.topic, poster=self.user)
+                assert self.count_updates(context.captured_queries, Topic) == 0
+        # Check
+        assert self.count_updates(context.captured_queries, Forum) == 1
+        self.check_trackers(self.forum)
+
+    def test_does_not_update_the_trackers_if_the_unit_of_work_fails(self):
+        # Run
+        with pytest.raises(ValueError):
+            with deferred_trackers.atomic():
+                topic = build_topic(forum=self.forum, poster=self.user)
+                topic.save()
+                PostFactory.create(topic=topic, poster=self.user)
+                raise ValueError
+        # Check
+        assert not deferred_trackers.active
+        assert Forum.objects.get(pk=self.forum.pk).direct_topics_count == 1
+        self.check_trackers(self.forum)
+
+    def test_updates_the_trackers_immediately_outside_of_a_unit_of_work(self):
+        # Run
+        PostFactory.create(topic=self.topic, poster=self.user)
+        # Check
+        assert Topic.objects.get(pk=self.topic.pk).posts_count == 3
+        self.check_trackers(self.forum)
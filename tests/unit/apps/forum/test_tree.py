@@ -0,0 +1,160 @@
+import pytest
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+from machina.test.factories import (
+    PostFactory, UserFactory, create_category_forum, create_forum, create_topic
+)
+
+
+Forum = get_model('forum', 'Forum')
+
+ForumTreeSnapshot = get_class('forum.tree', 'ForumTreeSnapshot')
+forum_tree = get_class('forum.tree', 'forum_tree')
+
+
+@pytest.mark.django_db
+class TestForumTree(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        # Set up the following forum tree:
+        #
+        #     top_level_cat
+        #         forum_1
+        #             forum_1_child
+        #         forum_2
+        #     top_level_forum
+        #
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_1_child = create_forum(parent=self.forum_1)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.top_level_forum = create_forum()
+
+    def test_contains_the_forums_in_tree_order(self):
+        # Run
+        tree = forum_tree.get()
+        # Check
+        assert list(tree.forums) == list(Forum.objects.all())
+        assert tree.top_nodes == (self.top_level_cat, self.top_level_forum)
+        assert self.forum_1_child in tree
+        assert tree.get_forum(self.forum_2.id) == self.forum_2
+
+    def test_can_return_the_relatives_of_a_forum(self):
+        # Run
+        tree = forum_tree.get()
+        # Check
+        for forum in Forum.objects.all():
+            assert tree.get_children(forum) == tuple(forum.get_children())
+            assert tree.get_ancestors(forum) == tuple(forum.get_ancestors())
+            assert tree.get_ancestors(forum, include_self=True) == \
+                tuple(forum.get_ancestors(include_self=True))
+            assert tree.get_descendants(forum) == tuple(forum.get_descendants())
+            assert tree.get_descendants(forum, include_self=True) == \
+                tuple(forum.get_descendants(include_self=True))
+            assert tree.get_interval(forum) == (forum.tree_id, forum.lft, forum.rght)
+
+
+@pytest.mark.django_db
+class TestForumTreeSnapshot(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_2 = create_forum()
+        yield
+        machina_settings.FORUM_TREE_CACHE_NAME = None
+        caches['default'].clear()
+
+    def test_is_reused_until_a_forum_is_modified(self, django_assert_num_queries):
+        # Setup
+        tree = forum_tree.get()
+        # Run & check
+        with django_assert_num_queries(1):  # The version of the tree is computed.
+            assert forum_tree.get() is tree
+
+    def test_is_invalidated_when_a_forum_is_created_modified_moved_or_deleted(self):
+        # Setup
+        tree = forum_tree.get()
+        # Run & check
+        forum_3 = create_forum()
+        assert forum_3 in forum_tree.get()
+        tree = forum_tree.get()
+        self.forum_2.name = 'Renamed forum'
+        self.forum_2.save()
+        assert forum_tree.get() is not tree
+        assert forum_tree.get().get_forum(self.forum_2.id).name == 'Renamed forum'
+        forum_3.parent = self.top_level_cat
+        forum_3.save()
+        assert forum_tree.get().get_ancestors(forum_3) == (self.top_level_cat, )
+        forum_3.delete()
+        assert forum_3 not in forum_tree.get()
+
+    def test_is_not_invalidated_when_the_trackers_of_a_forum_are_updated(self):
+        # Setup
+        topic = create_topic(forum=self.forum_1, poster=UserFactory.create())
+        tree = forum_tree.get()
+        updated = Forum.objects.get(pk=self.forum_1.pk).updated
+        # Run
+        PostFactory.create(topic=topic, poster=topic.poster)
+        self.forum_1.update_trackers()
+        self.forum_1.update_trackers_incrementally(topics_delta=1, posts_delta=1)
+        # Check
+        assert forum_tree.get() is tree
+        assert Forum.objects.get(pk=self.forum_1.pk).updated == updated
+
+    def test_is_invalidated_when_a_forum_is_moved_among_its_siblings(self):
+        # Setup
+        tree = forum_tree.get()
+        # Run
+        self.forum_2.move_to(self.top_level_cat, 'left')
+        # Check
+        assert forum_tree.get() is not tree
+        assert forum_tree.get().top_nodes == (self.forum_2, self.top_level_cat)
+
+    def test_is_invalidated_when_a_forum_is_modified_from_another_process(self):
+        # Setup
+        tree = forum_tree.get()
+        # Run
+        # Queryset updates don't send any signal, as if the forum was saved by another process.
+        Forum.objects.filter(id=self.forum_2.id).update(name='Renamed forum', updated=now())
+        # Check
+        assert forum_tree.get() is not tree
+        assert forum_tree.get().get_forum(self.forum_2.id).name == 'Renamed forum'
+
+    def test_is_invalidated_when_a_forum_is_moved_from_another_process(self):
+        # Setup
+        forum_3 = create_forum(parent=self.top_level_cat)
+        tree = forum_tree.get()
+        assert tree.get_children(self.top_level_cat) == (self.forum_1, forum_3)
+        # Run
+        # The MPTT fields of the forums are swapped using queryset updates, which neither send any
+        # signal nor modify the update dates of the forums, as if they were moved by another
+        # process.
+        Forum.objects.filter(id=self.forum_1.id).update(lft=forum_3.lft, rght=forum_3.rght)
+        Forum.objects.filter(id=forum_3.id).update(lft=self.forum_1.lft, rght=self.forum_1.rght)
+        # Check
+        assert forum_tree.get() is not tree
+        assert forum_tree.get().get_children(self.top_level_cat) == (forum_3, self.forum_1)
+
+    def test_can_be_shared_using_a_cache(self, django_assert_num_queries):
+        # Setup
+        machina_settings.FORUM_TREE_CACHE_NAME = 'default'
+        forum_tree.get()
+        # Run & check
+        with django_assert_num_queries(0):
+            tree = ForumTreeSnapshot().get()
+        assert list(tree.forums) == list(Forum.objects.all())
+        create_forum()
+        assert len(ForumTreeSnapshot().get()) == 4
+
+    def test_should_raise_if_the_cache_backend_is_not_configured(self):
+        # Setup
+        machina_settings.FORUM_TREE_CACHE_NAME = 'dummy'
+        # Run & check
+        with pytest.raises(ImproperlyConfigured):
+            ForumTreeSnapshot().get()
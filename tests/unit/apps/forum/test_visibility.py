@@ -192,6 +192,30 @@ class TestForumVisibilityContentNode(object):
         # Run & check
         assert visibility_tree.as_dict[self.top_level_cat.id].topics_count == 3
 
+    def test_uses_the_stored_totals_of_its_sub_forums_if_they_are_all_visible(
+            self, django_assert_num_queries):
+        # Setup
+        visibility_tree = ForumVisibilityContentTree.from_forums(Forum.objects.all())
+        node = visibility_tree.as_dict[self.top_level_cat.id]
+        # Run & check
+        with django_assert_num_queries(0):
+            assert node.is_complete
+            assert node.posts_count == 3
+            assert node.last_post.poster == self.user
+
+    def test_does_not_count_the_sub_forums_that_are_not_visible(self):
+        # Setup
+        visibility_tree = ForumVisibilityContentTree.from_forums(
+            Forum.objects.exclude(pk=self.forum_2_child_1.pk),
+        )
+        node = visibility_tree.as_dict[self.top_level_cat.id]
+        # Run & check
+        assert not node.is_complete
+        assert visibility_tree.as_dict[self.forum_1.id].is_complete
+        assert node.posts_count == 2
+        assert node.topics_count == 2
+        assert node.last_post == self.post_2
+
     def test_can_return_an_appropriate_boolean_value(self):
         visibility_tree_1 = ForumVisibilityContentTree.from_forums(Forum.objects.all())
         visibility_tree_2 = ForumVisibilityContentTree.from_forums(
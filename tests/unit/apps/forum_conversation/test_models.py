@@ -1,7 +1,12 @@
+import random
+
 import pytest
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from faker import Faker
 
+from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
 from machina.test.factories import (
     PostFactory, UserFactory, build_topic, create_category_forum, create_forum, create_link_forum,
@@ -277,3 +282,83 @@ class TestPost(object):
         with pytest.raises(ValidationError):
             post = PostFactory.build(topic=self.topic, poster=None, anonymous_key='1234')
             post.clean()
+
+
+@pytest.mark.django_db
+class TestIncrementalTrackers(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.INCREMENTAL_TRACKERS = True
+        self.u1 = UserFactory.create()
+        self.forum = create_forum()
+        yield
+        machina_settings.INCREMENTAL_TRACKERS = False
+
+    def get_trackers(self):
+        topics = {
+            topic.pk: (
+                topic.posts_count, topic.first_post_id, topic.last_post_id, topic.last_post_on,
+                topic.approved,
+            )
+            for topic in Topic.objects.filter(forum=self.forum)
+        }
+        forum = Forum.objects.get(pk=self.forum.pk)
+        return topics, (
+            forum.direct_topics_count, forum.direct_posts_count, forum.last_post_id,
+            forum.last_post_on,
+        )
+
+    def get_recomputed_trackers(self):
+        for topic in Topic.objects.filter(forum=self.forum):
+            topic.update_trackers()
+        Forum.objects.get(pk=self.forum.pk).update_trackers()
+        return self.get_trackers()
+
+    def create_post(self, topic, **kwargs):
+        post = PostFactory.create(topic=topic, poster=self.u1, **kwargs)
+        # Posts are not created within the same microsecond in practice.
+        Post.objects.filter(pk=post.pk).update(created=post.created)
+        return post
+
+    @pytest.mark.parametrize('seed', range(4))
+    def test_produce_the_same_trackers_as_a_full_recomputation(self, seed):
+        # Setup
+        rng = random.Random(seed)
+        topics = [create_topic(forum=self.forum, poster=self.u1) for _ in range(3)]
+        posts = [self.create_post(topic, approved=rng.random() < 0.8) for topic in topics]
+        # Run
+        for _ in range(25):
+            action = rng.choice(['reply', 'reply', 'approve', 'disapprove', 'delete', 'edit'])
+            if action == 'reply':
+                topic = Topic.objects.filter(pk=rng.choice(topics).pk).first()
+                if topic is not None:
+                    posts.append(self.create_post(topic, approved=rng.random() < 0.7))
+                continue
+            post = Post.objects.filter(pk=rng.choice(posts).pk).first()
+            if post is None or not Topic.objects.filter(pk=post.topic_id).exists():
+                continue
+            if action in ('approve', 'disapprove', 'edit'):
+                post.approved = {'approve': True, 'disapprove': False}.get(action, post.approved)
+                post.subject = faker.text(max_nb_chars=200)
+                post.save()
+            else:
+                post.delete()
+        # Check
+        assert self.get_trackers() == self.get_recomputed_trackers()
+
+    def test_create_replies_using_a_number_of_queries_independent_of_the_forum_size(self):
+        # Setup
+        def measure():
+            topic = Topic.objects.filter(forum=self.forum).select_related('forum').first()
+            with CaptureQueriesContext(connection) as context:
+                self.create_post(topic)
+            return len(context.captured_queries)
+
+        topic = create_topic(forum=self.forum, poster=self.u1)
+        self.create_post(topic)
+        # Run & check
+        queries_count = measure()
+        for _ in range(10):
+            self.create_post(create_topic(forum=self.forum, poster=self.u1))
+        assert measure() == queries_count
+        assert self.get_trackers() == self.get_recomputed_trackers()
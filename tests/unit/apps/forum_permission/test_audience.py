@@ -0,0 +1,137 @@
+import random
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+
+from machina.apps.forum_permission.audience import ForumAudienceResolver
+from machina.apps.forum_permission.checker import ForumPermissionChecker
+from machina.apps.forum_permission.shortcuts import ALL_AUTHENTICATED_USERS, assign_perm
+from machina.conf import settings as machina_settings
+from machina.test.factories import GroupFactory, UserFactory, create_category_forum, create_forum
+
+
+@pytest.mark.django_db
+class TestForumAudienceResolver(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.rng = random.Random(42)
+        top_level_cat = create_category_forum()
+        self.forums = [top_level_cat, create_forum(parent=top_level_cat), create_forum()]
+        self.groups = [GroupFactory.create() for _ in range(4)]
+        self.users = [UserFactory.create() for _ in range(12)]
+        for user in self.users:
+            user.groups.add(*self.rng.sample(self.groups, self.rng.randint(0, 3)))
+        yield
+        machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS = []
+
+    def assign_random_perms(self, rows_count):
+        targets = [ALL_AUTHENTICATED_USERS, AnonymousUser()] + self.groups + self.users
+        assigned = set()
+        while len(assigned) < rows_count:
+            target = self.rng.choice(targets)
+            codename = self.rng.choice(['can_read_forum', 'can_see_forum'])
+            forum = self.rng.choice(self.forums + [None])
+            key = (id(target), codename, forum.id if forum else None)
+            if key in assigned:
+                continue
+            assigned.add(key)
+            assign_perm(codename, target, forum, has_perm=self.rng.random() < 0.6)
+
+    def get_expected_user_ids(self, forum, codename):
+        return [
+            user.id for user in self.users
+            if codename in ForumPermissionChecker(user).get_perms_for_forumlist(
+                [forum], [codename])[forum]
+        ]
+
+    @pytest.mark.parametrize('seed', range(8))
+    def test_returns_the_same_users_as_the_permission_checker(self, seed):
+        # Setup
+        self.rng.seed(seed)
+        if seed % 2:
+            machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS = ['can_read_forum']
+        self.assign_random_perms(30)
+        # Run
+        audiences = ForumAudienceResolver().get_audiences(self.forums, 'can_read_forum')
+        # Check
+        for forum, audience in audiences.items():
+            assert list(audience.iter_user_ids()) == \
+                self.get_expected_user_ids(forum, 'can_read_forum')
+            assert audience.anonymous_user == ForumPermissionChecker(AnonymousUser()).has_perm(
+                'can_read_forum', forum)
+
+    def test_can_restrict_the_considered_users(self):
+        # Setup
+        assign_perm('can_read_forum', ALL_AUTHENTICATED_USERS, None)
+        assign_perm('can_read_forum', self.users[0], self.forums[1], has_perm=False)
+        users = self.users[0].__class__.objects.filter(id__in=[u.id for u in self.users[:3]])
+        # Run
+        audience = ForumAudienceResolver().get_audience(self.forums[1], 'can_read_forum')
+        # Check
+        assert list(audience.iter_user_ids(users, chunk_size=1)) == [
+            self.users[1].id, self.users[2].id,
+        ]
+        assert audience.user_overrides == {self.users[0].id: False}
+
+    @pytest.mark.parametrize('all_users', [True, False])
+    def test_does_not_return_inactive_users(self, all_users):
+        # Setup
+        if all_users:
+            assign_perm('can_read_forum', ALL_AUTHENTICATED_USERS, None)
+        assign_perm('can_read_forum', self.users[0], None)
+        self.users[0].is_active = False
+        self.users[0].save()
+        # Run
+        audience = ForumAudienceResolver().get_audience(self.forums[1], 'can_read_forum')
+        # Check
+        user_ids = list(audience.iter_user_ids())
+        assert self.users[0].id not in user_ids
+        assert user_ids == [
+            user.id for user in self.users
+            if ForumPermissionChecker(user).has_perm('can_read_forum', self.forums[1])
+        ]
+
+    @pytest.mark.parametrize('all_users', [True, False])
+    def test_always_returns_the_superusers(self, all_users):
+        # Setup
+        if all_users:
+            assign_perm('can_read_forum', ALL_AUTHENTICATED_USERS, None)
+        assign_perm('can_read_forum', self.users[0], self.forums[1], has_perm=False)
+        assign_perm('can_read_forum', self.users[1], None)
+        self.users[0].is_superuser = True
+        self.users[0].save()
+        self.users[1].is_superuser = True
+        self.users[1].save()
+        # Run
+        audience = ForumAudienceResolver().get_audience(self.forums[1], 'can_read_forum')
+        # Check
+        user_ids = list(audience.iter_user_ids(chunk_size=1))
+        assert user_ids[:2] == [self.users[0].id, self.users[1].id]
+        assert user_ids == [
+            user.id for user in self.users
+            if ForumPermissionChecker(user).has_perm('can_read_forum', self.forums[1])
+        ]
+
+    def test_returns_the_qualifying_groups(self):
+        # Setup
+        g1, g2, g3, g4 = self.groups
+        assign_perm('can_read_forum', g1, None)
+        assign_perm('can_read_forum', g2, self.forums[0])
+        assign_perm('can_read_forum', g3, None, has_perm=False)
+        # Run
+        audience = ForumAudienceResolver().get_audience(self.forums[0], 'can_read_forum')
+        # Check
+        assert not audience.authenticated_users
+        assert audience.granted_group_ids == {g1.id, g2.id}
+        assert audience.denied_group_ids == {g3.id}
+        assert set(audience.get_granted_groups()) == {g1, g2}
+        assign_perm('can_read_forum', ALL_AUTHENTICATED_USERS, None)
+        audience = ForumAudienceResolver().get_audience(self.forums[0], 'can_read_forum')
+        assert set(audience.get_granted_groups()) == {g1, g2, g4}
+
+    def test_loads_the_permission_rows_of_all_the_forums_at_once(self, django_assert_num_queries):
+        # Setup
+        self.assign_random_perms(20)
+        # Run & check
+        with django_assert_num_queries(2):
+            ForumAudienceResolver().get_audiences(self.forums, 'can_read_forum')
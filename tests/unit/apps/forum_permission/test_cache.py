@@ -0,0 +1,192 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from machina.apps.forum_permission.cache import PermissionCache, cache
+from machina.apps.forum_permission.checker import ForumPermissionChecker
+from machina.apps.forum_permission.handler import PermissionHandler
+from machina.apps.forum_permission.shortcuts import assign_perm, remove_perm
+from machina.conf import settings as machina_settings
+from machina.test.factories import GroupFactory, UserFactory, create_forum
+
+
+@pytest.mark.django_db
+class TestPermissionCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.PERMISSION_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.user = UserFactory.create()
+        self.group = GroupFactory.create()
+        self.user.groups.add(self.group)
+        self.forum_1 = create_forum()
+        self.forum_2 = create_forum()
+        assign_perm('can_read_forum', self.group, self.forum_1)
+        yield
+        machina_settings.PERMISSION_CACHE_NAME = None
+        caches['default'].clear()
+
+    def test_is_disabled_if_no_cache_name_is_configured(self):
+        # Setup
+        machina_settings.PERMISSION_CACHE_NAME = None
+        # Run & check
+        assert not cache.enabled
+        assert ForumPermissionChecker(self.user).get_shared_perms() is None
+
+    def test_should_raise_if_the_cache_backend_is_not_configured(self):
+        # Setup
+        machina_settings.PERMISSION_CACHE_NAME = 'dummy'
+        # Run & check
+        with pytest.raises(ImproperlyConfigured):
+            PermissionCache().get_generation()
+
+    def test_shares_the_resolved_permissions_across_checkers(self, django_assert_num_queries):
+        # Setup
+        ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+        checker = ForumPermissionChecker(self.user)
+        # Run & check
+        with django_assert_num_queries(1):  # The fingerprint of the user is computed.
+            assert checker.has_perm('can_read_forum', self.forum_1)
+            assert not checker.has_perm('can_read_forum', self.forum_2)
+        anonymous_checker = ForumPermissionChecker(AnonymousUser())
+        anonymous_checker.has_perm('can_read_forum', self.forum_1)
+        with django_assert_num_queries(0):
+            assert not ForumPermissionChecker(AnonymousUser()).has_perm(
+                'can_read_forum', self.forum_1)
+
+    def test_shares_the_granted_forums_across_handlers(self, django_assert_num_queries):
+        # Setup
+        PermissionHandler().get_readable_forums([self.forum_1, self.forum_2], self.user)
+        # Run & check
+        with django_assert_num_queries(2):  # The fingerprint of the user and the forums.
+            readable_forums = PermissionHandler().get_readable_forums(
+                [self.forum_1, self.forum_2], self.user)
+        assert readable_forums == [self.forum_1]
+
+    def test_is_invalidated_when_a_permission_is_modified(self):
+        # Setup
+        assert not ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_2)
+        generation = cache.get_generation()
+        # Run
+        assign_perm('can_read_forum', self.user, self.forum_2)
+        # Check
+        assert cache.get_generation() > generation
+        assert ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_2)
+        remove_perm('can_read_forum', self.user, self.forum_2)
+        assert not ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_2)
+
+    def test_is_invalidated_when_the_groups_of_a_user_change(self):
+        # Setup
+        assert ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+        generation = cache.get_generation()
+        # Run
+        self.user.groups.remove(self.group)
+        # Check
+        assert cache.get_generation() > generation
+        assert not ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+
+    def test_is_invalidated_when_the_tree_of_forums_changes(self):
+        # Setup
+        assert PermissionHandler().get_readable_forums(
+            [self.forum_1, self.forum_2], self.user) == [self.forum_1]
+        generation = cache.get_generation()
+        # Run
+        forum_3 = create_forum()
+        assign_perm('can_read_forum', self.user, forum_3)
+        self.forum_2.parent = self.forum_1
+        self.forum_2.save()
+        # Check
+        assert cache.get_generation() > generation
+        generation = cache.get_generation()
+        self.forum_2.update_trackers()
+        assert cache.get_generation() == generation
+        self.forum_2.delete()
+        assert cache.get_generation() > generation
+
+    def test_bumps_the_generation_again_once_the_transaction_is_committed(
+            self, django_capture_on_commit_callbacks):
+        # Run
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                self.group.user_set.remove(self.user)
+                # A request running before the commit reads the previous rows and caches them
+                # under the current generation.
+                generation = cache.get_generation()
+        # Check
+        assert cache.get_generation() > generation
+
+    def test_bumps_the_generation_of_a_batch_once_the_transaction_is_committed(
+            self, django_capture_on_commit_callbacks):
+        # Run
+        with django_capture_on_commit_callbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                with cache.batch():
+                    generation = cache.get_generation()
+                    cache.bump_generation()
+                    cache.bump_generation()
+                    assert cache.get_generation() == generation
+                generation = cache.get_generation()
+        # Check
+        assert len(callbacks) == 1
+        assert cache.get_generation() > generation
+
+    def test_keeps_a_generation_if_the_generation_key_is_evicted(self):
+        # Setup
+        generation = cache.get_generation()
+        caches['default'].delete(cache.generation_key)
+        # Run & check
+        assert cache.get_generation() >= generation
+        cache.bump_generation()
+        assert cache.get_generation() > generation
+
+    def test_shares_the_resolved_permissions_between_users_having_the_same_fingerprint(
+            self, django_assert_num_queries):
+        # Setup
+        other_user = UserFactory.create()
+        other_user.groups.add(self.group)
+        PermissionHandler().get_readable_forums([self.forum_1, self.forum_2], self.user)
+        ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+        # Run & check
+        with django_assert_num_queries(1):  # The fingerprint of the user is computed.
+            assert ForumPermissionChecker(other_user).has_perm('can_read_forum', self.forum_1)
+        with django_assert_num_queries(2):  # The fingerprint of the user and the forums.
+            assert PermissionHandler().get_readable_forums(
+                [self.forum_1, self.forum_2], other_user) == [self.forum_1]
+
+    def test_shares_checkers_between_users_having_the_same_fingerprint(
+            self, django_assert_num_queries):
+        # Setup
+        other_user = UserFactory.create()
+        other_user.groups.add(self.group)
+        handler = PermissionHandler()
+        assert handler.can_read_forum(self.forum_1, self.user)
+        # Run & check
+        with django_assert_num_queries(1):  # The fingerprint of the user is computed.
+            assert handler.can_read_forum(self.forum_1, other_user)
+            assert not handler.can_read_forum(self.forum_2, other_user)
+
+
+@pytest.mark.django_db
+class TestForumPermissionCheckerFingerprint(object):
+    def test_is_the_same_for_users_having_the_same_groups(self):
+        # Setup
+        g1, g2 = GroupFactory.create(), GroupFactory.create()
+        u1, u2, u3 = UserFactory.create(), UserFactory.create(), UserFactory.create()
+        u1.groups.add(g1, g2)
+        u2.groups.add(g2, g1)
+        u3.groups.add(g1)
+        # Run & check
+        assert ForumPermissionChecker(u1).get_fingerprint() == \
+            ForumPermissionChecker(u2).get_fingerprint() == \
+            ('authenticated', tuple(sorted([g1.id, g2.id])), None)
+        assert ForumPermissionChecker(u3).get_fingerprint() == ('authenticated', (g1.id, ), None)
+        assert ForumPermissionChecker(AnonymousUser()).get_fingerprint() == ('anonymous', )
+
+    def test_contains_the_user_id_if_some_permissions_target_the_user(self):
+        # Setup
+        u1 = UserFactory.create()
+        assign_perm('can_read_forum', u1, None)
+        # Run & check
+        assert ForumPermissionChecker(u1).get_fingerprint() == ('authenticated', (), u1.id)
@@ -0,0 +1,324 @@
+import random
+from collections import OrderedDict
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import Q
+
+from machina.apps.forum_permission.checker import ForumPermissionChecker
+from machina.apps.forum_permission.engine import PermissionResolutionEngine
+from machina.apps.forum_permission.models import (
+    ForumPermission, GroupForumPermission, UserForumPermission
+)
+from machina.apps.forum_permission.shortcuts import ALL_AUTHENTICATED_USERS, assign_perm
+from machina.conf import settings as machina_settings
+from machina.test.factories import GroupFactory, UserFactory, create_category_forum, create_forum
+
+
+class LegacyForumPermissionChecker(ForumPermissionChecker):
+    """ Reference implementation of the nested filtering resolution used before the bitset engine.
+    """
+
+    def get_perms_for_forumlist(self, forums, perm_codenames=None):
+        """
+            Computes and returns a dictionary of [forum] to (set of permissions) for the user,
+            taking into account precendence of permissions:
+                - forum > global
+                - user > group > all_authenticated_users
+            Expects:
+            - forums to be a list of forum objects
+            - perm_codenames to be a list of permission codes (strings) to look for or None
+        """
+        globally_granted_all_users_perms = set()
+        globally_granted_group_perms, globally_nongranted_group_perms = set(), set()
+
+        user_perms = (
+            UserForumPermission.objects.select_related()
+            .filter(Q(forum__isnull=True) | Q(forum__in=forums))
+        )
+        if perm_codenames:
+            user_perms = user_perms.filter(permission__codename__in=perm_codenames)
+
+        # Do some additional filtering on (type of) user
+        if self.user.is_anonymous:
+            user_perms = user_perms.filter(anonymous_user=True)
+            all_users_perms = None
+            group_perms = None
+        else:
+            two_types_user_perms = user_perms.filter(Q(authenticated_user=True) | Q(user=self.user))
+            all_users_perms = [p for p in two_types_user_perms if p.authenticated_user]
+            user_perms = [p for p in two_types_user_perms if p.user]
+            # Now get group permissions
+            user_model = get_user_model()
+            user_groups_related_name = user_model.groups.field.related_query_name()
+            group_perms = (
+                GroupForumPermission.objects.select_related()
+                .filter(**{'group__{}'.format(user_groups_related_name): self.user})
+                .filter(Q(forum__isnull=True) | Q(forum__in=forums))
+            )
+            if perm_codenames:
+                group_perms = group_perms.filter(permission__codename__in=perm_codenames)
+
+            # The following 3 lists can already be made outside of the loop over forums
+            # But only for non-anonymous users so we do it here
+            globally_granted_all_users_perms = list(
+                filter(lambda p: p.has_perm and p.forum_id is None, all_users_perms)
+            )
+            globally_granted_group_perms = list(
+                filter(lambda p: p.has_perm and p.forum_id is None, group_perms)
+            )
+            globally_nongranted_group_perms = list(
+                filter(lambda p: not p.has_perm and p.forum_id is None, group_perms)
+            )
+
+        # Computes the list of permissions that are non-granted for all the forums.
+        globally_nongranted_user_perms = list(
+            filter(lambda p: not p.has_perm and p.forum_id is None, user_perms)
+        )
+        # Computes the list of permissions that are granted for all the forums.
+        globally_granted_user_perms = list(
+            filter(lambda p: p.has_perm and p.forum_id is None, user_perms)
+        )
+        globally_granted_user_permcodes = [
+            p.permission.codename for p in globally_granted_user_perms
+        ]
+        # If the considered user has no global permissions, the permissions defined by the
+        # DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS settings are used instead.
+        if self.user.is_authenticated and not globally_granted_user_permcodes:
+            globally_granted_user_permcodes = machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS  # noqa: E501
+
+        forum_to_permissions = OrderedDict()
+        for f in forums:
+            """
+            In every place that we check on f.id we first check if f is actually there
+            It might be None because some tests only try global permissions without forum
+            """
+            # (Re)set these variables for each loop
+            permcodes, granted_group_permcodes, granted_all_users_permcodes = set(), set(), set()
+
+            # ########## BLOCK FOR PERMS SPECIFIC TO ONE LOGGED IN USER ###########
+            per_forum_granted_user_perms = list(
+                filter(lambda p: p.has_perm and f and p.forum_id == f.id, user_perms)
+            )
+            per_forum_granted_user_permcodes = [
+                p.permission.codename for p in per_forum_granted_user_perms
+            ]
+            per_forum_nongranted_user_perms = list(
+                filter(lambda p: not p.has_perm and f and p.forum_id == f.id, user_perms)
+            )
+            per_forum_nongranted_user_permcodes = [
+                p.permission.codename for p in per_forum_nongranted_user_perms
+            ]
+
+            per_forum_granted_group_perms = []
+            per_forum_nongranted_group_perms = []
+            per_forum_nongranted_all_users_permcodes = []
+            # ########## BLOCK FOR PERMS SPECIFIC TO GROUPS OF LOGGED IN USER ###########
+            # If the user is a registered user, we have to check the permissions of its groups
+            # in order to determine the additional permissions they could have.
+            if not self.user.is_anonymous:
+                if group_perms:
+                    # A permission can be non-granted on user-forum level, and that takes
+                    # precedence over granted group permissions so we do not add those to the list.
+                    per_forum_granted_group_perms = list(
+                        filter(lambda p: p.has_perm and f and p.forum_id == f.id and
+                               p.permission_id not in
+                               [q.permission_id for q in per_forum_nongranted_user_perms],
+                               group_perms)
+                    )
+                    per_forum_granted_group_permcodes = [
+                        p.permission.codename for p in per_forum_granted_group_perms
+                    ]
+                    # A permission can be granted on user-forum level, and that takes precedence
+                    # over nongranted group permissions so we do not add those to the list.
+                    per_forum_nongranted_group_perms = list(
+                        filter(lambda p: not p.has_perm and f and p.forum_id == f.id and
+                               p.permission_id not in
+                               [q.permission_id for q in per_forum_granted_user_perms],
+                               group_perms)
+                    )
+
+                    # Filter the globally granted group perms to those that were:
+                    # - not set to non-granted on global-user level
+                    # - and not set to non-granted on forum-group level
+                    # - and not set to non-granted on forum-user level
+                    globally_granted_group_perms = list(
+                        filter(lambda p: p.has_perm and p.forum_id is None and
+                               p.permission_id not in
+                               [q.permission_id for q in globally_nongranted_user_perms] and
+                               p.permission_id not in
+                               [y.permission_id for y in per_forum_nongranted_group_perms] and
+                               p.permission_id not in
+                               [z.permission_id for z in per_forum_nongranted_user_perms],
+                               globally_granted_group_perms)
+                    )
+                    globally_granted_group_permcodes = [
+                        p.permission.codename for p in globally_granted_group_perms
+                    ]
+
+                    # Filter the globally non granted group perms to those that were:
+                    # - not set to granted on global- user level
+                    # - and not set to granted on forum-group level
+                    # - and not set to granted on forum-user level
+                    globally_nongranted_group_perms = list(
+                        filter(lambda p: not p.has_perm and p.forum_id is None and
+                               p.permission_id not in
+                               [q.permission_id for q in globally_granted_user_perms] and
+                               p.permission_id not in
+                               [y.permission_id for y in per_forum_granted_group_perms] and
+                               p.permission_id not in
+                               [z.permission_id for z in per_forum_granted_user_perms],
+                               globally_nongranted_group_perms)
+                    )
+                    granted_group_permcodes = set(globally_granted_group_permcodes +
+                                                  per_forum_granted_group_permcodes)
+
+                # ######### BLOCK FOR PERMS FOR EVERY LOGGED IN USER ##########
+                # A permission can be non-granted on user-forum or group-forum level, and
+                # that takes precedence over granted all_users permissions so we do not add
+                # those to the list.
+                per_forum_granted_all_users_perms = list(
+                    filter(lambda p: p.has_perm and f and p.forum_id == f.id and
+                           p.permission_id not in
+                           [q.permission_id for q in per_forum_nongranted_user_perms] and
+                           p.permission_id not in
+                           [z.permission_id for z in per_forum_nongranted_group_perms],
+                           all_users_perms)
+                )
+                per_forum_granted_all_users_permcodes = [
+                    p.permission.codename for p in per_forum_granted_all_users_perms
+                ]
+
+                # A permission can be granted on user-forum or group-forum level, and that takes
+                # precedence over nongranted all_user permissions so we do not add those to
+                # the list
+                per_forum_nongranted_all_users_perms = list(
+                    filter(lambda p: not p.has_perm and f and p.forum_id == f.id and
+                           p.permission_id not in
+                           [q.permission_id for q in per_forum_granted_user_perms] and
+                           p.permission_id not in
+                           [z.permission_id for z in per_forum_granted_group_perms],
+                           all_users_perms)
+                )
+                per_forum_nongranted_all_users_permcodes = [
+                    p.permission.codename for p in per_forum_nongranted_all_users_perms
+                ]
+                # Filter the globally granted all users perms to those that were:
+                # - not set to non-granted on forum-all_user level
+                # - and not set to non-granted on global-user level
+                # - and not set to non-granted on global-group level
+                # - and not set to non-granted on forum-group level
+                # - and not set to non-granted on forum-user level
+                globally_granted_all_users_perms = list(
+                    filter(lambda p: p.has_perm and p.forum_id is None and
+                           p.permission_id not in
+                           [y.permission_id for y in per_forum_nongranted_all_users_perms] and
+                           p.permission_id not in
+                           [q.permission_id for q in globally_nongranted_user_perms] and
+                           p.permission_id not in
+                           [a.permission_id for a in globally_nongranted_group_perms] and
+                           p.permission_id not in
+                           [x.permission_id for x in per_forum_nongranted_group_perms] and
+                           p.permission_id not in
+                           [z.permission_id for z in per_forum_nongranted_user_perms],
+                           globally_granted_all_users_perms)
+                )
+                globally_granted_all_users_permcodes = [
+                    p.permission.codename for p in globally_granted_all_users_perms
+                ]
+                granted_all_users_permcodes = set(globally_granted_all_users_permcodes +
+                                                  per_forum_granted_all_users_permcodes)
+
+            # Finally computes the list of permission codenames that are
+            # granted to the user for the considered forum.
+            # We can not do this earlier because
+            # globally_granted_user_perms can be from the setting
+            # DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS in which case
+            # it only contains permission codes and not actual permission
+            # objects that we can loop over and check against.
+            granted_user_permcodes = [
+                c for c in globally_granted_user_permcodes if
+                c not in per_forum_nongranted_user_permcodes and
+                c not in per_forum_nongranted_all_users_permcodes
+            ]
+            permcodes = set(granted_user_permcodes +
+                            per_forum_granted_user_permcodes)
+            # Includes the permissions granted for the user's groups and for all logged
+            # in users (that were not overruled by more specific targets) in the initial
+            # set of permission codenames.
+            forum_to_permissions[f] = permcodes.union(granted_group_permcodes,
+                                                      granted_all_users_permcodes)
+
+        return forum_to_permissions
+
+
+@pytest.mark.django_db
+class TestPermissionResolutionEngine(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.rng = random.Random(42)
+        self.codenames = list(ForumPermission.objects.values_list('codename', flat=True))
+        top_level_cat = create_category_forum()
+        self.forums = [top_level_cat]
+        for _ in range(3):
+            forum = create_forum(parent=top_level_cat)
+            self.forums.extend([forum, create_forum(parent=forum)])
+        self.forums.append(create_forum())
+        self.groups = [GroupFactory.create() for _ in range(3)]
+        self.users = [UserFactory.create() for _ in range(4)]
+        for user in self.users:
+            user.groups.add(*self.rng.sample(self.groups, self.rng.randint(0, 3)))
+
+    def teardown_method(self, method):
+        machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS = []
+
+    def assign_random_perms(self, rows_count):
+        targets = [ALL_AUTHENTICATED_USERS, AnonymousUser()] + self.groups + self.users
+        assigned = set()
+        while len(assigned) < rows_count:
+            target = self.rng.choice(targets)
+            codename = self.rng.choice(self.codenames)
+            forum = self.rng.choice(self.forums + [None, None])
+            key = (id(target), codename, forum.id if forum else None)
+            if key in assigned:
+                continue
+            assigned.add(key)
+            assign_perm(codename, target, forum, has_perm=self.rng.random() < 0.6)
+
+    def assert_same_perms(self, user, forums, perm_codenames=None):
+        expected = LegacyForumPermissionChecker(user).get_perms_for_forumlist(
+            forums, perm_codenames)
+        engine = PermissionResolutionEngine(user)
+        assert engine.get_perms_for_forumlist(forums, perm_codenames) == expected
+
+    @pytest.mark.parametrize('seed', range(8))
+    def test_computes_the_same_permissions_as_the_legacy_resolution(self, seed):
+        # Setup
+        self.rng.seed(seed)
+        if seed % 2:
+            machina_settings.DEFAULT_AUTHENTICATED_USER_FORUM_PERMISSIONS = [
+                'can_see_forum', 'can_read_forum',
+            ]
+        self.assign_random_perms(120)
+        shuffled_forums = self.forums[:]
+        self.rng.shuffle(shuffled_forums)
+        # Run & check
+        for user in self.users + [AnonymousUser()]:
+            self.assert_same_perms(user, self.forums)
+            self.assert_same_perms(user, shuffled_forums)
+            self.assert_same_perms(user, [None])
+            self.assert_same_perms(user, self.forums, ['can_see_forum', 'can_read_forum'])
+            for forum in self.forums:
+                self.assert_same_perms(user, [forum])
+
+    def test_performs_a_constant_number_of_queries_regardless_of_the_number_of_forums(
+            self, django_assert_num_queries):
+        # Setup
+        self.assign_random_perms(60)
+        user = self.users[0]
+        # Run & check
+        with django_assert_num_queries(2):
+            PermissionResolutionEngine(user).get_perms_for_forumlist(self.forums)
+        with django_assert_num_queries(1):
+            PermissionResolutionEngine(AnonymousUser()).get_perms_for_forumlist(self.forums)
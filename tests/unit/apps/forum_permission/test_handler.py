@@ -1,7 +1,12 @@
 import datetime as dt
+import random
 
 import pytest
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 
 from machina.conf import settings as machina_settings
 from machina.core.db.models import get_model
@@ -13,6 +18,7 @@ from machina.test.factories import (
 
 
 Forum = get_model('forum', 'Forum')
+GrantedForum = get_model('forum_permission', 'GrantedForum')
 Post = get_model('forum_conversation', 'Post')
 Topic = get_model('forum_conversation', 'Topic')
 
@@ -21,6 +27,9 @@ remove_perm = get_class('forum_permission.shortcuts', 'remove_perm')
 
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 
+forum_tree = get_class('forum.tree', 'forum_tree')
+permission_cache = get_class('forum_permission.cache', 'cache')
+
 
 @pytest.mark.django_db
 class TestPermissionHandler(object):
@@ -128,6 +137,16 @@ class TestPermissionHandler(object):
         assert set(readable_forums_1) == set([self.top_level_cat, self.forum_1, self.forum_3, ])
         assert set(readable_forums_2) == set(Forum.objects.all())
 
+    def test_can_return_a_list_of_readable_forums_without_fetching_them_again(
+            self, django_assert_num_queries):
+        # Setup
+        forums = list(Forum.objects.all())
+        forum_tree.get()
+        # Run & check
+        with django_assert_num_queries(3):  # The tree version, the user and group permissions.
+            readable_forums = self.perm_handler.get_readable_forums(forums, self.u1)
+        assert readable_forums == [self.top_level_cat, self.forum_1, self.forum_3]
+
     def test_can_return_a_list_of_readable_forums_taking_into_account_user_over_group_precedence(self):  # noqa: E501
 
         u2 = UserFactory.create()
@@ -428,6 +447,16 @@ class TestPermissionHandler(object):
         assert not self.perm_handler.can_vote_in_poll(poll_2, u3)
         assert not self.perm_handler.can_vote_in_poll(poll_3, u3)
 
+    def test_knows_that_an_anonymous_user_whose_forum_key_is_not_generated_yet_can_vote_in_polls(
+            self):
+        # Setup
+        u3 = AnonymousUser()
+        u3.forum_key_loader = lambda create: None
+        poll_1 = TopicPollFactory.create(topic=self.forum_1_topic)
+        assign_perm('can_vote_in_polls', u3, self.forum_1)
+        # Run & check
+        assert self.perm_handler.can_vote_in_poll(poll_1, u3)
+
     def test_knows_that_a_superuser_can_vote_in_polls(self):
         # Setup
         poll = TopicPollFactory.create(topic=self.forum_1_topic)
@@ -776,3 +805,383 @@ class TestPermissionHandler(object):
         assign_perm('can_read_forum', u2, self.forum_1)
         # Run & check
         assert not self.perm_handler.can_unsubscribe_from_topic(self.forum_1_topic, u2)
+
+    def test_can_evaluate_a_batch_of_permission_checks(self, django_assert_max_num_queries):
+        # Setup
+        u2 = UserFactory.create()
+        assign_perm('can_edit_own_posts', self.u1, None)
+        assign_perm('can_delete_posts', self.g1, self.forum_3)
+        checks = [
+            ('can_edit_post', self.post_1),
+            ('can_delete_post', self.post_2),
+            ('can_add_topic', self.forum_1),
+            ('can_read_forum', self.forum_2),
+            ('can_add_post', self.forum_3_topic),
+            ('can_access_moderation_queue', None),
+        ]
+        forum_tree.get()
+        # Run
+        with django_assert_max_num_queries(5):
+            permissions = PermissionHandler().get_permissions(checks, self.u1)
+        # Check
+        for user in (self.u1, u2):
+            handler = PermissionHandler()
+            permissions = handler.get_permissions(checks, user)
+            assert permissions == {
+                (method, obj): (
+                    getattr(handler, method)(obj, user) if obj is not None
+                    else getattr(handler, method)(user)
+                )
+                for method, obj in checks
+            }
+        assert permissions[('can_edit_post', self.post_1)] is False
+
+    def test_cannot_evaluate_a_batch_containing_non_permission_methods(self):
+        # Run & check
+        with pytest.raises(ValueError):
+            self.perm_handler.get_permissions([('_get_checker', None)], self.u1)
+        with pytest.raises(ValueError):
+            self.perm_handler.get_permissions([('unknown', self.forum_1)], self.u1)
+
+
+@pytest.mark.django_db
+class TestPermissionHandlerQuerysetMode(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.PERMISSION_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.u1 = UserFactory.create()
+        self.u2 = UserFactory.create()
+        self.g1 = GroupFactory.create()
+        self.u1.groups.add(self.g1)
+        self.anonymous_user = AnonymousUser()
+
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.forum_2_child = create_forum(parent=self.forum_2)
+        self.top_level_forum = create_forum()
+
+        for user in (self.g1, self.u2, self.anonymous_user):
+            assign_perm('can_see_forum', user, None)
+            assign_perm('can_read_forum', user, None)
+        assign_perm('can_read_forum', self.g1, self.forum_2, has_perm=False)
+        assign_perm('can_see_forum', self.u2, self.top_level_cat, has_perm=False)
+        assign_perm('can_read_forum', self.anonymous_user, self.top_level_forum, has_perm=False)
+        yield
+        machina_settings.PERMISSION_QUERYSET_MODE = False
+        machina_settings.PERMISSION_CACHE_NAME = None
+        caches['default'].clear()
+
+    def _get_results(self, user):
+        handler = PermissionHandler()
+        return (
+            list(handler.forum_list_filter(Forum.objects.all(), user)),
+            list(handler.get_readable_forums(Forum.objects.all(), user)),
+            list(handler.get_readable_forums(self.forum_2.get_descendants(), user)),
+        )
+
+    def test_returns_the_same_forums_as_the_default_mode(self):
+        for user in (self.u1, self.u2, self.anonymous_user):
+            # Setup
+            expected_results = self._get_results(user)
+            machina_settings.PERMISSION_QUERYSET_MODE = True
+            # Run & check
+            assert self._get_results(user) == expected_results
+            machina_settings.PERMISSION_QUERYSET_MODE = False
+
+    def test_filters_querysets_using_a_subquery(self):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        # Run
+        forums = PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1)
+        # Check
+        assert GrantedForum._meta.db_table in str(forums.query)
+        assert list(forums) == list(
+            PermissionHandler().get_readable_forums(list(Forum.objects.all()), self.u1))
+
+    def test_materializes_the_granted_forums_once_per_permission_generation(self):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        rows_count = GrantedForum.objects.count()
+        # Run & check
+        list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        assert GrantedForum.objects.count() == rows_count
+        assign_perm('can_read_forum', self.u1, self.forum_2)
+        forums = list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        assert self.forum_2 in forums
+        # The rows of the previous generation are kept, the older ones are deleted.
+        assert GrantedForum.objects.count() == rows_count + len(forums) + 1
+        remove_perm('can_read_forum', self.u1, self.forum_2)
+        previous_forums = forums
+        forums = list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        assert self.forum_2 not in forums
+        assert GrantedForum.objects.count() == len(previous_forums) + 1 + len(forums) + 1
+
+    def test_keeps_the_granted_forums_of_the_previous_generation(self):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        forums = PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1)
+        expected_forums = list(forums)
+        # Run
+        # The permissions of another user are modified while the queryset is not evaluated yet.
+        assign_perm('can_read_forum', self.u2, self.forum_2, has_perm=False)
+        list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u2))
+        # Check
+        assert list(forums.all()) == expected_forums
+
+    def test_can_materialize_granted_forums_concurrently(self):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        expected_forums = list(
+            PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        rows_count = GrantedForum.objects.count()
+        # Another process started to materialize the same granted forums before they were committed.
+        profile_key = GrantedForum.objects.values_list('profile_key', flat=True).first()
+        GrantedForum.objects.filter(forum__isnull=True).delete()
+        caches['default'].delete(
+            '{}:granted_forums:{}'.format(permission_cache.key_prefix, profile_key),
+        )
+        # Run
+        forums = list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+        # Check
+        assert forums == expected_forums
+        assert GrantedForum.objects.count() == rows_count
+
+    def test_does_not_reuse_the_granted_forums_materialized_before_a_commit(
+            self, django_capture_on_commit_callbacks):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        assign_perm('can_read_forum', self.u1, self.forum_2)
+        assert self.forum_2 in PermissionHandler().get_readable_forums(
+            Forum.objects.all(), self.u1)
+        # Run
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                remove_perm('can_read_forum', self.u1, self.forum_2)
+                list(PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1))
+                # A request running before the commit materializes the granted forums from the
+                # permission rows that were not modified yet.
+                profile_keys = set(GrantedForum.objects.values_list('profile_key', flat=True))
+                GrantedForum.objects.bulk_create([
+                    GrantedForum(
+                        profile_key=profile_key, generation=permission_cache.get_generation(),
+                        forum=self.forum_2,
+                    )
+                    for profile_key in profile_keys
+                ])
+        # Check
+        assert self.forum_2 not in PermissionHandler().get_readable_forums(
+            Forum.objects.all(), self.u1)
+
+    def test_cannot_be_used_without_the_permission_cache(self):
+        # Setup
+        machina_settings.PERMISSION_QUERYSET_MODE = True
+        machina_settings.PERMISSION_CACHE_NAME = None
+        # Run & check
+        with pytest.raises(ImproperlyConfigured):
+            PermissionHandler().get_readable_forums(Forum.objects.all(), self.u1)
+
+
+@pytest.mark.django_db
+class TestPermissionHandlerAsync(object):
+    FORUM_METHODS = [
+        'can_read_forum', 'can_add_topic', 'can_add_stickies', 'can_add_announcements',
+        'can_post_without_approval', 'can_create_polls', 'can_attach_files', 'can_download_files',
+        'can_lock_topics', 'can_move_topics', 'can_delete_topics',
+        'can_update_topics_to_normal_topics', 'can_update_topics_to_sticky_topics',
+        'can_update_topics_to_announces', 'can_approve_posts',
+    ]
+
+    @pytest.fixture(autouse=True, params=[None, 'default'])
+    def setup(self, request):
+        machina_settings.PERMISSION_CACHE_NAME = request.param
+        caches['default'].clear()
+        self.u1 = UserFactory.create()
+        self.u2 = UserFactory.create()
+        self.g1 = GroupFactory.create()
+        self.u1.groups.add(self.g1)
+        self.anonymous_user = AnonymousUser()
+
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.top_level_forum = create_forum()
+
+        self.topic = create_topic(forum=self.forum_1, poster=self.u1)
+        self.post = PostFactory.create(topic=self.topic, poster=self.u1)
+        self.poll = TopicPollFactory.create(topic=self.topic, max_options=2)
+        TopicPollOptionFactory.create(poll=self.poll)
+
+        for target in (self.g1, self.u2, self.anonymous_user):
+            assign_perm('can_see_forum', target, None)
+            assign_perm('can_read_forum', target, None)
+        for codename in ('can_start_new_topics', 'can_reply_to_topics', 'can_edit_own_posts',
+                         'can_vote_in_polls', 'can_delete_own_posts', 'can_lock_topics',
+                         'can_approve_posts', 'can_move_topics'):
+            assign_perm(codename, self.g1, self.forum_1)
+        assign_perm('can_vote_in_polls', self.anonymous_user, None)
+        assign_perm('can_read_forum', self.g1, self.forum_2, has_perm=False)
+        assign_perm('can_see_forum', self.u2, self.top_level_cat, has_perm=False)
+        yield
+        machina_settings.PERMISSION_CACHE_NAME = None
+        caches['default'].clear()
+
+    def _get_objects(self):
+        # The objects are fetched again so that their relations are not cached.
+        return {
+            'forums': list(Forum.objects.all()),
+            'topic': Topic.objects.get(pk=self.topic.pk),
+            'post': Post.objects.get(pk=self.post.pk),
+            'poll': self.poll.__class__.objects.get(pk=self.poll.pk),
+        }
+
+    def _get_checks(self):
+        objects = self._get_objects()
+        checks = [(method, forum) for method in self.FORUM_METHODS for forum in objects['forums']]
+        checks += [
+            ('can_add_post', objects['topic']),
+            ('can_subscribe_to_topic', objects['topic']),
+            ('can_unsubscribe_from_topic', objects['topic']),
+            ('can_edit_post', objects['post']),
+            ('can_delete_post', objects['post']),
+            ('can_vote_in_poll', objects['poll']),
+        ]
+        return checks
+
+    @pytest.mark.parametrize('user_attr', ['u1', 'u2', 'anonymous_user'])
+    def test_permission_methods_return_the_same_results_as_their_sync_versions(self, user_attr):
+        # Setup
+        user = getattr(self, user_attr)
+        expected = [
+            getattr(PermissionHandler(), method)(obj, user) for method, obj in self._get_checks()
+        ]
+        # Run
+        results = [
+            async_to_sync(getattr(PermissionHandler(), 'a' + method))(obj, user)
+            for method, obj in self._get_checks()
+        ]
+        # Check
+        assert results == expected
+
+    @pytest.mark.parametrize('user_attr', ['u1', 'u2', 'anonymous_user'])
+    def test_can_return_the_readable_forums(self, user_attr):
+        # Setup
+        user = getattr(self, user_attr)
+        handler = PermissionHandler()
+        expected = (
+            list(handler.forum_list_filter(Forum.objects.all(), user)),
+            list(handler.get_readable_forums(Forum.objects.all(), user)),
+            handler.get_readable_forums(list(Forum.objects.all()), user),
+            list(handler.get_moderation_queue_forums(user)),
+            handler.can_access_moderation_queue(user),
+            list(handler.get_target_forums_for_moved_topics(user)),
+        )
+        handler = PermissionHandler()
+        forums = list(Forum.objects.all())
+
+        async def run():
+            return (
+                [f async for f in await handler.aforum_list_filter(Forum.objects.all(), user)],
+                [f async for f in await handler.aget_readable_forums(Forum.objects.all(), user)],
+                await handler.aget_readable_forums(forums, user),
+                list(await handler.aget_moderation_queue_forums(user)),
+                await handler.acan_access_moderation_queue(user),
+                list(await handler.aget_target_forums_for_moved_topics(user)),
+            )
+
+        # Run
+        results = async_to_sync(run)()
+        # Check
+        assert results == expected
+
+    def test_can_evaluate_many_permission_checks_at_once(self):
+        # Setup
+        expected = PermissionHandler().get_permissions(self._get_checks(), self.u1)
+        # Run
+        results = async_to_sync(PermissionHandler().aget_permissions)(self._get_checks(), self.u1)
+        # Check
+        assert list(results.values()) == list(expected.values())
+
+    def test_cannot_evaluate_asynchronous_methods_as_permission_checks(self):
+        # Run & check
+        with pytest.raises(ValueError):
+            async_to_sync(PermissionHandler().aget_permissions)(
+                [('acan_read_forum', self.forum_1)], self.u1,
+            )
+
+
+class TestPermissionHandlerTreeFiltering(object):
+    def _build_forums(self, trees_count):
+        # Each tree contains a root, 9 children and 10 grandchildren per child.
+        forums = []
+        forum_id = 0
+        for tree_id in range(1, trees_count + 1):
+            forum_id += 1
+            root = Forum(id=forum_id, tree_id=tree_id, level=0, lft=1, rght=200)
+            forums.append(root)
+            lft = 2
+            for _ in range(9):
+                forum_id += 1
+                child = Forum(
+                    id=forum_id, parent_id=root.id, tree_id=tree_id, level=1, lft=lft,
+                    rght=lft + 21)
+                forums.append(child)
+                for i in range(10):
+                    forum_id += 1
+                    forums.append(Forum(
+                        id=forum_id, parent_id=child.id, tree_id=tree_id, level=2,
+                        lft=lft + 1 + 2 * i, rght=lft + 2 + 2 * i))
+                lft += 22
+        return forums
+
+    def _filter(self, forums, granted_forums):
+        handler = PermissionHandler()
+        handler._all_forums = forums
+        return handler._filter_granted_forums_using_tree(granted_forums)
+
+    def test_keeps_only_the_granted_forums_whose_ancestors_are_granted(self):
+        # Setup
+        forums = self._build_forums(20)
+        rng = random.Random(0)
+        granted_forums = [f for f in forums if rng.random() < 0.9]
+        granted_forum_ids = {f.id for f in granted_forums}
+        forums_by_id = {f.id: f for f in forums}
+
+        def has_granted_ancestors(forum):
+            while forum.parent_id is not None:
+                forum = forums_by_id[forum.parent_id]
+                if forum.id not in granted_forum_ids:
+                    return False
+            return True
+
+        # Run
+        allowed_forums = self._filter(list(reversed(forums)), granted_forums)
+        # Check
+        assert allowed_forums == [
+            f for f in forums if f.id in granted_forum_ids and has_granted_ancestors(f)
+        ]
+
+    # Each tree contains 100 forums: up to 20 000 forums are considered.
+    @pytest.mark.parametrize('trees_count', [2, 20, 200])
+    def test_visits_each_forum_only_once(self, trees_count):
+        # Setup
+        class VisitCountingList(list):
+            visits = 0
+
+            def __iter__(self):
+                for item in super().__iter__():
+                    self.visits += 1
+                    yield item
+
+        forums = VisitCountingList(self._build_forums(trees_count))
+        granted_forums = VisitCountingList(f for f in forums if f.id % 7)
+        forums.visits = 0
+        # Run
+        self._filter(forums, granted_forums)
+        # Check
+        # The filtering is linear: neither the forums nor the granted forums are walked again for
+        # each forum.
+        assert forums.visits == len(forums)
+        assert granted_forums.visits == len(granted_forums)
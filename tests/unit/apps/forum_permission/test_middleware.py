@@ -0,0 +1,65 @@
+from unittest import mock
+
+import pytest
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from machina.apps.forum_permission.handler import PermissionHandler
+from machina.apps.forum_permission.middleware import ForumPermissionMiddleware
+from machina.apps.forum_permission.shortcuts import get_anonymous_user_forum_key
+
+
+@pytest.mark.django_db
+class TestForumPermissionMiddleware(object):
+    def process(self, view, cookies=None):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        middleware = SessionMiddleware(
+            AuthenticationMiddleware(ForumPermissionMiddleware(view)),
+        )
+        return request, middleware(request)
+
+    def test_does_not_write_the_session_of_anonymous_users_browsing_the_forum(self):
+        # Setup
+        def view(request):
+            assert get_anonymous_user_forum_key(request.user, create=False) is None
+            return HttpResponse()
+        # Run
+        request, response = self.process(view)
+        # Check
+        assert not request.session.modified
+        assert settings.SESSION_COOKIE_NAME not in response.cookies
+
+    def test_generates_the_forum_key_of_anonymous_users_when_it_is_needed(self):
+        # Setup
+        forum_keys = []
+
+        def view(request):
+            forum_keys.append(get_anonymous_user_forum_key(request.user))
+            forum_keys.append(get_anonymous_user_forum_key(request.user, create=False))
+            return HttpResponse()
+        # Run
+        _, response = self.process(view)
+        self.process(view, cookies={
+            settings.SESSION_COOKIE_NAME: response.cookies[settings.SESSION_COOKIE_NAME].value,
+        })
+        # Check
+        assert forum_keys[0] is not None
+        assert forum_keys == [forum_keys[0]] * 4
+
+    def test_instantiates_the_permission_handler_only_if_it_is_used(self):
+        # Setup
+        def view(request):
+            return HttpResponse()
+        # Run
+        with mock.patch.object(
+            PermissionHandler, '__init__', autospec=True, side_effect=PermissionHandler.__init__,
+        ) as handler_init:
+            request, _ = self.process(view)
+            assert handler_init.call_count == 0
+            assert request.forum_permission_handler.get_readable_forums([], request.user) == []
+        # Check
+        assert handler_init.call_count == 1
@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from machina.apps.forum_permission.handler import PermissionHandler
+from machina.apps.forum_permission.middleware import ForumPermissionMiddleware
+from machina.apps.forum_permission.registry import get_permission_handler
+
+
+@pytest.mark.django_db
+class TestPermissionHandlerRegistry(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.request = RequestFactory().get('/')
+        self.request.user = AnonymousUser()
+        self.request.session = SessionStore()
+        self.handlers = []
+
+    def get_response(self, request):
+        self.handlers.append(get_permission_handler())
+        return HttpResponse()
+
+    def test_returns_the_permission_handler_of_the_request_being_processed(self):
+        # Run
+        ForumPermissionMiddleware(self.get_response)(self.request)
+        # Check
+        assert self.handlers == [self.request.forum_permission_handler]
+        assert get_permission_handler() is not self.request.forum_permission_handler
+
+    def test_returns_the_permission_handler_of_the_request_being_processed_asynchronously(self):
+        # Setup
+        async def get_response(request):
+            return self.get_response(request)
+
+        # Run
+        asyncio.run(ForumPermissionMiddleware(get_response)(self.request))
+        # Check
+        assert self.handlers == [self.request.forum_permission_handler]
+
+    def test_returns_a_new_permission_handler_outside_of_requests(self):
+        # Run & check
+        handler = get_permission_handler()
+        assert isinstance(handler, PermissionHandler)
+        assert get_permission_handler() is not handler
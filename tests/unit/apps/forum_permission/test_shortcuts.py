@@ -0,0 +1,142 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import transaction
+
+from machina.apps.forum_permission.cache import cache
+from machina.apps.forum_permission.models import (
+    ForumPermission, GroupForumPermission, UserForumPermission
+)
+from machina.apps.forum_permission.shortcuts import (
+    ALL_AUTHENTICATED_USERS, assign_perm, assign_perms, copy_perms, remove_perms, set_perms
+)
+from machina.conf import settings as machina_settings
+from machina.test.factories import GroupFactory, UserFactory, create_category_forum, create_forum
+
+
+@pytest.mark.django_db
+class TestBulkPermissionShortcuts(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.PERMISSION_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.user = UserFactory.create()
+        self.groups = [GroupFactory.create() for _ in range(5)]
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.codenames = list(ForumPermission.objects.values_list('codename', flat=True))
+        yield
+        machina_settings.PERMISSION_CACHE_NAME = None
+        caches['default'].clear()
+
+    def test_can_assign_many_permissions_using_a_constant_number_of_queries(
+            self, django_assert_max_num_queries):
+        # Setup
+        assign_perm('can_read_forum', self.groups[0], self.forum_1, has_perm=False)
+        generation = cache.get_generation()
+        # Run
+        with django_assert_max_num_queries(7):
+            assign_perms(self.codenames, self.groups, [self.forum_1, self.forum_2])
+        # Check
+        assert GroupForumPermission.objects.filter(has_perm=True).count() == \
+            len(self.codenames) * len(self.groups) * 2
+        assert cache.get_generation() == generation + 1
+
+    def test_can_assign_permissions_to_users(self):
+        # Run
+        assign_perms(
+            ['can_read_forum'], [self.user, AnonymousUser(), ALL_AUTHENTICATED_USERS],
+            has_perm=False,
+        )
+        # Check
+        assert UserForumPermission.objects.filter(
+            forum__isnull=True, has_perm=False, permission__codename='can_read_forum',
+        ).count() == 3
+        assert UserForumPermission.objects.filter(user=self.user).exists()
+        assert UserForumPermission.objects.filter(anonymous_user=True).exists()
+        assert UserForumPermission.objects.filter(authenticated_user=True).exists()
+
+    def test_cannot_assign_unknown_permissions(self):
+        # Run & check
+        with pytest.raises(ForumPermission.DoesNotExist):
+            assign_perms(['unknown'], [self.user])
+
+    def test_can_remove_many_permissions(self):
+        # Setup
+        assign_perms(['can_read_forum', 'can_see_forum'], self.groups + [self.user], [self.forum_1])
+        assign_perms(['can_read_forum'], self.groups)
+        generation = cache.get_generation()
+        # Run
+        remove_perms(['can_read_forum'], self.groups + [self.user], [self.forum_1])
+        # Check
+        assert cache.get_generation() == generation + 1
+        assert not GroupForumPermission.objects.filter(
+            forum=self.forum_1, permission__codename='can_read_forum').exists()
+        assert not UserForumPermission.objects.filter(
+            forum=self.forum_1, permission__codename='can_read_forum').exists()
+        assert GroupForumPermission.objects.filter(forum__isnull=True).count() == 5
+        assert GroupForumPermission.objects.filter(forum=self.forum_1).count() == 5
+
+    def test_can_set_the_permissions_of_a_target(self):
+        # Setup
+        assign_perm('can_read_forum', self.user, self.forum_1)
+        assign_perm('can_see_forum', self.user, self.forum_1, has_perm=False)
+        generation = cache.get_generation()
+        # Run
+        set_perms(self.user, self.forum_1, {
+            'can_read_forum': None, 'can_see_forum': True, 'can_start_new_topics': False,
+        })
+        # Check
+        assert cache.get_generation() == generation + 1
+        assert dict(
+            UserForumPermission.objects.filter(user=self.user)
+            .values_list('permission__codename', 'has_perm')
+        ) == {'can_see_forum': True, 'can_start_new_topics': False}
+
+    def test_invalidates_the_cached_permissions_once_the_changes_are_committed(
+            self, django_capture_on_commit_callbacks):
+        # Run
+        with django_capture_on_commit_callbacks(execute=True):
+            with transaction.atomic():
+                set_perms(self.user, self.forum_1, {'can_read_forum': False})
+                copy_perms(self.forum_1, [self.forum_2])
+                # A request running before the commit caches the previous permissions under the
+                # current generation.
+                generation = cache.get_generation()
+        # Check
+        assert cache.get_generation() > generation
+
+    def test_can_copy_the_permissions_of_a_forum(self):
+        # Setup
+        assign_perm('can_read_forum', self.user, self.forum_1, has_perm=False)
+        assign_perm('can_read_forum', ALL_AUTHENTICATED_USERS, self.forum_1)
+        assign_perm('can_see_forum', self.groups[0], self.forum_1)
+        assign_perm('can_see_forum', self.groups[0], self.forum_2, has_perm=False)
+        assign_perm('can_start_new_topics', self.groups[1], self.forum_2)
+        generation = cache.get_generation()
+        # Run
+        copy_perms(self.forum_1, [self.forum_2, self.top_level_cat])
+        # Check
+        assert cache.get_generation() == generation + 1
+        for forum in (self.forum_2, self.top_level_cat):
+            assert UserForumPermission.objects.filter(
+                forum=forum, user=self.user, has_perm=False).exists()
+            assert UserForumPermission.objects.filter(
+                forum=forum, authenticated_user=True, has_perm=True).exists()
+            assert GroupForumPermission.objects.filter(
+                forum=forum, group=self.groups[0], has_perm=True).exists()
+        assert GroupForumPermission.objects.filter(
+            forum=self.forum_2, group=self.groups[1]).exists()
+
+    def test_can_copy_the_permissions_of_a_forum_using_a_management_command(self):
+        # Setup
+        assign_perm('can_see_forum', self.groups[0], self.top_level_cat)
+        generation = cache.get_generation()
+        # Run
+        call_command('copy_forum_permissions', self.top_level_cat.id, self.top_level_cat.id,
+                     '--descendants')
+        # Check
+        assert cache.get_generation() == generation + 1
+        assert GroupForumPermission.objects.filter(group=self.groups[0]).count() == 3
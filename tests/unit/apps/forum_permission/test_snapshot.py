@@ -0,0 +1,106 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+
+from machina.apps.forum_permission.cache import cache
+from machina.apps.forum_permission.checker import ForumPermissionChecker
+from machina.apps.forum_permission.handler import PermissionHandler
+from machina.apps.forum_permission.shortcuts import assign_perm
+from machina.apps.forum_permission.snapshot import snapshot
+from machina.conf import settings as machina_settings
+from machina.test.factories import GroupFactory, create_forum
+
+
+@pytest.mark.django_db
+class TestAnonymousPermissionSnapshot(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = 60
+        self.user = AnonymousUser()
+        self.forum_1 = create_forum()
+        self.forum_2 = create_forum()
+        assign_perm('can_see_forum', self.user, None)
+        assign_perm('can_read_forum', self.user, None)
+        assign_perm('can_read_forum', self.user, self.forum_2, has_perm=False)
+        yield
+        machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = None
+        machina_settings.PERMISSION_CACHE_NAME = None
+        caches['default'].clear()
+        snapshot.invalidate()
+
+    def test_is_disabled_by_default(self, django_assert_num_queries):
+        # Setup
+        machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = None
+        ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+        # Run & check
+        assert not snapshot.enabled
+        with django_assert_num_queries(1):
+            assert ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+
+    def test_allows_to_check_permissions_without_queries(self, django_assert_num_queries):
+        # Setup
+        ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_1)
+        # Run & check
+        with django_assert_num_queries(0):
+            checker = ForumPermissionChecker(self.user)
+            assert checker.has_perm('can_read_forum', self.forum_1)
+            assert not checker.has_perm('can_read_forum', self.forum_2)
+            assert checker.has_perm('can_see_forum', self.forum_2)
+
+    def test_allows_to_compute_readable_forums_without_permission_queries(
+            self, django_assert_num_queries):
+        # Setup
+        PermissionHandler().get_readable_forums([self.forum_1, self.forum_2], self.user)
+        # Run & check
+        with django_assert_num_queries(1):  # The forums are fetched.
+            readable_forums = PermissionHandler().get_readable_forums(
+                [self.forum_1, self.forum_2], self.user)
+        assert readable_forums == [self.forum_1]
+
+    def test_is_invalidated_when_the_permissions_of_the_anonymous_user_change(self):
+        # Setup
+        assert not ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_2)
+        assert PermissionHandler().get_readable_forums(
+            [self.forum_1, self.forum_2], self.user) == [self.forum_1]
+        # Run
+        assign_perm('can_read_forum', self.user, self.forum_2, has_perm=True)
+        # Check
+        assert ForumPermissionChecker(self.user).has_perm('can_read_forum', self.forum_2)
+        assert PermissionHandler().get_readable_forums(
+            [self.forum_1, self.forum_2], self.user) == [self.forum_1, self.forum_2]
+
+    def test_is_not_invalidated_when_group_permissions_change(self):
+        # Setup
+        data = snapshot.get()
+        # Run
+        assign_perm('can_read_forum', GroupFactory.create(), self.forum_2)
+        # Check
+        assert snapshot.get() is data
+
+    def test_is_invalidated_when_a_forum_is_created(self):
+        # Setup
+        assert PermissionHandler().get_readable_forums(
+            [self.forum_1, self.forum_2], self.user) == [self.forum_1]
+        # Run
+        forum_3 = create_forum()
+        # Check
+        assert PermissionHandler().get_readable_forums(
+            [self.forum_1, self.forum_2, forum_3], self.user) == [self.forum_1, forum_3]
+
+    def test_expires_after_the_configured_timeout(self):
+        # Setup
+        data = snapshot.get()
+        machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = 0
+        # Run & check
+        assert snapshot.get() is not data
+
+    def test_relies_on_the_generation_of_the_permission_cache_if_it_is_enabled(self):
+        # Setup
+        machina_settings.ANONYMOUS_PERMISSION_SNAPSHOT_TIMEOUT = None
+        machina_settings.PERMISSION_CACHE_NAME = 'default'
+        data = snapshot.get()
+        # Run & check
+        assert snapshot.enabled
+        assert snapshot.get() is data
+        cache.bump_generation()
+        assert snapshot.get() is not data
@@ -0,0 +1,187 @@
+import datetime as dt
+import random
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+from machina.test.factories import (
+    ForumReadTrackFactory, GroupFactory, PostFactory, TopicReadTrackFactory, UserFactory,
+    create_category_forum, create_forum, create_topic
+)
+
+
+Forum = get_model('forum', 'Forum')
+ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+Topic = get_model('forum_conversation', 'Topic')
+TopicReadState = get_model('forum_tracking', 'TopicReadState')
+TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+
+assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
+CompactTrackingBackend = get_class('forum_tracking.backends', 'CompactTrackingBackend')
+TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
+
+ROW_BACKEND = 'machina.apps.forum_tracking.backends.RowTrackingBackend'
+COMPACT_BACKEND = 'machina.apps.forum_tracking.backends.CompactTrackingBackend'
+
+
+@pytest.mark.django_db
+class TestCompactTrackingBackend(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.u1 = UserFactory.create()
+        self.row_user = UserFactory.create()
+        self.compact_user = UserFactory.create()
+        self.g1 = GroupFactory.create()
+        for user in (self.u1, self.row_user, self.compact_user):
+            user.groups.add(self.g1)
+
+        self.tracks_handler = TrackingHandler()
+
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_1_child = create_forum(parent=self.forum_1)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.forums = [self.top_level_cat, self.forum_1, self.forum_1_child, self.forum_2]
+
+        self.topics = []
+        for forum in self.forums[1:]:
+            for _ in range(3):
+                topic = create_topic(forum=forum, poster=self.u1)
+                PostFactory.create(topic=topic, poster=self.u1)
+                self.topics.append(topic)
+
+        for forum in self.forums:
+            assign_perm('can_read_forum', self.g1, forum)
+        yield
+        machina_settings.TRACKING_BACKEND = ROW_BACKEND
+
+    def run_with(self, backend, func, *args):
+        machina_settings.TRACKING_BACKEND = backend
+        try:
+            return func(*args)
+        finally:
+            machina_settings.TRACKING_BACKEND = ROW_BACKEND
+
+    def get_read_state(self, user, backend):
+        topics = Topic.objects.order_by('pk')
+        return (
+            self.run_with(backend, self.tracks_handler.get_unread_topics, topics, user),
+            self.run_with(backend, self.tracks_handler.get_unread_forums, user),
+            set(ForumReadTrack.objects.filter(user=user).values_list('forum_id', flat=True)),
+        )
+
+    def test_can_store_the_topic_read_marks_of_a_forum_in_a_single_row(self):
+        # Setup
+        state = TopicReadState(user=self.u1, forum=self.forum_1)
+        mark_time = now().replace(microsecond=123456)
+        # Run
+        state.set_marks({
+            self.topics[1].id: mark_time, self.topics[0].id: mark_time - dt.timedelta(days=1),
+        })
+        state.update_marks({
+            self.topics[0].id: mark_time - dt.timedelta(days=2), self.topics[2].id: mark_time,
+        })
+        state.save()
+        # Check
+        state = TopicReadState.objects.get(pk=state.pk)
+        assert len(bytes(state.marks)) == 3 * 16
+        assert state.get_marks() == {
+            self.topics[0].id: mark_time - dt.timedelta(days=1),
+            self.topics[1].id: mark_time,
+            self.topics[2].id: mark_time,
+        }
+
+    @pytest.mark.parametrize('seed', range(4))
+    def test_considers_the_same_topics_as_unread_as_the_row_backend(self, seed):
+        # Setup
+        rng = random.Random(seed)
+        reference = now()
+        for topic in self.topics:
+            Topic.objects.filter(pk=topic.pk).update(
+                created=reference - dt.timedelta(hours=rng.randint(10, 20)),
+                last_post_on=rng.choice([None, reference - dt.timedelta(hours=rng.randint(0, 9))]),
+            )
+        for forum in self.forums:
+            if rng.random() < 0.7:
+                mark_time = reference - dt.timedelta(hours=rng.randint(0, 20))
+                for user in (self.row_user, self.compact_user):
+                    track = ForumReadTrackFactory.create(forum=forum, user=user)
+                    ForumReadTrack.objects.filter(pk=track.pk).update(mark_time=mark_time)
+        marks = {
+            topic.id: reference - dt.timedelta(hours=rng.randint(0, 20))
+            for topic in self.topics if rng.random() < 0.5
+        }
+        for topic_id, mark_time in marks.items():
+            track = TopicReadTrack.objects.create(topic_id=topic_id, user=self.row_user)
+            TopicReadTrack.objects.filter(pk=track.pk).update(mark_time=mark_time)
+        CompactTrackingBackend().upsert_topic_marks(
+            {(self.compact_user.id, topic_id): mark_time for topic_id, mark_time in marks.items()},
+        )
+        topics = Topic.objects.order_by('pk')
+        # Run
+        row_unread_topics = self.run_with(
+            ROW_BACKEND, self.tracks_handler.get_unread_topics, topics, self.row_user)
+        compact_unread_topics = self.run_with(
+            COMPACT_BACKEND, self.tracks_handler.get_unread_topics, topics, self.compact_user)
+        compact_queryset = self.run_with(
+            COMPACT_BACKEND, self.tracks_handler.get_unread_topics_queryset, self.compact_user)
+        # Check
+        assert compact_unread_topics == row_unread_topics
+        assert set(compact_queryset) == set(row_unread_topics)
+        assert not TopicReadTrack.objects.filter(user=self.compact_user).exists()
+
+    def test_produces_the_same_read_state_as_the_row_backend(self):
+        # Setup
+        PostFactory.create(topic=self.topics[0], poster=self.u1)
+        ForumReadTrackFactory.create(forum=self.forum_2, user=self.row_user)
+        ForumReadTrackFactory.create(forum=self.forum_2, user=self.compact_user)
+        PostFactory.create(topic=self.topics[-1], poster=self.u1)
+        # Run & check
+        steps = [
+            (self.tracks_handler.mark_topic_read, self.topics[3]),
+            (self.tracks_handler.mark_topic_read, self.topics[-1]),
+            (self.tracks_handler.mark_topic_read, self.topics[0]),
+            (self.tracks_handler.mark_topic_read, self.topics[4]),
+            (self.tracks_handler.mark_topic_read, self.topics[5]),
+            (self.tracks_handler.mark_forums_read, [self.forum_1]),
+        ]
+        for func, arg in steps:
+            self.run_with(ROW_BACKEND, func, arg, self.row_user)
+            self.run_with(COMPACT_BACKEND, func, arg, self.compact_user)
+            assert self.get_read_state(self.compact_user, COMPACT_BACKEND) == \
+                self.get_read_state(self.row_user, ROW_BACKEND)
+        assert self.forum_1_child.id in self.get_read_state(self.compact_user, COMPACT_BACKEND)[2]
+        assert not TopicReadState.objects.filter(
+            user=self.compact_user, forum__in=[self.forum_1, self.forum_1_child]).exists()
+
+    def test_can_mark_topics_read_asynchronously(self):
+        # Setup
+        topics = list(Topic.objects.filter(forum=self.forum_2).order_by('pk'))
+        machina_settings.TRACKING_BACKEND = COMPACT_BACKEND
+        # Run
+        async_to_sync(self.tracks_handler.amark_topic_read)(topics[0], self.compact_user)
+        # Check
+        assert async_to_sync(self.tracks_handler.aget_unread_topics)(
+            topics, self.compact_user) == topics[1:]
+        for topic in topics[1:]:
+            async_to_sync(self.tracks_handler.amark_topic_read)(topic, self.compact_user)
+        assert ForumReadTrack.objects.filter(
+            forum=self.forum_2, user=self.compact_user).exists()
+        assert not TopicReadState.objects.exists()
+
+    def test_can_migrate_the_topic_tracks_using_a_management_command(self):
+        # Setup
+        for topic in self.topics[:5]:
+            TopicReadTrackFactory.create(topic=topic, user=self.row_user)
+        unread_topics = self.get_read_state(self.row_user, ROW_BACKEND)[0]
+        # Run
+        call_command('migrate_topic_tracks', '--batch-size', 2, '--delete')
+        # Check
+        assert not TopicReadTrack.objects.exists()
+        assert TopicReadState.objects.filter(user=self.row_user).count() == 2
+        assert self.get_read_state(self.row_user, COMPACT_BACKEND)[0] == unread_topics
@@ -0,0 +1,237 @@
+import datetime as dt
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.utils.timezone import now
+
+from machina.conf import settings as machina_settings
+from machina.core.db.models import get_model
+from machina.core.loading import get_class
+from machina.test.factories import (
+    ForumReadTrackFactory, GroupFactory, PostFactory, UserFactory, create_category_forum,
+    create_forum, create_topic
+)
+
+
+ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
+
+assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
+TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
+update_user_trackers = get_class('forum_tracking.receivers', 'update_user_trackers')
+
+read_mark_buffer = get_class('forum_tracking.buffer', 'read_mark_buffer')
+
+
+@pytest.mark.django_db
+class TestReadMarkBuffer(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.TRACKING_BUFFER_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.u1 = UserFactory.create()
+        self.u2 = UserFactory.create()
+        self.u3 = UserFactory.create()
+        self.g1 = GroupFactory.create()
+        for user in (self.u1, self.u2, self.u3):
+            user.groups.add(self.g1)
+
+        self.tracks_handler = TrackingHandler()
+
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_1_child = create_forum(parent=self.forum_1)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+
+        self.topics = []
+        for forum in (self.forum_1, self.forum_1_child, self.forum_1_child, self.forum_2):
+            topic = create_topic(forum=forum, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+            self.topics.append(topic)
+
+        for forum in (self.top_level_cat, self.forum_1, self.forum_1_child, self.forum_2):
+            assign_perm('can_read_forum', self.g1, forum)
+        yield
+        machina_settings.TRACKING_BUFFER_CACHE_NAME = None
+        caches['default'].clear()
+
+    def get_tracks(self, user):
+        return (
+            set(ForumReadTrack.objects.filter(user=user).values_list('forum_id', flat=True)),
+            set(TopicReadTrack.objects.filter(user=user).values_list('topic_id', flat=True)),
+        )
+
+    def test_returns_the_buffered_marks_in_order(self):
+        # Setup
+        for topic in self.topics:
+            read_mark_buffer.add(topic, self.u2)
+        batches = []
+        # Run
+        assert read_mark_buffer.flush(batches.append, batch_size=3) == 4
+        # Check
+        assert [[mark[1] for mark in batch] for batch in batches] == [
+            [t.id for t in self.topics[:3]], [self.topics[3].id],
+        ]
+        assert read_mark_buffer.flush(batches.append) == 0
+        assert len(batches) == 2
+
+    def test_keeps_the_marks_if_they_cannot_be_written(self):
+        # Setup
+        read_mark_buffer.add(self.topics[0], self.u2)
+
+        def apply(marks):
+            raise ValueError
+
+        # Run
+        with pytest.raises(ValueError):
+            read_mark_buffer.flush(apply)
+        # Check
+        assert self.tracks_handler.flush_read_marks() == 1
+        assert read_mark_buffer.get_overlay(self.u2) == {}
+        assert self.tracks_handler.get_unread_topics(self.topics, self.u2) == self.topics[1:]
+
+    def test_does_not_go_past_a_mark_that_is_not_stored_yet(self):
+        # Setup
+        backend = caches['default']
+        read_mark_buffer.add(self.topics[0], self.u2)
+        # The index of a mark is reserved by another process which did not store the mark yet.
+        backend.incr(read_mark_buffer.sequence_key)
+        read_mark_buffer.add(self.topics[1], self.u2)
+        batches = []
+        # Run & check
+        assert read_mark_buffer.flush(batches.append) == 1
+        assert read_mark_buffer.flush(batches.append) == 0
+        backend.set(read_mark_buffer._get_entry_key(2), (self.u3.pk, self.topics[2].pk, now()))
+        assert read_mark_buffer.flush(batches.append) == 2
+        assert [[mark[1] for mark in batch] for batch in batches] == [
+            [self.topics[0].id], [self.topics[2].id, self.topics[1].id],
+        ]
+
+    def test_skips_the_marks_that_are_missing_for_too_long(self, monkeypatch):
+        # Setup
+        backend = caches['default']
+        # The index of a mark is reserved by a process which never stored the mark.
+        backend.add(read_mark_buffer.sequence_key, 0, timeout=None)
+        backend.incr(read_mark_buffer.sequence_key)
+        read_mark_buffer.add(self.topics[1], self.u2)
+        batches = []
+        assert read_mark_buffer.flush(batches.append) == 0
+        # Run
+        monkeypatch.setattr(read_mark_buffer, 'missing_timeout', 0)
+        # Check
+        assert read_mark_buffer.flush(batches.append) == 1
+        assert [[mark[1] for mark in batch] for batch in batches] == [[self.topics[1].id]]
+
+    def test_cannot_be_flushed_concurrently(self):
+        # Setup
+        read_mark_buffer.add(self.topics[0], self.u2)
+        caches['default'].add(read_mark_buffer.lock_key, 'other-process')
+        # Run & check
+        assert self.tracks_handler.flush_read_marks() == 0
+        caches['default'].delete(read_mark_buffer.lock_key)
+        assert self.tracks_handler.flush_read_marks() == 1
+
+    def test_removes_the_flushed_marks_from_the_overlay(self):
+        # Setup
+        mark_time = now()
+        read_mark_buffer.add(self.topics[0], self.u2, mark_time)
+        read_mark_buffer.add(self.topics[1], self.u2, mark_time)
+        # Run
+        self.tracks_handler.flush_read_marks()
+        read_mark_buffer.add(self.topics[2], self.u2, mark_time)
+        # Check
+        assert read_mark_buffer.get_overlay(self.u2) == {self.topics[2].id: mark_time}
+        assert self.tracks_handler.get_unread_topics(self.topics, self.u2) == [self.topics[3]]
+
+    def test_keeps_a_bounded_number_of_marks_in_the_overlay(self, monkeypatch):
+        # Setup
+        monkeypatch.setattr(read_mark_buffer, 'overlay_size', 2)
+        mark_time = now()
+        # Run
+        for i, topic in enumerate(self.topics):
+            read_mark_buffer.add(topic, self.u2, mark_time + dt.timedelta(seconds=i))
+        # Check
+        assert set(read_mark_buffer.get_overlay(self.u2)) == {t.id for t in self.topics[2:]}
+
+    def test_defers_the_read_marks_of_topic_views(self):
+        # Run
+        update_user_trackers(
+            sender=None, topic=self.topics[0], user=self.u2, request=None, response=None)
+        # Check
+        assert not TopicReadTrack.objects.exists()
+        assert self.tracks_handler.get_unread_topics(self.topics, self.u2) == self.topics[1:]
+        assert set(self.tracks_handler.get_unread_topics_queryset(self.u2)) == set(self.topics[1:])
+        assert self.tracks_handler.get_unread_topics(self.topics, self.u3) == self.topics
+
+    def test_does_not_display_the_forums_read_by_a_user_as_unread_before_the_flush(self):
+        # Run
+        self.tracks_handler.buffer_topic_read(self.topics[3], self.u2)
+        self.tracks_handler.buffer_topic_read(self.topics[0], self.u2)
+        # Check
+        # The first forum still contains unread topics through its child forum.
+        unread_forums = [self.top_level_cat, self.forum_1, self.forum_1_child]
+        assert self.tracks_handler.get_unread_forums(self.u2) == unread_forums
+        assert async_to_sync(self.tracks_handler.aget_unread_forums)(self.u2) == unread_forums
+        assert self.tracks_handler.get_unread_forums(self.u3) == unread_forums + [self.forum_2]
+        self.tracks_handler.flush_read_marks()
+        assert self.tracks_handler.get_unread_forums(self.u2) == unread_forums
+
+    def test_does_not_consider_the_topics_updated_since_they_were_read(self):
+        # Setup
+        self.tracks_handler.buffer_topic_read(self.topics[3], self.u2)
+        # Run
+        PostFactory.create(topic=self.topics[3], poster=self.u1)
+        # Check
+        assert self.tracks_handler.get_unread_topics(self.topics, self.u2) == self.topics
+        assert self.forum_2 in self.tracks_handler.get_unread_forums(self.u2)
+
+    def test_produces_the_same_tracks_as_immediate_read_marks_once_flushed(self):
+        # Setup
+        ForumReadTrackFactory.create(forum=self.forum_2, user=self.u2)
+        ForumReadTrackFactory.create(forum=self.forum_2, user=self.u3)
+        PostFactory.create(topic=self.topics[3], poster=self.u1)
+        viewed_topics = [self.topics[1], self.topics[2], self.topics[1], self.topics[3]]
+        for topic in viewed_topics:
+            self.tracks_handler.mark_topic_read(topic, self.u2)
+        # Run
+        for topic in viewed_topics:
+            self.tracks_handler.buffer_topic_read(topic, self.u3)
+        call_command('flush_read_marks', '--batch-size', 3)
+        # Check
+        assert self.get_tracks(self.u3) == self.get_tracks(self.u2)
+        assert self.forum_1_child.id in self.get_tracks(self.u3)[0]
+        assert read_mark_buffer.flush(lambda marks: None) == 0
+
+    def test_coalesces_the_marks_of_the_same_topic(self):
+        # Setup
+        mark_time = now() + dt.timedelta(hours=1)
+        read_mark_buffer.add(self.topics[1], self.u2, mark_time - dt.timedelta(minutes=5))
+        read_mark_buffer.add(self.topics[1], self.u2, mark_time)
+        read_mark_buffer.add(self.topics[1], self.u2, mark_time - dt.timedelta(minutes=10))
+        # Run
+        assert self.tracks_handler.flush_read_marks() == 3
+        # Check
+        assert list(TopicReadTrack.objects.values_list('topic_id', 'mark_time')) == [
+            (self.topics[1].id, mark_time),
+        ]
+
+    def test_writes_the_marks_using_a_constant_number_of_queries(
+            self, django_assert_max_num_queries):
+        # Setup
+        for _ in range(10):
+            topic = create_topic(forum=self.forum_2, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+            self.tracks_handler.buffer_topic_read(topic, self.u2)
+        # Run & check
+        with django_assert_max_num_queries(16):  # The batch is written in a savepoint.
+            self.tracks_handler.flush_read_marks()
+        assert TopicReadTrack.objects.filter(user=self.u2).count() == 10
+
+    def test_cannot_be_flushed_if_it_is_not_enabled(self):
+        # Setup
+        machina_settings.TRACKING_BUFFER_CACHE_NAME = None
+        # Run & check
+        with pytest.raises(CommandError):
+            call_command('flush_read_marks')
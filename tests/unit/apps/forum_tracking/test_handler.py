@@ -1,9 +1,21 @@
+import datetime as dt
+import random
+import time
+
 import pytest
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user
 from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection
 from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 from faker import Faker
 
+from machina.apps.forum_tracking.management.commands.machina_compact_tracks import (
+    Command as CompactTracksCommand
+)
 from machina.core.db.models import get_model
 from machina.core.loading import get_class
 from machina.test.factories import (
@@ -16,12 +28,15 @@ faker = Faker()
 
 Forum = get_model('forum', 'Forum')
 ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
+Topic = get_model('forum_conversation', 'Topic')
 TopicReadTrack = get_model('forum_tracking', 'TopicReadTrack')
 
 assign_perm = get_class('forum_permission.shortcuts', 'assign_perm')
 PermissionHandler = get_class('forum_permission.handler', 'PermissionHandler')
 TrackingHandler = get_class('forum_tracking.handler', 'TrackingHandler')
 
+forum_tree = get_class('forum.tree', 'forum_tree')
+
 
 @pytest.mark.django_db
 class TestTrackingHandler(object):
@@ -151,6 +166,105 @@ class TestTrackingHandler(object):
         assert not len(unread_forums)
         assert not len(unread_topics)
 
+    @pytest.mark.parametrize('seed', range(4))
+    def test_annotates_topics_with_their_unread_status(self, seed):
+        # Setup
+        rng = random.Random(seed)
+        reference = now()
+        for forum in (self.forum_1, self.forum_2_child_2, self.forum_3):
+            for _ in range(4):
+                topic = create_topic(forum=forum, poster=self.u1)
+                PostFactory.create(topic=topic, poster=self.u1)
+        topics = list(Topic.objects.order_by('?'))
+        for topic in topics:
+            Topic.objects.filter(pk=topic.pk).update(
+                created=reference - dt.timedelta(hours=rng.randint(10, 20)),
+                last_post_on=rng.choice([None, reference - dt.timedelta(hours=rng.randint(0, 9))]),
+            )
+            if rng.random() < 0.5:
+                track = TopicReadTrackFactory.create(topic=topic, user=self.u2)
+                TopicReadTrack.objects.filter(pk=track.pk).update(
+                    mark_time=reference - dt.timedelta(hours=rng.randint(0, 20)))
+        ForumReadTrack.objects.filter(user=self.u2).delete()
+        for forum in (self.forum_1, self.forum_2, self.forum_2_child_2):
+            track = ForumReadTrackFactory.create(forum=forum, user=self.u2)
+            ForumReadTrack.objects.filter(pk=track.pk).update(
+                mark_time=reference - dt.timedelta(hours=rng.randint(0, 20)))
+        topics = [Topic.objects.get(pk=topic.pk) for topic in topics]
+        topic_tracks = dict(
+            TopicReadTrack.objects.filter(user=self.u2).values_list('topic_id', 'mark_time'))
+        forum_tracks = dict(
+            ForumReadTrack.objects.filter(user=self.u2).values_list('forum_id', 'mark_time'))
+
+        def is_unread(topic):
+            mark_time = topic_tracks.get(topic.id, forum_tracks.get(topic.forum_id))
+            return mark_time is None or (topic.last_post_on or topic.created) > mark_time
+
+        # Run
+        annotated_topics = self.tracks_handler.annotate_unread_topics(
+            Topic.objects.filter(pk__in=[t.pk for t in topics]), self.u2)
+        # Check
+        assert {t.pk: t.is_unread for t in annotated_topics} == {t.pk: is_unread(t) for t in topics}
+        assert self.tracks_handler.get_unread_topics(topics, self.u2) == \
+            [t for t in topics if is_unread(t)]
+
+    def test_can_return_the_unread_topics_of_annotated_topics_without_queries(
+            self, django_assert_num_queries):
+        # Setup
+        new_topic = create_topic(forum=self.forum_2, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        topics = list(self.tracks_handler.annotate_unread_topics(
+            self.forum_2.topics.order_by('pk'), self.u2))
+        # Run & check
+        with django_assert_num_queries(0):
+            assert self.tracks_handler.get_unread_topics(topics, self.u2) == [new_topic]
+        assert not any(
+            t.is_unread for t in self.tracks_handler.annotate_unread_topics(
+                self.forum_2.topics.all(), AnonymousUser())
+        )
+
+    def test_can_return_the_unread_topics_of_the_readable_forums(self):
+        # Setup
+        new_topics = [create_topic(forum=forum, poster=self.u1) for forum in (
+            self.forum_1, self.forum_2, self.forum_3, self.forum_4)]
+        for topic in new_topics:
+            PostFactory.create(topic=topic, poster=self.u1)
+        PostFactory.create(
+            topic=create_topic(forum=self.forum_1, poster=self.u1), poster=self.u1, approved=False)
+        # Run & check
+        assert set(self.tracks_handler.get_unread_topics_queryset(self.u2)) == \
+            {new_topics[0], new_topics[1]}
+        assert self.tracks_handler.get_unread_topics_count(self.u2) == 2
+        assert self.tracks_handler.get_unread_topics_count(self.u2, limit=1) == 1
+        assert self.tracks_handler.get_unread_topics_count(AnonymousUser()) == 0
+
+    def test_uses_the_current_trackers_of_the_forums_of_the_tree_snapshot(self):
+        # Setup
+        assert not self.tracks_handler.get_unread_forums(self.u2)
+        new_topic = create_topic(forum=self.forum_2, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        # Run
+        unread_forums = self.tracks_handler.get_unread_forums(self.u2)
+        # Check
+        assert unread_forums == [self.top_level_cat_1, self.forum_2]
+
+    def test_does_not_filter_the_forums_of_the_tree_snapshot_by_id(self):
+        # Setup
+        forum_tree.get()
+        forum_table = connection.ops.quote_name(Forum._meta.db_table)
+        # Run
+        with CaptureQueriesContext(connection) as context:
+            unread_forums = self.tracks_handler.get_unread_forums(self.u2)
+        # Check
+        assert unread_forums == []
+        forum_queries = [
+            query['sql'] for query in context.captured_queries
+            if 'FROM {}'.format(forum_table) in query['sql']
+        ]
+        assert forum_queries
+        assert all(' IN (' not in sql for sql in forum_queries)
+        assert async_to_sync(self.tracks_handler.aget_unread_forums)(self.u2) == []
+
     def test_cannot_say_that_a_forum_is_unread_if_it_has_been_updated_without_new_topics_or_posts(self):  # noqa
         # Setup
         self.forum_2.save()
@@ -221,6 +335,40 @@ class TestTrackingHandler(object):
         assert ForumReadTrack.objects.filter(user=self.u2).count() == 3
         assert not TopicReadTrack.objects.filter(user=self.u2).exists()
 
+    def test_marks_topics_read_using_a_number_of_queries_independent_of_the_forum_depth(self):
+        # Setup
+        def measure(depth):
+            user = UserFactory.create()
+            forum = create_category_forum()
+            for _ in range(depth):
+                forum = create_forum(parent=forum)
+            topic = create_topic(forum=forum, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+            topic = Topic.objects.select_related('forum').get(pk=topic.pk)
+            with CaptureQueriesContext(connection) as context:
+                self.tracks_handler.mark_topic_read(topic, user)
+            # All the ancestors are marked as read.
+            assert ForumReadTrack.objects.filter(user=user).count() == depth + 1
+            return len(context.captured_queries)
+
+        # Run & check
+        assert measure(2) == measure(8)
+
+    def test_stops_marking_ancestors_as_read_at_the_first_one_with_unread_topics(self):
+        # Setup
+        forum_2_topic = create_topic(forum=self.forum_2, poster=self.u1)
+        PostFactory.create(topic=forum_2_topic, poster=self.u1)
+        TopicReadTrackFactory.create(topic=self.topic, user=self.u2)
+        PostFactory.create(topic=self.topic, poster=self.u1)
+        new_topic = create_topic(forum=self.forum_2_child_2, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        # Run
+        self.tracks_handler.mark_topic_read(new_topic, self.u2)
+        # Check
+        assert set(ForumReadTrack.objects.filter(user=self.u2).values_list('forum', flat=True)) \
+            == {self.forum_2.id, self.forum_2_child_2.id}
+        assert self.topic in self.tracks_handler.get_unread_topics([self.topic], self.u2)
+
     def test_cannot_mark_topics_read_for_anonymous_users(self):
         # Setup
         new_topic = create_topic(forum=self.forum_2, poster=self.u1)
@@ -232,3 +380,182 @@ class TestTrackingHandler(object):
         # Check
         assert ForumReadTrack.objects.count() == initial_forum_read_tracks_count
         assert TopicReadTrack.objects.count() == initial_topics_read_tracks_count
+
+    def test_can_mark_forums_read_asynchronously(self):
+        # Setup
+        new_topic = create_topic(forum=self.forum_2_child_2, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        assert async_to_sync(self.tracks_handler.aget_unread_forums)(self.u2) == \
+            self.tracks_handler.get_unread_forums(self.u2)
+        # Run
+        async_to_sync(self.tracks_handler.amark_forums_read)(Forum.objects.all(), self.u2)
+        # Check
+        assert async_to_sync(self.tracks_handler.aget_unread_forums)(self.u2) == []
+        assert ForumReadTrack.objects.filter(user=self.u2).count() == 8
+
+    def test_can_mark_topics_read_asynchronously(self):
+        # Setup
+        new_topic = create_topic(forum=self.forum_2_child_2, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        topics = Topic.objects.filter(forum=self.forum_2_child_2)
+        assert async_to_sync(self.tracks_handler.aget_unread_topics)(topics, self.u2) == \
+            self.tracks_handler.get_unread_topics(topics, self.u2) == [new_topic]
+        # Run
+        # The forum of the topic is not loaded yet.
+        async_to_sync(self.tracks_handler.amark_topic_read)(
+            Topic.objects.get(pk=new_topic.pk), self.u2,
+        )
+        # Check
+        assert async_to_sync(self.tracks_handler.aget_unread_topics)(topics, self.u2) == []
+        assert list(self.tracks_handler.get_unread_forums(self.u2)) == []
+        assert ForumReadTrack.objects.filter(user=self.u2).count() == 3
+        assert not TopicReadTrack.objects.filter(user=self.u2).exists()
+
+
+@pytest.mark.django_db
+class TestMarkForumsReadBenchmark(object):
+    def measure(self, forums_count):
+        user = UserFactory.create()
+        top_level_cat = create_category_forum()
+        forums = [create_forum(parent=top_level_cat) for _ in range(forums_count)]
+        for forum in forums[::2]:
+            ForumReadTrackFactory.create(forum=forum, user=user)
+            TopicReadTrackFactory.create(topic=create_topic(forum=forum, poster=user), user=user)
+        forums = list(Forum.objects.filter(id__in=[f.id for f in forums]))
+
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            TrackingHandler().mark_forums_read(forums, user)
+            duration = time.perf_counter() - start
+
+        assert ForumReadTrack.objects.filter(user=user).count() == forums_count + 1
+        assert not TopicReadTrack.objects.filter(user=user).exists()
+        assert ForumReadTrack.objects.filter(
+            user=user, forum__in=forums).values('mark_time').distinct().count() == 1
+        return len(context.captured_queries), duration
+
+    def test_marks_forums_read_using_a_constant_number_of_queries(self):
+        # Run
+        results = {forums_count: self.measure(forums_count) for forums_count in (5, 50)}
+        # Check
+        assert results[5][0] == results[50][0]
+        # Each forum used to require several queries: 10 times more forums would be 10 times slower.
+        assert results[50][1] < results[5][1] * 10
+
+
+@pytest.mark.django_db
+class TestCompactTracksCommand(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.u1 = UserFactory.create(last_login=now())
+        self.u2 = UserFactory.create(last_login=now() - dt.timedelta(days=400))
+        self.top_level_cat = create_category_forum()
+        self.forum_1 = create_forum(parent=self.top_level_cat)
+        self.forum_2 = create_forum(parent=self.top_level_cat)
+        self.topics = []
+        for forum in (self.forum_1, self.forum_1, self.forum_2, self.forum_2):
+            topic = create_topic(forum=forum, poster=self.u1)
+            PostFactory.create(topic=topic, poster=self.u1)
+            self.topics.append(topic)
+
+    def create_track(self, factory, mark_time, **kwargs):
+        track = factory.create(**kwargs)
+        type(track).objects.filter(pk=track.pk).update(mark_time=mark_time)
+
+    def test_deletes_the_topic_tracks_covered_by_forum_tracks(self):
+        # Setup
+        reference = now()
+        for user in (self.u1, self.u2):
+            self.create_track(ForumReadTrackFactory, reference, forum=self.forum_1, user=user)
+            for topic, hours in zip(self.topics, (-2, 1, -1, -3)):
+                self.create_track(
+                    TopicReadTrackFactory, reference + dt.timedelta(hours=hours),
+                    topic=topic, user=user,
+                )
+        # Run
+        call_command('machina_compact_tracks', '--batch-size', 1)
+        # Check
+        for user in (self.u1, self.u2):
+            assert set(TopicReadTrack.objects.filter(user=user).values_list('topic', flat=True)) \
+                == {self.topics[1].id, self.topics[2].id, self.topics[3].id}
+
+    def test_can_collapse_the_topic_tracks_of_inactive_users_into_forum_tracks(self):
+        # Setup
+        reference = now() - dt.timedelta(days=300)
+        self.create_track(ForumReadTrackFactory, reference, forum=self.forum_1, user=self.u2)
+        for user in (self.u1, self.u2):
+            for topic, hours in zip(self.topics, (1, 2, -3, -1)):
+                self.create_track(
+                    TopicReadTrackFactory, reference + dt.timedelta(hours=hours),
+                    topic=topic, user=user,
+                )
+        # Run
+        call_command('machina_compact_tracks', '--inactive-days', 365)
+        # Check
+        assert not TopicReadTrack.objects.filter(user=self.u2).exists()
+        assert TopicReadTrack.objects.filter(user=self.u1).count() == 4
+        assert dict(
+            ForumReadTrack.objects.filter(user=self.u2).values_list('forum_id', 'mark_time')
+        ) == {
+            self.forum_1.id: reference + dt.timedelta(hours=2),
+            self.forum_2.id: reference - dt.timedelta(hours=1),
+        }
+        assert not ForumReadTrack.objects.filter(user=self.u1).exists()
+
+    def test_collapses_the_topic_tracks_of_users_who_never_logged_in(self):
+        # Setup
+        u3 = UserFactory.create(last_login=None)
+        reference = now() - dt.timedelta(days=300)
+        self.create_track(TopicReadTrackFactory, reference, topic=self.topics[0], user=u3)
+        # Run
+        call_command('machina_compact_tracks', '--inactive-days', 365)
+        # Check
+        assert not TopicReadTrack.objects.filter(user=u3).exists()
+        assert ForumReadTrack.objects.get(user=u3).mark_time == reference
+
+    def test_never_moves_the_forum_tracks_of_inactive_users_backward(self):
+        # Setup
+        reference = now() - dt.timedelta(days=300)
+        self.create_track(ForumReadTrackFactory, reference, forum=self.forum_1, user=self.u2)
+        marks = {
+            (self.u2.id, self.forum_1.id): reference - dt.timedelta(hours=1),
+            (self.u2.id, self.forum_2.id): reference - dt.timedelta(hours=2),
+        }
+        # Run
+        CompactTracksCommand()._upsert_forum_tracks(marks)
+        # Check
+        assert dict(
+            ForumReadTrack.objects.filter(user=self.u2).values_list('forum_id', 'mark_time')
+        ) == {
+            self.forum_1.id: reference,
+            self.forum_2.id: reference - dt.timedelta(hours=2),
+        }
+
+    def test_never_changes_the_unread_topics_of_inactive_users(self):
+        # Setup
+        reference = now() - dt.timedelta(days=300)
+        updates = (-48, -1, 2, 5)
+        for topic, hours in zip(self.topics, updates):
+            Topic.objects.filter(pk=topic.pk).update(
+                last_post_on=reference + dt.timedelta(hours=hours),
+            )
+        # The first topic is never read, the second one is read, the third one is read before its
+        # last update and the last one is read after its last update.
+        for topic, hours in zip(self.topics[1:], (0, 1, 6)):
+            self.create_track(
+                TopicReadTrackFactory, reference + dt.timedelta(hours=hours),
+                topic=topic, user=self.u2,
+            )
+        topics = Topic.objects.filter(pk__in=[topic.pk for topic in self.topics])
+        unread_topics = TrackingHandler().get_unread_topics(topics, self.u2)
+        # Run
+        call_command('machina_compact_tracks', '--inactive-days', 365)
+        # Check
+        assert TrackingHandler().get_unread_topics(topics, self.u2) == unread_topics
+        assert {topic.id for topic in unread_topics} == {self.topics[0].id, self.topics[2].id}
+        assert set(
+            TopicReadTrack.objects.filter(user=self.u2).values_list('topic_id', flat=True)
+        ) == {self.topics[1].id, self.topics[2].id}
+        assert dict(
+            ForumReadTrack.objects.filter(user=self.u2).values_list('forum_id', 'mark_time')
+        ) == {self.forum_2.id: reference + dt.timedelta(hours=6)}
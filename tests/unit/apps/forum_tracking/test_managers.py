@@ -7,6 +7,7 @@ from machina.test.factories import (
 )
 
 
+Forum = get_model('forum', 'Forum')
 ForumReadTrack = get_model('forum_tracking', 'ForumReadTrack')
 
 
@@ -87,3 +88,17 @@ class TestForumReadTrackManager(object):
             self.u1)
         # Check
         assert self.forum_2_child_2 not in unread_forums
+
+    def test_returns_the_unread_forums_in_the_order_of_the_list_using_a_single_query(
+            self, django_assert_num_queries):
+        # Setup
+        PostFactory.create(topic=self.topic, poster=self.u1)
+        new_topic = create_topic(forum=self.forum_4, poster=self.u1)
+        PostFactory.create(topic=new_topic, poster=self.u1)
+        forums = list(Forum.objects.all())
+        # Run & check
+        with django_assert_num_queries(1):
+            unread_forums = ForumReadTrack.objects.get_unread_forums_from_list(forums, self.u2)
+        assert unread_forums == [
+            self.top_level_cat_1, self.forum_2, self.top_level_cat_2, self.forum_4,
+        ]
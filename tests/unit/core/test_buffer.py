@@ -0,0 +1,73 @@
+import pytest
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from machina.conf import settings as machina_settings
+from machina.core.buffer import CacheBuffer
+
+
+class DummyBuffer(CacheBuffer):
+    cache_name_setting = 'COUNTER_BUFFER_CACHE_NAME'
+    verbose_name = 'dummy buffer'
+    key_prefix = 'machina:tests:dummy'
+
+    def __init__(self):
+        self.flushed_batches = []
+
+    def add(self, entry):
+        self._append(self.get_backend(), entry)
+
+    def _on_batch_flushed(self, backend, entries):
+        self.flushed_batches.append(entries)
+
+
+@pytest.mark.django_db
+class TestCacheBuffer(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = 'default'
+        caches['default'].clear()
+        self.buffer = DummyBuffer()
+        yield
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = None
+        caches['default'].clear()
+
+    def test_flushes_the_entries_by_batches_in_the_order_in_which_they_were_appended(self):
+        # Setup
+        for entry in range(5):
+            self.buffer.add(entry)
+        batches = []
+        # Run & check
+        assert self.buffer.flush(batches.append, batch_size=2, max_batches=2) == 4
+        assert self.buffer.flush(batches.append, batch_size=2) == 1
+        assert batches == [[0, 1], [2, 3], [4]]
+        assert self.buffer.flushed_batches == batches
+        assert self.buffer.flush(batches.append) == 0
+
+    def test_keeps_the_entries_of_a_batch_that_cannot_be_applied(self):
+        # Setup
+        self.buffer.add(0)
+
+        def apply(entries):
+            raise ValueError
+
+        batches = []
+        # Run & check
+        with pytest.raises(ValueError):
+            self.buffer.flush(apply)
+        assert self.buffer.flush(batches.append) == 1
+        assert batches == [[0]]
+
+    def test_is_disabled_if_no_cache_is_configured(self):
+        # Setup
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = None
+        # Run & check
+        assert not self.buffer.enabled
+        assert self.buffer.get_backend() is None
+
+    def test_should_raise_if_the_cache_backend_is_not_configured(self):
+        # Setup
+        machina_settings.COUNTER_BUFFER_CACHE_NAME = 'dummy'
+        # Run & check
+        with pytest.raises(ImproperlyConfigured):
+            self.buffer.get_backend()